@@ -1 +1 @@
-from . import forcesLib, geometryLib, plotLib, runSimulator, simulatorLib
+from . import cacheLib, catalogLib, decimationLib, forcesLib, framesLib, geometryLib, jacobianLib, jobsLib, logLib, modelLib, pacingLib, plotLib, profileLib, resultsLib, runSimulator, simulatorLib, solverLib, statsLib
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import forcesLib
+import geometryLib
+import jacobianLib
+import modelLib
+import resultsLib
+import simulatorLib
+import solverLib
+import statsLib
+
+# Cache of the stored results (see resultsLib) of finished simulations, so
+# identical requests are replayed instead of simulated again. Entries are
+# addressed by a hash of everything the results depend on: the parsed
+# request (see simulatorLib.from_json), the physics and solver constants
+# below and the code of the simulation modules. The cache lives in a
+# directory, one result directory per entry, and evicts the least recently
+# used entries once it holds more than max_bytes.
+
+# Constants of each module the results depend on
+physics_constants = {
+    'forcesLib': (forcesLib, ['water_entering_position_matter', 'rho', 'g', 'mass_per_meter_of_spring', 'kappa',
+                              'kappa_ground', 'epsilon_ground', 'W']),
+    'simulatorLib': (simulatorLib, ['damping']),
+    'solverLib': (solverLib, ['xtol', 'ftol', 'max_newton_iterations', 'armijo', 'min_step_length',
+                              'slowdown_ratio', 'max_broyden_updates'])
+}
+
+# Modules whose code the results depend on
+simulation_modules = [forcesLib, geometryLib, jacobianLib, modelLib, simulatorLib, solverLib]
+
+default_cache_directory = 'result_cache'
+default_max_bytes = 1 << 30
+
+code_versions = {}
+
+
+# Hash of the code of the simulation modules, computed once per process
+def code_version():
+    if 'simulation' not in code_versions:
+        digest = hashlib.sha256()
+        for module in simulation_modules:
+            with open(module.__file__, 'rb') as f:
+                digest.update(f.read())
+        code_versions['simulation'] = digest.hexdigest()
+
+    return code_versions['simulation']
+
+
+def constants():
+    return {name: {constant: getattr(module, constant) for constant in names}
+            for name, (module, names) in physics_constants.items()}
+
+
+# Everything the results of a request, as parsed by simulatorLib.from_json,
+# depend on, in a canonical form: the same simulation gives the same inputs
+# however its request was written (e.g. '0.01' or 0.01 as time step)
+def cache_inputs(request):
+    model, hw, water_speed, time_step, max_iterations, method = request
+
+    return {
+        'verteces': model.V.astype(float).tolist(),
+        'edges': model.E.astype(int).tolist(),
+        'vertexTypes': model.VP.astype(int).tolist(),
+        'edgeTypes': model.EP.astype(int).tolist(),
+        'edgeLengths': model.EL.astype(float).tolist(),
+        'vertexBoyantRadiai': model.VBR.astype(float).tolist(),
+        'waterLevel': float(hw),
+        'waterSpeed': water_speed,
+        'timeStep': time_step,
+        'maxIterations': max_iterations,
+        'simulationMethod': method,
+        'constants': constants(),
+        'codeVersion': code_version()
+    }
+
+
+# Key of the results of a parsed request (see cache_inputs), or None if they
+# cannot be cached (runs without a maximum of iterations never complete)
+def cache_key(request):
+    inputs = cache_inputs(request)
+    if inputs['maxIterations'] is None:
+        return None
+
+    canonical = json.dumps(inputs, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+# Copies the results at source to destination. Files are hard linked when
+# possible: resultsLib replaces files rather than writing them in place, so
+# the copies never change behind each other's back.
+def copy_results(source, destination):
+    shutil.copytree(source, destination, copy_function=link_or_copy, dirs_exist_ok=True)
+
+
+def directory_size(path):
+    size = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            size += os.path.getsize(os.path.join(directory, name))
+
+    return size
+
+
+# Batches of the results stored at path, one per chunk, as the integrators
+# emit them (see simulatorLib.record_batch): with the summary statistics so
+# far, and no telemetry since nothing was simulated
+# noinspection PyPep8Naming
+def replay(path, model, total_steps):
+    reader = resultsLib.ResultReader(path)
+    statistics = statsLib.SummaryStatistics.default(model)
+    for chunk in reader.chunks:
+        start, stop = chunk['start'], chunk['start'] + chunk['steps']
+        P, F, wl = reader.positions(start, stop), reader.forces(start, stop), reader.water_level(start, stop)
+        statistics.update(start, P, F, wl)
+        yield P, F, wl, total_steps, {'statistics': statistics.summary(), 'telemetry': None}
+
+
+# The cache itself. Entries are only added whole (copied aside and then
+# renamed) and only removed whole (renamed aside and then deleted), so
+# several processes can share it; the modification time of an entry is its
+# last use.
+class ResultCache(object):
+    def __init__(self, directory=default_cache_directory, max_bytes=default_max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key)
+
+    # Path of the complete results of key, or None if not cached
+    def lookup(self, key):
+        path = self.entry_path(key)
+        try:
+            if not resultsLib.read_metadata(path)['complete']:
+                return None
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+
+        return path
+
+    # Copies the complete results of key to destination, which must not
+    # exist, returning whether they were cached. The copy is made aside and
+    # only renamed to destination if the entry was not evicted meanwhile, as
+    # it could then be missing files.
+    def copy_out(self, key, destination):
+        path = self.lookup(key)
+        if path is None:
+            return False
+
+        temporary_path = os.path.join(os.path.dirname(os.path.abspath(destination)), '.' + uuid.uuid4().hex)
+        try:
+            copy_results(path, temporary_path)
+            if not os.path.isdir(path):
+                raise FileNotFoundError(path)
+            os.rename(temporary_path, destination)
+        except OSError:
+            shutil.rmtree(temporary_path, ignore_errors=True)
+            return False
+
+        return True
+
+    # Adds the complete results at results_path as the ones of key
+    def store(self, key, results_path):
+        if not resultsLib.read_metadata(results_path)['complete']:
+            return
+        if self.lookup(key) is not None:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_path = os.path.join(self.directory, '.' + uuid.uuid4().hex)
+        copy_results(results_path, temporary_path)
+        try:
+            os.rename(temporary_path, self.entry_path(key))
+        except OSError:
+            # someone else cached it meanwhile
+            shutil.rmtree(temporary_path, ignore_errors=True)
+
+        self.evict()
+
+    # Entries as (last use, path, bytes), from the least recently used
+    def entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            try:
+                entries.append((os.path.getmtime(path), path, directory_size(path)))
+            except OSError:
+                pass
+
+        return sorted(entries)
+
+    # Removes the least recently used entries until the cache fits max_bytes
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if total <= self.max_bytes:
+                break
+            evicted_path = os.path.join(self.directory, '.' + uuid.uuid4().hex)
+            try:
+                os.rename(path, evicted_path)
+            except OSError:
+                # someone else evicted it meanwhile
+                pass
+            else:
+                shutil.rmtree(evicted_path, ignore_errors=True)
+            total -= size
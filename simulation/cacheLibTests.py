@@ -0,0 +1,163 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import cacheLib
+import forcesLib
+import numpy as np
+import resultsLib
+import simulatorLib
+
+
+# noinspection PyPep8Naming
+class CacheLibTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = cacheLib.ResultCache(os.path.join(self.directory, 'cache'))
+
+        scenarios_directory = os.path.join(os.path.dirname(__file__), '..', 'scenarios')
+        with open(os.path.join(scenarios_directory, 'boyant_end_split_edges.json')) as data_file:
+            self.scenario = json.load(data_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def request(self, **settings):
+        post_body = dict(self.scenario)
+        post_body.update(settings)
+
+        return post_body
+
+    # Complete results of num_steps random steps, stored as name
+    def writeResults(self, name, num_steps):
+        model, hw = simulatorLib.setup_original_watergate_example7()
+        path = os.path.join(self.directory, name)
+        with resultsLib.ResultWriter(path, model) as writer:
+            writer.append(np.random.rand(num_steps, model.num_v, 2), np.random.rand(num_steps, model.num_v, 10),
+                          np.random.rand(num_steps))
+
+        return path
+
+    @staticmethod
+    def key(post_body):
+        return cacheLib.cache_key(simulatorLib.from_json(post_body))
+
+    def testKeyIgnoresHowTheRequestIsWritten(self):
+        # Arrange
+        request = self.request(timeStep='0.001', maxIterations=100, simulationMethod='Forward Euler')
+        same = self.request(timeStep=0.001, maxIterations='100', simulationMethod='Forward Euler')
+        same['verteces'] = [[float(x), float(y)] for x, y in same['verteces']]
+
+        # Act
+        key = self.key(request)
+        same_key = self.key(same)
+
+        # Assert
+        self.assertEqual(key, same_key)
+        self.assertNotEqual(key, self.key(dict(request, simulationMethod='Backward Euler')))
+        self.assertNotEqual(key, self.key(dict(request, maxIterations=101)))
+        self.assertIsNone(self.key(dict(request, unlimited=True)))
+
+    def testKeyDependsOnThePhysicsConstants(self):
+        # Arrange
+        request = self.request(maxIterations=100)
+        key = self.key(request)
+        kappa = forcesLib.kappa
+
+        # Act
+        try:
+            forcesLib.kappa = 2 * kappa
+            stiffer_key = self.key(request)
+        finally:
+            forcesLib.kappa = kappa
+
+        # Assert
+        self.assertNotEqual(key, stiffer_key)
+        self.assertEqual(key, self.key(request))
+
+    def testStoredResultsAreFoundAndLeastRecentlyUsedEvicted(self):
+        # Arrange
+        first = self.writeResults('first', 200)
+        second = self.writeResults('second', 200)
+        third = self.writeResults('third', 200)
+        self.cache.max_bytes = 2.5 * cacheLib.directory_size(first)
+
+        # Act
+        self.cache.store('a', first)
+        self.cache.store('b', second)
+        old = time.time() - 60
+        os.utime(self.cache.entry_path('a'), (old, old))
+        os.utime(self.cache.entry_path('b'), (old - 60, old - 60))
+        self.cache.lookup('b')
+        self.cache.store('c', third)
+
+        # Assert
+        self.assertIsNone(self.cache.lookup('a'))
+        self.assertIsNotNone(self.cache.lookup('b'))
+        cached = resultsLib.ResultReader(self.cache.lookup('c'))
+        np.testing.assert_array_equal(cached.forces(), resultsLib.ResultReader(third).forces())
+
+    def testCachedResultsAreCopiedOut(self):
+        # Arrange
+        self.cache.store('a', self.writeResults('first', 200))
+        destination = os.path.join(self.directory, 'job')
+
+        # Act
+        copied = self.cache.copy_out('a', destination)
+        missing = self.cache.copy_out('b', os.path.join(self.directory, 'other job'))
+
+        # Assert
+        self.assertTrue(copied)
+        self.assertFalse(missing)
+        np.testing.assert_array_equal(resultsLib.ResultReader(destination).forces(),
+                                      resultsLib.ResultReader(self.cache.entry_path('a')).forces())
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'other job')))
+
+    def testEntriesEvictedWhileCopiedOutAreMisses(self):
+        # Arrange
+        self.cache.store('a', self.writeResults('first', 200))
+        destination = os.path.join(self.directory, 'job')
+        link_or_copy = cacheLib.link_or_copy
+
+        def evictingLinkOrCopy(source, target):
+            self.cache.max_bytes = 0
+            self.cache.evict()
+            link_or_copy(source, target)
+
+        # Act
+        try:
+            cacheLib.link_or_copy = evictingLinkOrCopy
+            copied = self.cache.copy_out('a', destination)
+        finally:
+            cacheLib.link_or_copy = link_or_copy
+
+        # Assert
+        self.assertFalse(copied)
+        self.assertFalse(os.path.exists(destination))
+        self.assertEqual(sorted(os.listdir(self.directory)), ['cache', 'first'])
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+    def testIncompleteResultsAreNotCached(self):
+        # Arrange
+        model, hw = simulatorLib.setup_original_watergate_example7()
+        path = os.path.join(self.directory, 'interrupted')
+        writer = resultsLib.ResultWriter(path, model)
+        writer.append(np.zeros((10, model.num_v, 2)), np.zeros((10, model.num_v, 10)), np.zeros(10))
+        writer.close(complete=False)
+
+        # Act
+        self.cache.store('a', path)
+
+        # Assert
+        self.assertIsNone(self.cache.lookup('a'))
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import numbers
+import os
+import time
+
+import logLib
+
+# Catalog of the scenarios of a directory (one JSON file each, as saved by
+# the client), so listing and loading them does not read the directory on
+# every request. Files are parsed and validated once, and again only when
+# their modification time or size changes; the directory is scanned for
+# changes at most every refresh_interval seconds. Invalid files are left out
+# of the catalog (see errors).
+
+scenario_extension = '.json'
+# the fields simulatorLib.from_json cannot do without
+required_keys = ['verteces', 'edges', 'vertexTypes', 'edgeTypes', 'edgeLengths', 'vertexBoyantRadiai', 'waterLevel']
+default_refresh_interval = 1.0
+
+
+def is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def is_number_list(value, length=None, nullable=False):
+    return (isinstance(value, list) and all(is_number(v) or (nullable and v is None) for v in value) and
+            (length is None or len(value) == length))
+
+
+# Raises ValueError unless scenario is a structure the simulator can load
+def validate_scenario(scenario):
+    if not isinstance(scenario, dict):
+        raise ValueError("A scenario must be an object")
+    missing = [key for key in required_keys if key not in scenario]
+    if len(missing) > 0:
+        raise ValueError("Missing " + ", ".join(missing))
+
+    verteces = scenario['verteces']
+    edges = scenario['edges']
+    if not isinstance(verteces, list) or not all(is_number_list(vertex, 2) for vertex in verteces):
+        raise ValueError("Vertices must be lists of 2 coordinates")
+    if not isinstance(edges, list) or not all(is_number_list(edge, 2) for edge in edges):
+        raise ValueError("Edges must be lists of 2 vertex indices")
+    if not all(isinstance(v, int) and 0 <= v < len(verteces) for edge in edges for v in edge):
+        raise ValueError("Edges must join 2 existing vertices")
+    if not is_number(scenario['waterLevel']):
+        raise ValueError("The water level must be a number")
+    # edges without splits have none
+    for key, length, nullable in [('vertexTypes', len(verteces), False), ('vertexBoyantRadiai', len(verteces), False),
+                                  ('edgeTypes', len(edges), False), ('edgeLengths', len(edges), False),
+                                  ('edgeSplits', len(edges), True)]:
+        if key in scenario and not is_number_list(scenario[key], length, nullable):
+            raise ValueError(f"{key} must be a list of {length} numbers")
+
+
+# A scenario file of the catalog: its parsed scenario, the hash of its
+# content (also its ETag) and a summary of it
+class ScenarioEntry(object):
+    def __init__(self, name, stamp, content):
+        self.name = name
+        self.stamp = stamp
+        self.scenario = json.loads(content)
+        validate_scenario(self.scenario)
+
+        self.hash = hashlib.sha256(content).hexdigest()
+        self.etag = self.hash
+        self.metadata = {
+            'name': name,
+            'vertices': len(self.scenario['verteces']),
+            'edges': len(self.scenario['edges']),
+            'buoys': sum(1 for radius in self.scenario['vertexBoyantRadiai'] if radius > 0),
+            'waterLevel': self.scenario['waterLevel'],
+            'hash': self.hash
+        }
+
+
+# Files that cannot be loaded are logged to logger (by default
+# logLib.default_logger) once per change.
+class ScenarioCatalog(object):
+    def __init__(self, directory, refresh_interval=default_refresh_interval, logger=None):
+        self.directory = directory
+        self.refresh_interval = refresh_interval
+        self.logger = logger if logger is not None else logLib.default_logger
+        self.last_refresh = None
+
+        self.entries = {}
+        self.errors = {}
+        self.scenario_names = []
+        self.scenario_listing = []
+        self.listing_etag = None
+
+        # number of files parsed, for statistics
+        self.files_parsed = 0
+
+        self.refresh(force=True)
+
+    # Scans the directory for new, changed and deleted files, unless it was
+    # scanned less than refresh_interval seconds ago
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self.last_refresh is not None and now - self.last_refresh < self.refresh_interval:
+            return
+        self.last_refresh = now
+
+        entries = {}
+        errors = {}
+        for file in os.scandir(self.directory):
+            if not file.name.endswith(scenario_extension) or not file.is_file():
+                continue
+
+            stat = file.stat()
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            known = self.entries.get(file.name)
+            if known is not None and known.stamp == stamp:
+                entries[file.name] = known
+                continue
+            if file.name in self.errors and self.errors[file.name][0] == stamp:
+                errors[file.name] = self.errors[file.name]
+                continue
+
+            try:
+                with open(file.path, 'rb') as f:
+                    content = f.read()
+                self.files_parsed += 1
+                entries[file.name] = ScenarioEntry(file.name, stamp, content)
+            except (OSError, ValueError, TypeError) as error:
+                errors[file.name] = (stamp, str(error))
+                self.logger.warning('invalid_scenario', file=file.name, error=str(error))
+
+        # swapped at once, so lookups never see a half refreshed catalog
+        names = sorted(entries)
+        if names != self.scenario_names or any(entries[name] is not self.entries.get(name) for name in names):
+            listing = [entries[name].metadata for name in names]
+            digest = hashlib.sha256(json.dumps([[entry['name'], entry['hash']] for entry in listing]).encode())
+            self.scenario_names, self.scenario_listing, self.listing_etag = names, listing, digest.hexdigest()
+        self.entries, self.errors = entries, errors
+
+    # Names of the valid scenarios, sorted
+    def names(self):
+        self.refresh()
+        return self.scenario_names
+
+    # Metadata of the valid scenarios (see ScenarioEntry), sorted by name
+    def listing(self):
+        self.refresh()
+        return self.scenario_listing
+
+    # Entry of the scenario in file name, or None if there is no such valid
+    # scenario
+    def lookup(self, name):
+        self.refresh()
+        return self.entries.get(name)
@@ -0,0 +1,125 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import catalogLib
+import logLib
+
+
+# noinspection PyPep8Naming
+class CatalogLibTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.scenarios_directory = os.path.join(os.path.dirname(__file__), '..', 'scenarios')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def copyScenario(self, name, as_name=None):
+        shutil.copy(os.path.join(self.scenarios_directory, name), os.path.join(self.directory, as_name or name))
+
+    def writeScenario(self, name, scenario, mtime_ns=None):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            json.dump(scenario, f)
+        if mtime_ns is not None:
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def testScenariosAreIndexedWithTheirMetadata(self):
+        # Arrange
+        self.copyScenario('boyant_end_split_edges.json')
+        self.copyScenario('two_ropes.json')
+        self.writeScenario('broken.json', {'verteces': [[0, 0]], 'edges': [[0, 3]], 'vertexTypes': [0],
+                                           'edgeTypes': [0], 'edgeLengths': [1.0], 'vertexBoyantRadiai': [0],
+                                           'waterLevel': 1.0})
+        self.writeScenario('notes.txt', {})
+
+        # Act
+        catalog = catalogLib.ScenarioCatalog(self.directory)
+        entry = catalog.lookup('boyant_end_split_edges.json')
+
+        # Assert
+        self.assertEqual(catalog.names(), ['boyant_end_split_edges.json', 'two_ropes.json'])
+        self.assertEqual((entry.metadata['vertices'], entry.metadata['edges'], entry.metadata['buoys']), (14, 19, 1))
+        self.assertIn('broken.json', catalog.errors)
+        self.assertIsNone(catalog.lookup('broken.json'))
+        self.assertIsNone(catalog.lookup('../requests.jsonl'))
+
+    def testOnlyChangedFilesAreParsedAgain(self):
+        # Arrange
+        scenario = {'verteces': [[0, 0], [1, 0]], 'edges': [[0, 1]], 'vertexTypes': [1, 0], 'edgeTypes': [0],
+                    'edgeLengths': [1.0], 'vertexBoyantRadiai': [0, 0], 'waterLevel': 1.0}
+        self.writeScenario('a.json', scenario, mtime_ns=10 ** 18)
+        self.writeScenario('b.json', scenario, mtime_ns=10 ** 18)
+        catalog = catalogLib.ScenarioCatalog(self.directory, refresh_interval=0.0)
+        etag = catalog.listing_etag
+
+        # Act
+        catalog.refresh()
+        unchanged_parses = catalog.files_parsed
+        unchanged_etag = catalog.listing_etag
+        self.writeScenario('b.json', dict(scenario, waterLevel=2.0), mtime_ns=2 * 10 ** 18)
+        os.remove(os.path.join(self.directory, 'a.json'))
+        listing = catalog.listing()
+
+        # Assert
+        self.assertEqual(unchanged_parses, 2)
+        self.assertEqual(unchanged_etag, etag)
+        self.assertEqual(catalog.files_parsed, 3)
+        self.assertEqual([(entry['name'], entry['waterLevel']) for entry in listing], [('b.json', 2.0)])
+        self.assertNotEqual(catalog.listing_etag, etag)
+
+    def testMalformedFilesAreSkippedAndLogged(self):
+        # Arrange
+        scenario = {'verteces': [[0, 0], [1, 0]], 'edges': [[0, 1]], 'vertexTypes': [1, 0], 'edgeTypes': [0],
+                    'edgeLengths': [1.0], 'vertexBoyantRadiai': [0, 0], 'waterLevel': 1.0}
+        self.writeScenario('valid.json', scenario)
+        self.writeScenario('null_edge.json', dict(scenario, edges=[[0, None]]))
+        self.writeScenario('number_verteces.json', dict(scenario, verteces=5))
+        self.writeScenario('null_radius.json', dict(scenario, vertexBoyantRadiai=[None, 0.1]))
+        self.writeScenario('string_level.json', dict(scenario, waterLevel='high'))
+        events = []
+
+        # Act
+        catalog = catalogLib.ScenarioCatalog(self.directory, refresh_interval=0.0,
+                                             logger=logLib.Logger(sink=events.append))
+        catalog.refresh()
+
+        # Assert
+        malformed = ['null_edge.json', 'null_radius.json', 'number_verteces.json', 'string_level.json']
+        self.assertEqual(catalog.names(), ['valid.json'])
+        self.assertEqual(sorted(catalog.errors), malformed)
+        self.assertEqual(sorted(event['file'] for event in events if event['event'] == 'invalid_scenario'), malformed)
+
+    def testScenariosMissingFieldsOfTheSimulatorAreRejected(self):
+        # Arrange
+        self.copyScenario('single_rope.json')
+
+        # Act
+        catalog = catalogLib.ScenarioCatalog(self.directory, logger=logLib.Logger(sink=lambda event: None))
+
+        # Assert
+        self.assertEqual(catalog.names(), [])
+        self.assertIn('edgeLengths', catalog.errors['single_rope.json'][1])
+
+    def testScansAreRateLimited(self):
+        # Arrange
+        catalog = catalogLib.ScenarioCatalog(self.directory, refresh_interval=1000.0)
+
+        # Act
+        self.copyScenario('two_ropes.json')
+
+        # Assert
+        self.assertEqual(catalog.names(), [])
+        catalog.refresh(force=True)
+        self.assertEqual(catalog.names(), ['two_ropes.json'])
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
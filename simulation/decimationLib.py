@@ -0,0 +1,119 @@
+import time
+
+import numpy as np
+import resultsLib
+
+# Policies choosing which steps of the emitted batches are streamed to the
+# clients, which cannot show more than a few dozen frames per second anyway.
+# They only thin out what is sent: the result store keeps every step. Each
+# policy returns the indices (within the batch) of the steps it keeps, always
+# including the last one, so the clients see the latest state of the run.
+
+
+# Keeps every step
+class KeepAll(object):
+    # noinspection PyPep8Naming
+    def select(self, start, P, F, wl):
+        return np.arange(len(wl))
+
+
+# Keeps every stride-th step of the run
+class KeepEveryNth(object):
+    def __init__(self, stride):
+        if stride < 1:
+            raise ValueError("The stride must be at least 1")
+        self.stride = int(stride)
+
+    # noinspection PyPep8Naming
+    def select(self, start, P, F, wl):
+        first = -start % self.stride
+
+        return with_last(np.arange(first, len(wl), self.stride), len(wl))
+
+
+# Keeps about fps steps per second of simulation (wall time, the pace at which
+# the clients receive them), evenly spread over each batch
+class TargetFrameRate(object):
+    def __init__(self, fps):
+        if fps <= 0:
+            raise ValueError("The frame rate must be positive")
+        self.fps = fps
+        self.last_time = time.perf_counter()
+        self.frames = 0.0
+
+    # noinspection PyPep8Naming
+    def select(self, start, P, F, wl):
+        now = time.perf_counter()
+        self.frames += self.fps * (now - self.last_time)
+        self.last_time = now
+
+        frames = min(max(int(self.frames), 1), len(wl))
+        self.frames = max(self.frames - frames, 0.0)
+
+        return np.unique(np.linspace(len(wl) - 1, 0, frames, endpoint=False).round().astype(int))
+
+
+# Keeps the steps whose peak force (the largest magnitude of the total force
+# over the vertices) changed by more than threshold (relative to the last kept
+# one), and at least every max_stride-th step, so sharp events are kept at
+# full resolution and quiet stretches are thinned out
+class AdaptiveDecimation(object):
+    def __init__(self, threshold=0.05, max_stride=100):
+        if max_stride < 1:
+            raise ValueError("The maximum stride must be at least 1")
+        self.threshold = threshold
+        self.max_stride = int(max_stride)
+        self.kept_peak = None
+        self.kept_step = None
+
+    # noinspection PyPep8Naming
+    def select(self, start, P, F, wl):
+        total = resultsLib.force_components.index('total')
+        peaks = resultsLib.force_magnitudes(F)[:, :, total].max(axis=1)
+
+        kept = []
+        for i, peak in enumerate(peaks):
+            if (self.kept_peak is None or
+                    abs(peak - self.kept_peak) > self.threshold * max(abs(self.kept_peak), 1e-12) or
+                    start + i - self.kept_step >= self.max_stride):
+                kept.append(i)
+                self.kept_peak = peak
+                self.kept_step = start + i
+
+        kept = with_last(np.array(kept, dtype=int), len(wl))
+        if len(kept) > 0:
+            self.kept_peak = peaks[kept[-1]]
+            self.kept_step = start + kept[-1]
+
+        return kept
+
+
+def with_last(indices, length):
+    if length > 0 and (len(indices) == 0 or indices[-1] != length - 1):
+        indices = np.append(indices, length - 1)
+
+    return indices
+
+
+# Policy of a request: its decimation, if any, as a dictionary with the
+# policy ('all', 'stride', 'fps' or 'adaptive') and its settings. Raises
+# ValueError if it is not one.
+def decimation_policy(post_body):
+    settings = post_body.get('decimation') or {'policy': 'all'}
+    if not isinstance(settings, dict):
+        raise ValueError("The decimation must be an object")
+    policy = settings.get('policy', 'all')
+
+    try:
+        if policy == 'all':
+            return KeepAll()
+        if policy == 'stride':
+            return KeepEveryNth(int(settings.get('stride', 10)))
+        if policy == 'fps':
+            return TargetFrameRate(float(settings.get('fps', 30)))
+        if policy == 'adaptive':
+            return AdaptiveDecimation(float(settings.get('threshold', 0.05)), int(settings.get('maxStride', 100)))
+    except TypeError:
+        raise ValueError("Invalid settings of the decimation policy: " + str(policy))
+
+    raise ValueError("Unknown decimation policy: " + str(policy))
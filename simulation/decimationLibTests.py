@@ -0,0 +1,71 @@
+import unittest
+
+import decimationLib
+import numpy as np
+
+
+# noinspection PyPep8Naming
+class DecimationLibTests(unittest.TestCase):
+    # Batch whose total force on its first vertex has the given magnitudes
+    def batchOfPeaks(self, peaks, num_v=3):
+        steps = len(peaks)
+        P = np.zeros((steps, num_v, 2))
+        F = np.zeros((steps, num_v, 10))
+        F[:, 0, 0] = peaks
+        wl = np.zeros(steps)
+
+        return P, F, wl
+
+    def testStrideFollowsTheRunAcrossBatches(self):
+        # Arrange
+        decimation = decimationLib.KeepEveryNth(4)
+        P, F, wl = self.batchOfPeaks(np.zeros(10))
+
+        # Act
+        first = decimation.select(0, P, F, wl)
+        second = decimation.select(10, P, F, wl)
+
+        # Assert
+        self.assertEqual(first.tolist(), [0, 4, 8, 9])
+        self.assertEqual(second.tolist(), [2, 6, 9])
+
+    def testAdaptiveKeepsSharpChanges(self):
+        # Arrange
+        decimation = decimationLib.AdaptiveDecimation(threshold=0.1, max_stride=5)
+        peaks = np.array([1.0, 1.01, 1.02, 1.5, 1.51, 1.52, 1.53, 1.54, 1.55, 1.56, 1.57, 1.58])
+
+        # Act
+        kept = decimation.select(0, *self.batchOfPeaks(peaks))
+
+        # Assert
+        self.assertEqual(kept.tolist(), [0, 3, 8, 11])
+
+    def testFrameRateKeepsFewStepsOfLastBatch(self):
+        # Arrange
+        decimation = decimationLib.TargetFrameRate(30)
+        P, F, wl = self.batchOfPeaks(np.zeros(1000))
+
+        # Act
+        kept = decimation.select(0, P, F, wl)
+
+        # Assert
+        self.assertLess(len(kept), 1000)
+        self.assertEqual(kept[-1], 999)
+        self.assertTrue(np.all(np.diff(kept) > 0))
+
+    def testUnknownPolicyIsRejected(self):
+        # Act & Assert
+        self.assertIsInstance(decimationLib.decimation_policy({}), decimationLib.KeepAll)
+        with self.assertRaises(ValueError):
+            decimationLib.decimation_policy({'decimation': {'policy': 'random'}})
+        for decimation in ['fps', [{'policy': 'fps'}], {'policy': 'stride', 'stride': None}]:
+            with self.assertRaises(ValueError):
+                decimationLib.decimation_policy({'decimation': decimation})
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+import bisect
 import math
 
 import numpy as np
@@ -12,308 +13,197 @@ epsilon_ground = 1e-2
 W = 1.0  # m (width)
 
 
-def ground_collision_jacobian(U, free_vertices, vertex_to_free_vertex):
-    num_free_vertices = len(U)
-    J = np.zeros((4 * num_free_vertices, 4 * num_free_vertices))
+# The jacobian kernels below do not fill a dense matrix. Each returns the
+# triple (rows, cols, blocks), where rows and cols are free vertex indices and
+# blocks[i] is the 2x2 derivative of the force on free vertex rows[i] with
+# respect to the position of free vertex cols[i] (blocks[i][r, c] = dF_r/dp_c).
+# They are assembled into the sparse jacobian by jacobianLib.
 
-    for v in free_vertices:
-        index_free_v = vertex_to_free_vertex[v]
-        y = U[index_free_v, 1]
 
-        if y >= epsilon_ground:
-            continue
+# Joins the four 2x2 blocks coupling the two endpoints of each edge, dropping
+# the ones that involve fixed vertices (free index -1)
+# noinspection PyPep8Naming
+def edge_jacobian_blocks(free_v, free_vj, dFv_dv, dFv_dvj, dFvj_dvj, dFvj_dv):
+    rows = np.concatenate([free_v, free_v, free_vj, free_vj])
+    cols = np.concatenate([free_v, free_vj, free_vj, free_v])
+    blocks = np.concatenate([dFv_dv, dFv_dvj, dFvj_dvj, dFvj_dv]).reshape(-1, 2, 2)
 
-        # compute indices where the jacobian will be filled
-        index_CF = 4 * index_free_v + 2
-        index_v = 4 * index_free_v
-        index_y = index_v + 1
+    keep = (rows >= 0) & (cols >= 0)
 
-        # add derivative to jacobian
-        J[index_CF + 1, index_y] += -kappa_ground
+    return rows[keep], cols[keep], blocks[keep]
 
-    return J
 
-# Compute Jacobian related to boyance forces
+# Compute Jacobian related to ground collision forces. P holds the current
+# positions of all vertices of the model (a modelLib.SimulationModel)
 # noinspection PyPep8Naming
-def buoyancy_jacobian(U, V, VBR, hw, free_vertices, vertex_to_free_vertex):
-    num_free_vertices = len(U)
-    J = np.zeros((4 * num_free_vertices, 4 * num_free_vertices))
+def ground_collision_jacobian(model, P):
+    vertex_to_free_vertex = model.vertex_to_free_vertex
 
-    for i, radius in enumerate(VBR):
+    touching = vertex_to_free_vertex[(P[:, 1] < epsilon_ground) & (vertex_to_free_vertex >= 0)]
 
-        # no point in computing force if no boyance radius or if vertex is fixed
-        if VBR[i] <= 0 or vertex_to_free_vertex[i] < 0:
-            continue
+    blocks = np.zeros((len(touching), 2, 2))
+    blocks[:, 1, 1] = -kappa_ground
 
-        index_free_v = vertex_to_free_vertex[i]
-        y = U[index_free_v, 1]
+    return touching, touching.copy(), blocks
 
-        # also, no point in computing derivative if entire structure is above water level
-        # TODO: is it OK to consider the derivative 0 in a conditional formula like this?
-        # I believe yes, because if we plug y + radius = hw (or y - radius = hw), it results in dF_dy = 0
-        if y + radius <= hw:
-            continue
-        if y - radius >= hw:
-            continue
 
-        # information used while computing derivative
-        squared_radius = radius * radius
-        K = - 2 * rho * g
+# Compute Jacobian related to boyance forces
+# noinspection PyPep8Naming
+def buoyancy_jacobian(model, P, hw):
+    # no point in computing force if no boyance radius or if vertex is fixed
+    buoys = np.nonzero(model.is_buoy & (model.vertex_to_free_vertex >= 0))[0]
+    y = P[buoys, 1]
+    radius = model.VBR[buoys]
 
-        # compute forces
-        dF_dy = np.zeros(2)
-        dF_dy[1] = K * math.sqrt(squared_radius - (hw - y) * (hw - y))
+    # also, no point in computing derivative if entire structure is above water level
+    # TODO: is it OK to consider the derivative 0 in a conditional formula like this?
+    # I believe yes, because if we plug y + radius = hw (or y - radius = hw), it results in dF_dy = 0
+    partial = partially_submerged(y, radius, hw)
 
-        # compute indices where the jacobian will be filled
-        index_F = 4 * index_free_v + 2
-        index_v = 4 * index_free_v
-        index_y = index_v + 1
+    dA_dy = get_submerged_area_derivatives(y[partial], radius[partial], hw)
 
-        # add derivative to jacobian
-        J[index_F:(index_F + 2), index_y] += dF_dy
+    # derivatives only with respect to the y coordinate of the vertex itself
+    rows = model.vertex_to_free_vertex[buoys[partial]]
+    blocks = np.zeros((len(rows), 2, 2))
+    blocks[:, 1, 1] = rho * g * dA_dy
 
-    return J
+    return rows, rows.copy(), blocks
 
 
-# Compute Jacobian related to tensor
+# Compute Jacobian related to tensor. The geometry is the one returned by
+# edge_geometry, which is computed if not given.
 # noinspection PyPep8Naming
-def tensor_jacobian(U, V, E, EP, EL, free_vertices, vertex_to_free_vertex):
-    num_free_vertices = len(U)
-    J = np.zeros((4 * num_free_vertices, 4 * num_free_vertices))
+def tensor_jacobian(model, P, geometry=None):
     Ks = kappa
+    vertex_to_free_vertex = model.vertex_to_free_vertex
 
-    P = V.copy()
-    P[free_vertices] = U[:, 0:2]
-
-    dT_dx = np.zeros(2)
-    dT_dy = np.zeros(2)
-
-    for e, edge in enumerate(E):
-        if EP[e] == 1:
-            continue
-
-        v = edge[0]
-        vj = edge[1]
-
-        index_free_v = vertex_to_free_vertex[v]
-        index_free_vj = vertex_to_free_vertex[vj]
-
-        # no sense in computing anything if vertices are both fixed
-        if index_free_v == -1 and index_free_vj == -1:
-            continue
-
-        # indices of v_ starts at  4*v_ (+ 0,1,2,3). But the forces are in positions 3 and 4 (4*v_ + 2 or 3)
-        # solve for v1:
-        x = P[v][0]
-        y = P[v][1]
-        xj = P[vj][0]
-        yj = P[vj][1]
-
-        # direction v-vj: force leaving vj.
-        delta_x = (x - xj)
-        delta_y = (y - yj)
-
-        # difference_vector = P[v] - P[vj]
-        difference_vector = [P[v][0] - P[vj][0], P[v][1] - P[vj][1]]
-        l = math.sqrt(difference_vector[0] ** 2 + difference_vector[1] ** 2)
-
-        l0 = EL[e]
-
-        if (EP[e] == 2) and (l0 > l):
-            continue
+    I, J, is_spring, is_rope, L0 = model.edge_arrays
+    if geometry is None:
+        geometry = edge_geometry(P, I, J)
+    difference_vectors, l = geometry
 
-        # Computing dF/dv
-        dT_dx[0] = + (Ks * l0 * (-delta_x / l ** 3) * delta_x + Ks * l0 / l - Ks)
-        dT_dx[1] = + (Ks * l0 * (-delta_x / l ** 3) * delta_y)
-        dT_dy[0] = + (Ks * l0 * (-delta_y / l ** 3) * delta_x)
-        dT_dy[1] = + (Ks * l0 * (-delta_y / l ** 3) * delta_y + Ks * l0 / l - Ks)
-
-        # Computing dF/dvj
-        dT_dxj = -dT_dx
-        dT_dyj = -dT_dy
-
-        # Add dF/dv1 to its position in Jacobian matrix of our nonlinear system
-        if index_free_v != -1:
-            index_T = 4 * index_free_v + 2
-            index_v = 4 * index_free_v
-
-            J[index_T, index_v] += dT_dx[0]
-            J[index_T + 1, index_v] += dT_dx[1]
-
-            J[index_T, index_v + 1] += dT_dy[0]
-            J[index_T + 1, index_v + 1] += dT_dy[1]
-
-            if index_free_vj != -1:
-                index_vj = 4 * index_free_vj
+    # direction v-vj: force leaving vj.
+    delta_x = -difference_vectors[:, 0]
+    delta_y = -difference_vectors[:, 1]
 
-                J[index_T, index_vj] += dT_dxj[0]
-                J[index_T + 1, index_vj] += dT_dxj[1]
+    # rods are rigid and slack ropes exert no force. No sense in computing
+    # anything if vertices are both fixed either
+    active = (is_spring | (is_rope & (L0 <= l)))
+    active &= (vertex_to_free_vertex[I] != -1) | (vertex_to_free_vertex[J] != -1)
 
-                J[index_T, index_vj + 1] += dT_dyj[0]
-                J[index_T + 1, index_vj + 1] += dT_dyj[1]
+    delta_x = delta_x[active]
+    delta_y = delta_y[active]
+    l = l[active]
+    l0 = L0[active]
 
-        # Copy everything to F2 (force on v2 (vj))
-        if index_free_vj != -1:
-            index_Tj = 4 * index_free_vj + 2
-            index_vj = 4 * index_free_vj
+    # Computing dF/dv, columns are dT/dx and dT/dy
+    dT_dv = np.empty((len(l), 2, 2))
+    dT_dv[:, 0, 0] = + (Ks * l0 * (-delta_x / l ** 3) * delta_x + Ks * l0 / l - Ks)
+    dT_dv[:, 1, 0] = + (Ks * l0 * (-delta_x / l ** 3) * delta_y)
+    dT_dv[:, 0, 1] = + (Ks * l0 * (-delta_y / l ** 3) * delta_x)
+    dT_dv[:, 1, 1] = + (Ks * l0 * (-delta_y / l ** 3) * delta_y + Ks * l0 / l - Ks)
 
-            J[index_Tj, index_vj] -= dT_dxj[0]
-            J[index_Tj + 1, index_vj] -= dT_dxj[1]
+    # The force on vj is the opposite of the force on v, and dF/dvj = -dF/dv
+    free_v = vertex_to_free_vertex[I[active]]
+    free_vj = vertex_to_free_vertex[J[active]]
 
-            J[index_Tj, index_vj + 1] -= dT_dyj[0]
-            J[index_Tj + 1, index_vj + 1] -= dT_dyj[1]
+    return edge_jacobian_blocks(free_v, free_vj, dT_dv, -dT_dv, dT_dv, -dT_dv)
 
-            if index_free_v != -1:
-                index_v = 4 * index_free_v
 
-                J[index_Tj, index_v] -= dT_dx[0]
-                J[index_Tj + 1, index_v] -= dT_dx[1]
+# Compute Jacobian related to water pressure on the wet edges ETW
+# noinspection PyPep8Naming
+def water_pressure_jacobian(model, P, ETW, hw):
+    Kw = rho * g * W
 
-                J[index_Tj, index_v + 1] -= dT_dy[0]
-                J[index_Tj + 1, index_v + 1] -= dT_dy[1]
+    edges = np.asarray(ETW, dtype=int).reshape(-1, 2)
+    num_e = len(edges)
+    v = edges[:, 1]
+    vj = edges[:, 0]
 
-    return J
+    x = P[v, 0]
+    y = P[v, 1]
+    xj = P[vj, 0]
+    yj = P[vj, 1]
 
+    delta_x = (x - xj)
+    delta_y = (y - yj)
 
-# noinspection PyPep8Naming
-def water_pressure_jacobian(U, V, ETW, hw, free_vertices, vertex_to_free_vertex):
-    Kw = rho * g * W
+    # Different cases, selected per edge in the same order as the per edge
+    # formulas: horizontal, leaving water at yj, leaving water at y and
+    # fully submerged
+    horizontal = y == yj
+    leaves_at_vj = ~horizontal & (yj > hw)
+    leaves_at_v = ~horizontal & ~leaves_at_vj & (y > hw)
+    submerged = ~(horizontal | leaves_at_vj | leaves_at_v)
 
-    num_free_vertices = len(U)
-    J = np.zeros((4 * num_free_vertices, 4 * num_free_vertices))
-
-    P = V.copy()
-    P[free_vertices] = U[:, 0:2]
-
-    for edge in ETW:
-        v = edge[1]
-        vj = edge[0]
-
-        # indices of v_ starts at  4*v_ (+ 0,1,2,3). But the forces are in positions 3 and 4 (4*v_ + 2 or 3)
-        # solve for v1:
-        x = P[v][0]
-        y = P[v][1]
-        xj = P[vj][0]
-        yj = P[vj][1]
-
-        delta_x = (x - xj)
-        delta_y = (y - yj)
-
-        # Different cases 
-        if y == yj:
-            # Computing dFdv 
-            dF_dx = np.zeros(2)
-            dF_dx[0] = 0
-            dF_dx[1] = Kw / 2 * (hw - (yj + y) / 2)
-
-            dF_dy = np.zeros(2)
-            dF_dy[0] = Kw / 2 * (1 / 2 * delta_y - (hw - (yj + y) / 2))
-            dF_dy[1] = Kw / 2 * (-1 / 2 * delta_x)
-
-            # Computing dF/dvj
-            dF_dxj = - dF_dx.copy()
-
-            dF_dyj = np.zeros(2)
-            dF_dyj[0] = Kw / 2 * (1 / 2 * delta_y + (hw - (yj + y) / 2))
-            dF_dyj[1] = dF_dy[1]
-
-        elif yj > hw:
-            # Edge leaves water
-            # Computing dFdx
-            dF_dx = np.zeros(2)
-            dF_dx[0] = 0
-            dF_dx[1] = Kw / 2 * ((hw - y / 2) * y - hw * hw / 2) / delta_y
-
-            dF_dy = np.zeros(2)
-            dF_dy[0] = Kw / 2 * (y - hw)
-            dF_dy[1] = Kw / 2 * (
-                (hw - y) * delta_x / delta_y - ((hw - y / 2) * y - hw * hw / 2) * (delta_x / (delta_y * delta_y)))
-
-            # Computing dF/dvj
-            dF_dxj = np.zeros(2)
-            dF_dxj[0] = 0
-            dF_dxj[1] = Kw / 2 * ((hw - y / 2) * y - hw * hw / 2) / (-delta_y)
-
-            dF_dyj = np.zeros(2)
-            dF_dyj[0] = 0
-            dF_dyj[1] = Kw / 2 * (((hw - y / 2) * y - hw * hw / 2) * (delta_x / (delta_y * delta_y)))
-
-        elif y > hw:
-            # Edge leaves water
-            # Computing dFdx
-            dF_dx = np.zeros(2)
-            dF_dx[0] = 0
-            dF_dx[1] = Kw / 2 * (hw * hw / 2 - (hw - yj / 2) * yj) / delta_y
-
-            dF_dy = np.zeros(2)
-            dF_dy[0] = 0
-            dF_dy[1] = Kw / 2 * (hw * hw / 2 - (hw - yj / 2) * yj) * (-delta_x / (delta_y * delta_y))
-
-            # Computing dF/dvj
-            dF_dxj = np.zeros(2)
-            dF_dxj[0] = 0
-            dF_dxj[1] = Kw / 2 * (hw * hw / 2 - (hw - yj / 2) * yj) / (-delta_y)
-
-            dF_dyj = np.zeros(2)
-            dF_dyj[0] = Kw / 2 * (yj - hw) * (-1)
-            dF_dyj[1] = Kw / 2 * (
-                (yj - hw) * delta_x / delta_y + (hw * hw / 2 - (hw - yj / 2) * yj) * (delta_x / (delta_y * delta_y)))
+    # columns are derivatives with respect to x and y
+    dF_dv = np.zeros((num_e, 2, 2))
+    dF_dvj = np.zeros((num_e, 2, 2))
 
-        else:
-            # Computing dF/dv
-            dF_dx = np.zeros(2)
-            dF_dx[0] = 0
-            dF_dx[1] = Kw / 2 * ((hw - y / 2) * y - (hw - yj / 2) * yj) / delta_y
+    c = horizontal
+    if np.any(c):
+        h = hw - (yj[c] + y[c]) / 2
 
-            dF_dy = np.zeros(2)
-            dF_dy[0] = Kw / 2 * (hw - y) * (-1)
-            dF_dy[1] = Kw / 2 * (
-                (hw - y) * (delta_x / delta_y) + ((hw - y / 2) * y - (hw - yj / 2) * yj) * (
-                    -delta_x / (delta_y * delta_y)))
+        # Computing dFdv
+        dF_dv[c, 1, 0] = Kw / 2 * h
+        dF_dv[c, 0, 1] = Kw / 2 * (1 / 2 * delta_y[c] - h)
+        dF_dv[c, 1, 1] = Kw / 2 * (-1 / 2 * delta_x[c])
 
-            # Computing dF/dvj
-            dF_dxj = np.zeros(2)
-            dF_dxj[0] = 0
-            dF_dxj[1] = Kw / 2 * ((hw - y / 2) * y - (hw - yj / 2) * yj) / (-delta_y)
+        # Computing dF/dvj
+        dF_dvj[c, :, 0] = - dF_dv[c, :, 0]
+        dF_dvj[c, 0, 1] = Kw / 2 * (1 / 2 * delta_y[c] + h)
+        dF_dvj[c, 1, 1] = dF_dv[c, 1, 1]
 
-            dF_dyj = np.zeros(2)
-            dF_dyj[0] = Kw / 2 * (yj - hw) * (-1)
-            dF_dyj[1] = Kw / 2 * (
-                (yj - hw) * delta_x / delta_y + ((hw - y / 2) * y - (hw - yj / 2) * yj) * (
-                    delta_x / (delta_y * delta_y)))
+    c = leaves_at_vj
+    if np.any(c):
+        # Edge leaves water
+        y_, dx, dy = y[c], delta_x[c], delta_y[c]
+        n = (hw - y_ / 2) * y_ - hw * hw / 2
 
-        # Add dF/dv1 to its position in Jacobian matrix of our nonlinear system
-        index_free_v = vertex_to_free_vertex[v]
-        index_free_vj = vertex_to_free_vertex[vj]
+        # Computing dFdv
+        dF_dv[c, 1, 0] = Kw / 2 * n / dy
+        dF_dv[c, 0, 1] = Kw / 2 * (y_ - hw)
+        dF_dv[c, 1, 1] = Kw / 2 * ((hw - y_) * dx / dy - n * (dx / (dy * dy)))
 
-        if index_free_v != -1:
-            index_F = 4 * index_free_v + 2
-            index_v = 4 * index_free_v
+        # Computing dF/dvj
+        dF_dvj[c, 1, 0] = Kw / 2 * n / (-dy)
+        dF_dvj[c, 1, 1] = Kw / 2 * (n * (dx / (dy * dy)))
 
-            J[index_F:(index_F + 2), index_v] += dF_dx
-            J[index_F:(index_F + 2), index_v + 1] += dF_dy
+    c = leaves_at_v
+    if np.any(c):
+        # Edge leaves water
+        yj_, dx, dy = yj[c], delta_x[c], delta_y[c]
+        n = hw * hw / 2 - (hw - yj_ / 2) * yj_
 
-            if index_free_vj != -1:
-                index_vj = 4 * index_free_vj
+        # Computing dFdv
+        dF_dv[c, 1, 0] = Kw / 2 * n / dy
+        dF_dv[c, 1, 1] = Kw / 2 * n * (-dx / (dy * dy))
 
-                J[index_F:(index_F + 2), index_vj] += dF_dxj
-                J[index_F:(index_F + 2), index_vj + 1] += dF_dyj
+        # Computing dF/dvj
+        dF_dvj[c, 1, 0] = Kw / 2 * n / (-dy)
+        dF_dvj[c, 0, 1] = Kw / 2 * (yj_ - hw) * (-1)
+        dF_dvj[c, 1, 1] = Kw / 2 * ((yj_ - hw) * dx / dy + n * (dx / (dy * dy)))
 
-        # Copy everything to F2 (force on v2 (vj))
-        if index_free_vj != -1:
-            index_Fj = 4 * index_free_vj + 2
-            index_vj = 4 * index_free_vj
+    c = submerged
+    if np.any(c):
+        y_, yj_, dx, dy = y[c], yj[c], delta_x[c], delta_y[c]
+        n = (hw - y_ / 2) * y_ - (hw - yj_ / 2) * yj_
 
-            J[index_Fj:(index_Fj + 2), index_vj] += dF_dxj
-            J[index_Fj:(index_Fj + 2), index_vj + 1] += dF_dyj
+        # Computing dF/dv
+        dF_dv[c, 1, 0] = Kw / 2 * n / dy
+        dF_dv[c, 0, 1] = Kw / 2 * (hw - y_) * (-1)
+        dF_dv[c, 1, 1] = Kw / 2 * ((hw - y_) * (dx / dy) + n * (-dx / (dy * dy)))
 
-            if index_free_v != -1:
-                index_v = 4 * index_free_v
+        # Computing dF/dvj
+        dF_dvj[c, 1, 0] = Kw / 2 * n / (-dy)
+        dF_dvj[c, 0, 1] = Kw / 2 * (yj_ - hw) * (-1)
+        dF_dvj[c, 1, 1] = Kw / 2 * ((yj_ - hw) * dx / dy + n * (dx / (dy * dy)))
 
-                J[index_Fj:(index_Fj + 2), index_v] += dF_dx
-                J[index_Fj:(index_Fj + 2), index_v + 1] += dF_dy
+    free_v = model.vertex_to_free_vertex[v]
+    free_vj = model.vertex_to_free_vertex[vj]
 
-    return J
+    # half of the edge force goes to each vertex, so both get the same derivatives
+    return edge_jacobian_blocks(free_v, free_vj, dF_dv, dF_dvj, dF_dvj, dF_dv)
 
 
 # noinspection PyPep8Naming
@@ -339,72 +229,180 @@ def finds_origin(V):
 # a path.
 # noinspection PyPep8Naming,PyPep8Naming
 def edges_touching_water(V, E, EP, VBR, hw):
-    ETW = []
-    result = []
+    # the path ends at the first rope
+    ropes = np.nonzero(np.asarray(EP) == 2)[0]
+    num_chain_edges = ropes[0] if len(ropes) > 0 else len(E)
 
-    exit_position = -float("inf")
-    in_water = True
+    edges = np.asarray(E, dtype=int).reshape(-1, 2)[:num_chain_edges]
+    wet = wet_edge_indices(np.asarray(V, dtype=float), edges[:, 0], edges[:, 1], np.asarray(VBR, dtype=float), hw)
 
-    # continues searching for next edge to touch water until we achieve a point
-    # higher than hw
-    for i, edge in enumerate(E):
-        if EP[i] == 2:
-            break
+    return [E[i] for i in wet]
+
+
+# Indices of the wet edges of the path I[e] -> J[e] (see edges_touching_water)
+# noinspection PyPep8Naming
+def wet_edge_indices(V, I, J, VBR, hw):
+    y = V[:, 1]
+    below = y < hw
+    wet, leaving, entering = water_crossing_flags(below, hw <= y + VBR, I, J)
+
+    return select_wet_edges(V, I, J, hw, wet, np.nonzero(leaving)[0], np.nonzero(entering)[0], below)
+
+
+# Flags of the edges of the path, given which vertices are below the water
+# level (y < hw) and which reach it with their buoys (hw <= y + VBR):
+#   - wet: some of the vertices is under water, so the edge is wet if the
+#     path is in water
+#   - leaving: the path leaves water through the edge
+#   - entering: the path enters water through the edge
+# noinspection PyPep8Naming
+def water_crossing_flags(below, reaches, I, J):
+    wet = below[I] | below[J]
+    leaving = below[I] & reaches[J]
+    entering = below[J]
+
+    return wet, leaving, entering
 
-        last_v = edge[0]
-        current_v = edge[1]
 
-        if in_water:
-            # if some of the vertices is under water, the edge is wet
-            if V[last_v, 1] < hw or V[current_v, 1] < hw:
-                ETW.append(edge)
+# x position where the edges cross the water level, or the position of their
+# last vertex if it is already under water (inside)
+# noinspection PyPep8Naming
+def water_crossing_positions(V, I, J, hw, inside):
+    x1, y1 = V[I].T
+    x2, y2 = V[J].T
+
+    # the shift from x2 is only computed outside, where the edge crosses hw
+    shifts = np.zeros(len(I))
+    np.divide((y2 - hw) * (x2 - x1), y2 - y1, out=shifts, where=~inside)
+
+    return x2 - shifts
+
+
+# Walks the path of edges from water crossing to water crossing. The path
+# starts in water; every run of wet edges that ends leaving water is kept if
+# it left the water to the right of the previous exit, and, out of water, the
+# path only enters it again to the right of the last exit (if
+# water_entering_position_matter). Runs that never leave water are dropped.
+# leaving_edges and entering_edges are the sorted indices of the edges
+# flagged by water_crossing_flags. Returns the sorted indices of wet edges.
+# noinspection PyPep8Naming
+def select_wet_edges(V, I, J, hw, wet, leaving_edges, entering_edges, below):
+    selected = np.zeros(len(I), dtype=bool)
+
+    # positions of all crossings at once, the walk below only compares them
+    exit_positions = water_crossing_positions(V, I[leaving_edges], J[leaving_edges], hw,
+                                              below[J[leaving_edges]]).tolist()
+    enter_positions = water_crossing_positions(V, I[entering_edges], J[entering_edges], hw,
+                                               below[I[entering_edges]]).tolist()
+    leaving_edges = leaving_edges.tolist()
+    entering_edges = entering_edges.tolist()
 
-            # if the edge is leaving water, time to save our wet edges
-            if V[last_v, 1] < hw <= (V[current_v, 1] + VBR[current_v]):
-                # set flat correctly, since we are leaving water
-                in_water = False
+    exit_position = -float("inf")
+    start = 0
+    search_from = 0
+
+    while True:
+        # if the edge is leaving water, time to save our wet edges
+        k = bisect.bisect_left(leaving_edges, search_from)
+        if k == len(leaving_edges):
+            break
+        end = leaving_edges[k]
 
-                x1 = V[last_v, 0]
-                y1 = V[last_v, 1]
-                x2 = V[current_v, 0]
-                y2 = V[current_v, 1]
+        if not water_entering_position_matter or exit_positions[k] >= exit_position:
+            selected[start:end + 1] = wet[start:end + 1]
 
-                if hw > V[current_v, 1]:
-                    new_exit_position = x2
-                else:
-                    new_exit_position = x2 - (y2 - hw) * (x2 - x1) / (y2 - y1)
+        exit_position = exit_positions[k]
 
-                # verify if
-                if not water_entering_position_matter or new_exit_position >= exit_position:
-                    result += ETW
+        # Entering water level? If it is entering to the right of the exit
+        # position, the entering edge is, in fact, wet
+        k = bisect.bisect_left(entering_edges, end + 1)
+        if water_entering_position_matter:
+            while k < len(entering_edges) and enter_positions[k] < exit_position:
+                k += 1
+        if k == len(entering_edges):
+            break
 
-                ETW = []
+        start = entering_edges[k]
+        search_from = start + 1
 
-                exit_position = new_exit_position
+    return np.nonzero(selected)[0]
 
+
+# Incremental version of edges_touching_water for the path of a model (a
+# modelLib.SimulationModel). Between consecutive iterates and time steps
+# almost no vertex crosses the water level, so the flags of the edges (see
+# water_crossing_flags) are kept and only the ones of edges touching vertices
+# that crossed hw (or the top of their buoys) are re-examined. The positions
+# of the crossings only matter when the path may enter water again after
+# leaving it (see select_wet_edges); otherwise the wet edges are kept as well
+# until some flag changes.
+# noinspection PyPep8Naming
+class WetEdgeClassifier(object):
+    def __init__(self, model):
+        num_chain_edges = model.num_chain_edges
+        self.E = model.E[:num_chain_edges]
+        self.I = model.I[:num_chain_edges]
+        self.J = model.J[:num_chain_edges]
+        self.VBR = model.VBR
+
+        # chain edges touching each vertex, in compressed rows
+        endpoints = np.concatenate([self.I, self.J])
+        self.vertex_edges = np.argsort(endpoints, kind='stable') % num_chain_edges
+        self.vertex_edges_indptr = np.zeros(model.num_v + 1, dtype=int)
+        np.cumsum(np.bincount(endpoints, minlength=model.num_v), out=self.vertex_edges_indptr[1:])
+
+        self.below = None
+        self.reaches = None
+        self.wet_edges = None
+
+        # number of edges whose flags were computed, over the whole run
+        self.reexamined_edges = 0
+
+    # Wet edges of the path with its vertices at P, as an array of edges
+    # noinspection PyPep8Naming
+    def classify(self, P, hw):
+        return self.E[self.indices(P, hw)]
+
+    # Indices of the wet edges of the path with its vertices at P
+    # noinspection PyPep8Naming
+    def indices(self, P, hw):
+        y = P[:, 1]
+        below = y < hw
+        reaches = hw <= y + self.VBR
+
+        if self.below is None:
+            self.wet, self.leaving, self.entering = water_crossing_flags(below, reaches, self.I, self.J)
+            self.reexamined_edges += len(self.I)
+            self.update_events()
+            self.wet_edges = None
         else:
-            # Entering water level?
-            if hw > V[current_v, 1]:
-                x1 = V[last_v, 0]
-                y1 = V[last_v, 1]
-                x2 = V[current_v, 0]
-                y2 = V[current_v, 1]
+            crossed = np.nonzero((below != self.below) | (reaches != self.reaches))[0]
+            if len(crossed) > 0:
+                edges = np.unique(np.concatenate([
+                    self.vertex_edges[self.vertex_edges_indptr[v]:self.vertex_edges_indptr[v + 1]] for v in crossed]))
+
+                wet, leaving, entering = water_crossing_flags(below, reaches, self.I[edges], self.J[edges])
+                self.wet[edges] = wet
+                self.leaving[edges] = leaving
+                self.entering[edges] = entering
+                self.reexamined_edges += len(edges)
+                self.update_events()
+                self.wet_edges = None
 
-                # if entire edge is below water, entering position is set as current position
-                if hw > V[last_v, 1]:
-                    enter_position = x2
-                else:
-                    enter_position = x2 - (y2 - hw) * (x2 - x1) / (y2 - y1)
+        self.below = below
+        self.reaches = reaches
 
-                # if it is entering to the right of the exit position, it is fine
-                if not water_entering_position_matter or enter_position >= exit_position:
-                    # then edge is, in fact, wet
-                    ETW.append(edge)
+        if self.wet_edges is None or self.positions_matter:
+            self.wet_edges = select_wet_edges(P, self.I, self.J, hw, self.wet, self.leaving_edges,
+                                              self.entering_edges, below)
 
-                    # set flat correctly, since we are leaving water
-                    in_water = True
+        return self.wet_edges
 
-    return result
+    def update_events(self):
+        self.leaving_edges = np.nonzero(self.leaving)[0]
+        self.entering_edges = np.nonzero(self.entering)[0]
+        self.positions_matter = (water_entering_position_matter and len(self.leaving_edges) > 0 and
+                                 len(self.entering_edges) > 0 and self.entering_edges[-1] > self.leaving_edges[0])
 
 
 # Method that computes Water pressure force in one edge/bar
@@ -495,6 +493,42 @@ def get_submerged_area(center_y, radius, water_height):
     return math.pi * radius * radius - not_submerged_area
 
 
+# Mask of the circles crossing the water surface
+def partially_submerged(center_y, radius, water_height):
+    return (center_y + radius > water_height) & (center_y - radius < water_height)
+
+
+# Same as get_submerged_area, for arrays of circles
+def get_submerged_areas(center_y, radius, water_height):
+    areas = math.pi * radius * radius
+    areas[center_y - radius >= water_height] = 0
+
+    partial = partially_submerged(center_y, radius, water_height)
+    radius = radius[partial]
+
+    # source: https://en.wikipedia.org/wiki/Circular_segment
+    d = radius - (center_y[partial] + radius - water_height)
+    theta = 2 * np.arccos(d / radius)
+
+    areas[partial] -= np.power(radius, 2) / 2 * (theta - np.sin(theta))
+
+    return areas
+
+
+# Derivatives of get_submerged_areas with respect to the heights of the
+# centers. They vanish unless the circle crosses the water surface.
+def get_submerged_area_derivatives(center_y, radius, water_height):
+    dA_dy = np.zeros(len(center_y))
+
+    partial = partially_submerged(center_y, radius, water_height)
+    radius = radius[partial]
+    depth = water_height - center_y[partial]
+
+    dA_dy[partial] = - 2 * np.sqrt(radius * radius - depth * depth)
+
+    return dA_dy
+
+
 def get_boyant_force(centroid, boyant_radius, water_height):
     submerged_volume = get_submerged_area(centroid[1], boyant_radius, water_height)
     displaced_mass = submerged_volume * rho * g
@@ -502,33 +536,65 @@ def get_boyant_force(centroid, boyant_radius, water_height):
     return displaced_mass
 
 
-# gets the boyancy forces for each vertex touching water
+# gets the boyancy forces for each vertex touching water. Callers that
+# already know the indices of the buoys (VBR > 0) may pass them along.
 # noinspection PyPep8Naming,PyPep8Naming,PyPep8Naming
-def compute_boyancy_forces(V, VBR, hw):
+def compute_boyancy_forces(V, VBR, hw, buoys=None):
+    VBR = np.asarray(VBR, dtype=float)
     B = np.zeros((len(VBR), 2))
 
-    for i, vertex in enumerate(V):
-        if VBR[i] > 0:
-            B[i] = [0, get_boyant_force(vertex, VBR[i], hw)]
+    if buoys is None:
+        buoys = np.nonzero(VBR > 0)[0]
+    submerged_volume = get_submerged_areas(np.asarray(V, dtype=float)[buoys, 1], VBR[buoys], hw)
+    B[buoys, 1] = submerged_volume * rho * g
 
     return B
 
 
+# Method that computes water pressure forces on each of the edges (rows of
+# vertex indices) at once, following compute_water_pressure_force_on_edge.
+# Each formula is written where its mask holds rather than gathered, which
+# saves numpy calls on small models.
+# noinspection PyPep8Naming
+def compute_water_pressure_forces_on_edges(V, edges, hw):
+    Kw = rho * g * W
+
+    # end points of the edges, [edge][start or end][x or y]
+    points = V[edges]
+    difference_vectors = points[:, 1] - points[:, 0]
+    dx = difference_vectors[:, 0]
+    dy = difference_vectors[:, 1]
+
+    forces = np.zeros((len(edges), 2))
+
+    # verifies if the vertices are out of water
+    y = np.minimum(points[:, :, 1], hw)
+    pressure_integrals = (hw - y / 2) * y
+
+    # if horizontal edge, computation is easier
+    horizontal = dy == 0
+    sloped = ~horizontal
+    np.multiply(Kw * (hw - points[:, 0, 1]), dx, out=forces[:, 1], where=horizontal)
+
+    # forces computed according document about our physics model
+    np.multiply(- Kw, pressure_integrals[:, 1] - pressure_integrals[:, 0], out=forces[:, 0], where=sloped)
+    np.divide(- forces[:, 0] * dx, dy, out=forces[:, 1], where=sloped)
+
+    return forces
+
+
 # Method that computes water pressure forces for all edges in water
 # noinspection PyPep8Naming,PyPep8Naming
 def compute_water_pressure_forces(V, ETW, hw):
-    FWP = np.zeros((len(V), 2))
-
-    for edge in ETW:
-        edge_force = compute_water_pressure_force_on_edge(edge, V, hw)
-
-        v1 = edge[0]
-        v2 = edge[1]
+    edges = np.asarray(ETW, dtype=int).reshape(-1, 2)
+    I = edges[:, 0]
+    J = edges[:, 1]
 
-        FWP[v1, :] += edge_force / 2
-        FWP[v2, :] += edge_force / 2
+    forces = compute_water_pressure_forces_on_edges(V, edges, hw)
 
-    return FWP
+    # half of the force goes to each vertex of the edge
+    half = forces / 2
+    return scatter_edge_forces(len(V), I, J, half, half)
 
 
 # Method that computes collision forces with the ground
@@ -536,12 +602,9 @@ def compute_water_pressure_forces(V, ETW, hw):
 def compute_ground_collision_forces(V):
     CF = np.zeros((len(V), 2))
 
-    for v, vertex in enumerate(V):
-
-        if vertex[1] < epsilon_ground:
-            ground_force = -kappa_ground * (vertex[1] - epsilon_ground)
-
-            CF[v, 1] = ground_force
+    y = V[:, 1]
+    touching = y < epsilon_ground
+    CF[touching, 1] = -kappa_ground * (y[touching] - epsilon_ground)
 
     return CF
 
@@ -588,52 +651,112 @@ def compute_tensor_force_on_rope(rope, V, l0):
     return force
 
 
-# Method that computes tensor forces for all ropes
+# Packs the edge list into the arrays used by the vectorized kernels: endpoint
+# indices, spring/rope masks and rest lengths
 # noinspection PyPep8Naming
-def compute_tensor_forces(V, E, EP, EL):
-    T = np.zeros((len(V), 2))
+def edge_index_arrays(E, EP, EL):
+    edges = np.asarray(E, dtype=int).reshape(-1, 2)
+    tags = np.asarray(EP, dtype=int).reshape(-1)
 
-    for i in range(0, len(E)):
-        edge = E[i]
+    I = edges[:, 0].copy()
+    J = edges[:, 1].copy()
+    is_spring = tags == 0
+    is_rope = tags == 2
+    L0 = np.asarray(EL, dtype=float).reshape(-1)
 
-        v1 = edge[0]
-        v2 = edge[1]
+    return I, J, is_spring, is_rope, L0
 
-        if EP[i] == 0:
-            force = compute_tensor_force_on_spring(edge, V, EL[i])
-        elif EP[i] == 2:
-            force = compute_tensor_force_on_rope(edge, V, EL[i])
-        else:
-            force = 0.0
 
-        T[v1, 0] += force[0]
-        T[v1, 1] += force[1]
+# Scatter-adds per edge forces into the per vertex force array: F goes to the
+# first vertex of each edge and FJ (by default -F) to the second one.
+# Contributions are interleaved (v1 of edge 0, v2 of edge 0, v1 of edge 1, ...)
+# so the sums are accumulated in the same order as the per edge loop.
+# noinspection PyPep8Naming
+def scatter_edge_forces(num_v, I, J, F, FJ=None):
+    if FJ is None:
+        FJ = -F
+
+    indices = np.empty(2 * len(I), dtype=int)
+    indices[0::2] = I
+    indices[1::2] = J
+
+    R = np.zeros((num_v, 2))
+    for c in range(0, 2):
+        weights = np.empty(2 * len(I))
+        weights[0::2] = F[:, c]
+        weights[1::2] = FJ[:, c]
+        R[:, c] = np.bincount(indices, weights=weights, minlength=num_v)
+
+    return R
+
 
-        T[v2, 0] += -force[0]
-        T[v2, 1] += -force[1]
+# Computes the vector from the first to the second vertex of each edge and
+# its length, shared by the tensor force and jacobian at the same positions
+# noinspection PyPep8Naming
+def edge_geometry(V, I, J):
+    V = np.asarray(V, dtype=float)
+
+    difference_vectors = V[J] - V[I]
+    lengths = np.sqrt(difference_vectors[:, 0] ** 2 + difference_vectors[:, 1] ** 2)
+
+    return difference_vectors, lengths
+
+
+# Method that computes tensor forces for all edges given the precomputed edge
+# arrays (see edge_index_arrays) and, optionally, their geometry (see
+# edge_geometry). Rods carry no tensor force and ropes only pull when
+# stretched beyond their rest length.
+# noinspection PyPep8Naming
+def compute_tensor_forces_on_edges(V, I, J, is_spring, is_rope, L0, geometry=None):
+    # computing current lengths
+    if geometry is None:
+        geometry = edge_geometry(V, I, J)
+    difference_vectors, d = geometry
+
+    active = (is_spring | (is_rope & (d >= L0)))[:, None]
+
+    forces = np.zeros((len(I), 2))
+    np.divide(difference_vectors, d[:, None], out=forces, where=active)
+    np.multiply(forces, kappa * (d - L0)[:, None], out=forces, where=active)
+
+    return scatter_edge_forces(len(V), I, J, forces)
+
+
+# Method that computes tensor forces for all ropes
+# noinspection PyPep8Naming
+def compute_tensor_forces(V, E, EP, EL):
+    I, J, is_spring, is_rope, L0 = edge_index_arrays(E, EP, EL)
 
-    return T
+    return compute_tensor_forces_on_edges(V, I, J, is_spring, is_rope, L0)
 
 
-# Computes all forces of the system
+# Computes all forces of the system of the model with its vertices at P.
+# Callers that already know the wet edges or the edge geometry at P may pass
+# them along. Its cost is mostly a fixed number of numpy calls, about 50us
+# whatever the size of the model, so on models of fewer than about 8
+# vertices it is slower than the per edge loops it replaced, and much faster
+# above.
 # noinspection PyPep8Naming
-def compute_resulting_forces(V, E, EP, EL, VBR, hw):
-    ETW = edges_touching_water(V, E, EP, VBR, hw)
+def compute_resulting_forces(model, P, hw, ETW=None, geometry=None):
+    if ETW is None:
+        n = model.num_chain_edges
+        ETW = model.E[wet_edge_indices(P, model.I[:n], model.J[:n], model.VBR, hw)]
     # print("ETW: ", ETW)
 
-    G = compute_gravity_forces(V, E, EL)
+    # gravity only depends on the topology
+    G = model.gravity
     # G = np.zeros((len(V), 2))
 
-    B = compute_boyancy_forces(V, VBR, hw)
+    B = compute_boyancy_forces(P, model.VBR, hw, model.buoys)
     # B = np.zeros((len(V), 2))
 
-    FWP = compute_water_pressure_forces(V, ETW, hw)
+    FWP = compute_water_pressure_forces(P, ETW, hw)
     # print("FWP: ", FWP)
 
-    T = compute_tensor_forces(V, E, EP, EL)
+    T = compute_tensor_forces_on_edges(P, *model.edge_arrays, geometry=geometry)
     # print("T: ", T)
 
-    CF = compute_ground_collision_forces(V)
+    CF = compute_ground_collision_forces(P)
     # print("CF: ", CF)
 
     R = T + FWP + G + B + CF
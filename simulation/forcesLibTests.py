@@ -1,7 +1,10 @@
+import json
 import math
+import os
 import unittest
 
 import forcesLib
+import modelLib
 import numpy as np
 import simulatorLib
 
@@ -19,7 +22,7 @@ class ForcesLibTests(unittest.TestCase):
         VBR = [0.0, 0.0, 0.0, 0.0, 0.0]
 
         # Act
-        E, EP, EL = simulatorLib.pre_ordering_of_edges(V, E, EP, EL)
+        E, EP, EL = modelLib.pre_ordering_of_edges(V, E, EP, EL)
         edges = forcesLib.edges_touching_water(V, E, EP, VBR, hw)
 
         # Assert
@@ -36,7 +39,7 @@ class ForcesLibTests(unittest.TestCase):
         VBR = [0.0, 0.0, 0.0, 0.0, 0.0]
 
         # Act
-        E, EP, EL = simulatorLib.pre_ordering_of_edges(V, E, EP, EL)
+        E, EP, EL = modelLib.pre_ordering_of_edges(V, E, EP, EL)
         edges = forcesLib.edges_touching_water(V, E, EP, VBR, hw)
 
         # Assert
@@ -53,7 +56,7 @@ class ForcesLibTests(unittest.TestCase):
         VBR = [0.0, 0.0, 0.0, 0.0, 0.0]
 
         # Act
-        E, EP, EL = simulatorLib.pre_ordering_of_edges(V, E, EP, EL)
+        E, EP, EL = modelLib.pre_ordering_of_edges(V, E, EP, EL)
         edges = forcesLib.edges_touching_water(V, E, EP, VBR, hw)
 
         # Assert
@@ -70,7 +73,7 @@ class ForcesLibTests(unittest.TestCase):
         VBR = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
 
         # Act
-        E, EP, EL = simulatorLib.pre_ordering_of_edges(V, E, EP, EL)
+        E, EP, EL = modelLib.pre_ordering_of_edges(V, E, EP, EL)
         edges = forcesLib.edges_touching_water(V, E, EP, VBR, hw)
 
         # Assert
@@ -87,7 +90,7 @@ class ForcesLibTests(unittest.TestCase):
         VBR = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
 
         # Act
-        E, EP, EL = simulatorLib.pre_ordering_of_edges(V, E, EP, EL)
+        E, EP, EL = modelLib.pre_ordering_of_edges(V, E, EP, EL)
         edges = forcesLib.edges_touching_water(V, E, EP, VBR, hw)
 
         # Assert
@@ -104,7 +107,7 @@ class ForcesLibTests(unittest.TestCase):
         VBR = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
 
         # Act
-        E, EP, EL = simulatorLib.pre_ordering_of_edges(V, E, EP, EL)
+        E, EP, EL = modelLib.pre_ordering_of_edges(V, E, EP, EL)
         edges = forcesLib.edges_touching_water(V, E, EP, VBR, hw)
 
         # Assert
@@ -121,13 +124,74 @@ class ForcesLibTests(unittest.TestCase):
         VBR = [0.0, 0.0, 0.5, 0.5, 0.0]
 
         # Act
-        E, EP, EL = simulatorLib.pre_ordering_of_edges(V, E, EP, EL)
+        E, EP, EL = modelLib.pre_ordering_of_edges(V, E, EP, EL)
         edges = forcesLib.edges_touching_water(V, E, EP, VBR, hw)
 
         # Assert
         true_solution = [[0, 1], [1, 2], [2, 3], [3, 4]]
         self.assertListEqual(true_solution, edges)
 
+    def testWetEdgeClassifierMatchesFullScan(self):
+        # Arrange
+        scenarios_directory = os.path.join(os.path.dirname(__file__), '..', 'scenarios')
+        with open(os.path.join(scenarios_directory, 'watergate-40degrees-curvature.json')) as data_file:
+            data = json.load(data_file)
+        model, hw, water_speed, time_step, max_iterations, simulation_method = simulatorLib.from_json(data)
+        random = np.random.RandomState(0)
+        classifier = forcesLib.WetEdgeClassifier(model)
+        P = model.V.copy()
+
+        for step in range(0, 50):
+            P = P + random.uniform(-0.01, 0.01, P.shape)
+
+            # Act
+            ETW = classifier.classify(P, hw)
+
+            # Assert
+            expected = forcesLib.edges_touching_water(P, model.E, model.EP, model.VBR, hw)
+            np.testing.assert_array_equal(ETW, np.array(expected).reshape(-1, 2))
+
+        self.assertLess(classifier.reexamined_edges, 10 * model.num_chain_edges)
+
+    def testWetEdgeClassifierKeepsWetEdgesOfPathsNotEnteringWaterAgain(self):
+        # Arrange
+        scenarios_directory = os.path.join(os.path.dirname(__file__), '..', 'scenarios')
+        for scenario in ['two_ropes.json', 'boyancy_test.json', 'rising_water_low_verteces.json']:
+            with open(os.path.join(scenarios_directory, scenario)) as data_file:
+                data = json.load(data_file)
+            model, hw, water_speed, time_step, max_iterations, simulation_method = simulatorLib.from_json(data)
+            random = np.random.RandomState(0)
+            classifier = forcesLib.WetEdgeClassifier(model)
+            P = model.V.copy()
+
+            for step in range(0, 50):
+                P = P + random.uniform(-0.05, 0.05, P.shape)
+
+                # Act
+                ETW = classifier.classify(P, hw)
+
+                # Assert
+                expected = forcesLib.edges_touching_water(P, model.E, model.EP, model.VBR, hw)
+                np.testing.assert_array_equal(ETW, np.array(expected, dtype=int).reshape(-1, 2))
+
+    def testWetEdgeClassifierReexaminesCrossingVertex(self):
+        # Arrange
+        hw = 8
+        V = np.array([[0, 0], [-10, 0], [-20, 0], [-13, 5], [-6, 10]], dtype=float)
+        model = modelLib.SimulationModel(V, [[0, 1], [1, 2], [2, 3], [3, 4], [1, 3]], [1, 1, 0, 0, 0],
+                                         [0, 0, 0, 0, 2], [1, 1, 1, 1, 1], [0, 0, 0, 0, 0])
+        classifier = forcesLib.WetEdgeClassifier(model)
+        classifier.classify(V, hw)
+        P = V.copy()
+        P[3, 1] = 9  # vertex 3 leaves water
+
+        # Act
+        ETW = classifier.classify(P, hw)
+
+        # Assert
+        np.testing.assert_array_equal(ETW, [[0, 1], [1, 2], [2, 3]])
+        self.assertEqual(classifier.reexamined_edges, 4 + 2)
+
 
     # Water Pressure Forces:
 
@@ -264,6 +328,190 @@ class ForcesLibTests(unittest.TestCase):
         self.assertAlmostEqual(force[0], true_magnitude *  math.sqrt(2) / 2)
         self.assertAlmostEqual(force[1], true_magnitude *  math.sqrt(2) / 2)
 
+    def testWPForcesMatchLoopOnScenarios(self):
+        scenarios_directory = os.path.join(os.path.dirname(__file__), '..', 'scenarios')
+        random = np.random.RandomState(0)
+
+        for name in ['watergate-40degrees-curvature.json', 'c-shape-2buoy.json', 'myrtle.json']:
+            # Arrange
+            with open(os.path.join(scenarios_directory, name)) as data_file:
+                data = json.load(data_file)
+            model, hw, water_speed, time_step, max_iterations, simulation_method = simulatorLib.from_json(data)
+            V = model.V + random.uniform(-0.05, 0.05, model.V.shape)
+            V[model.J[::3], 1] = V[model.I[::3], 1]  # some horizontal edges
+            ETW = forcesLib.edges_touching_water(V, model.E, model.EP, model.VBR, hw)
+
+            expected = np.zeros((len(V), 2))
+            for edge in ETW:
+                edge_force = forcesLib.compute_water_pressure_force_on_edge(edge, V, hw)
+                expected[edge[0]] += edge_force / 2
+                expected[edge[1]] += edge_force / 2
+
+            # Act
+            FWP = forcesLib.compute_water_pressure_forces(V, ETW, hw)
+
+            # Assert
+            self.assertGreater(len(ETW), 0)
+            np.testing.assert_array_equal(FWP, expected, err_msg=name)
+
+    def testWPForcesWithoutWetEdges(self):
+        # Arrange
+        V = np.array([[0.0, 6.0], [1.0, 7.0]])
+
+        # Act
+        FWP = forcesLib.compute_water_pressure_forces(V, [], 5.0)
+
+        # Assert
+        np.testing.assert_array_equal(FWP, np.zeros((2, 2)))
+
+    # Jacobian of the water pressure on a single free edge, against central
+    # differences, for every case: horizontal, leaving water at either vertex
+    # and fully submerged
+    def testWPJacobianCases(self):
+        hw = 5.0
+        delta = 1e-3  # forces are quadratic in the positions, smaller steps only add rounding noise
+
+        for V in [np.array([[1.0, 2.0], [3.0, 2.0]]), np.array([[1.0, 2.0], [3.0, 6.0]]),
+                  np.array([[1.0, 6.0], [3.0, 2.0]]), np.array([[1.0, 2.0], [3.0, 4.0]])]:
+            # Arrange
+            model = modelLib.SimulationModel(V, [[0, 1]], [0, 0], [1], [1.0], [0, 0])
+            ETW = model.E
+
+            expected = np.zeros((4, 4))
+            for c in range(0, 4):
+                forward = V.copy()
+                backward = V.copy()
+                forward[c // 2, c % 2] += delta
+                backward[c // 2, c % 2] -= delta
+                difference = forcesLib.compute_water_pressure_forces(forward, ETW, hw) - \
+                    forcesLib.compute_water_pressure_forces(backward, ETW, hw)
+                expected[:, c] = difference.reshape(-1) / (2 * delta)
+
+            # Act
+            rows, cols, blocks = forcesLib.water_pressure_jacobian(model, V, ETW, hw)
+
+            J = np.zeros((4, 4))
+            for row, col, block in zip(rows, cols, blocks):
+                J[2 * row:2 * row + 2, 2 * col:2 * col + 2] += block
+
+            # Assert
+            np.testing.assert_allclose(J, expected, rtol=1e-5, atol=1e-2, err_msg=str(V))
+
+    # Buoyancy Forces:
+
+    def testBuoyancyForcesMatchScalarPath(self):
+        # Arrange
+        hw = 5.0
+        random = np.random.RandomState(0)
+        V = np.zeros((60, 2))
+        V[:, 1] = random.uniform(3.0, 7.0, 60)
+        VBR = random.uniform(0.1, 1.0, 60)
+        VBR[::4] = 0  # vertices that are not buoys
+        V[1, 1] = 2.0  # fully submerged
+        V[2, 1] = 8.0  # dry
+
+        expected = np.zeros((60, 2))
+        for i, vertex in enumerate(V):
+            if VBR[i] > 0:
+                expected[i, 1] = forcesLib.get_boyant_force(vertex, VBR[i], hw)
+
+        # Act
+        B = forcesLib.compute_boyancy_forces(V, VBR, hw)
+
+        # Assert
+        self.assertEqual(B[1, 1], expected[1, 1])
+        self.assertEqual(B[2, 1], 0.0)
+        np.testing.assert_array_equal(B[:, 0], 0.0)
+        np.testing.assert_allclose(B, expected, rtol=1e-12)
+
+    def testBuoyancyJacobianMatchesDifferences(self):
+        # Arrange
+        hw = 5.0
+        delta = 1e-6
+        V = np.array([[0.0, 0.0], [1.0, 4.8], [2.0, 5.3], [3.0, 2.0], [4.0, 8.0]])
+        VBR = [0.0, 0.5, 0.5, 0.5, 0.5]
+        model = modelLib.SimulationModel(V, [[0, 1], [1, 2], [2, 3], [3, 4]], [1, 0, 0, 0, 0], [0, 0, 0, 0],
+                                         [1.0, 1.0, 1.0, 1.0], VBR)
+
+        forward = V.copy()
+        backward = V.copy()
+        forward[:, 1] += delta
+        backward[:, 1] -= delta
+        expected = (forcesLib.compute_boyancy_forces(forward, VBR, hw) -
+                    forcesLib.compute_boyancy_forces(backward, VBR, hw))[:, 1] / (2 * delta)
+
+        # Act
+        rows, cols, blocks = forcesLib.buoyancy_jacobian(model, V, hw)
+
+        # Assert
+        np.testing.assert_array_equal(rows, cols)
+        np.testing.assert_array_equal(model.free_vertices[rows], [1, 2])
+        np.testing.assert_allclose(blocks[:, 1, 1], expected[[1, 2]], rtol=1e-6)
+        np.testing.assert_array_equal(blocks[:, :, 0], 0.0)
+        np.testing.assert_array_equal(blocks[:, 0, 1], 0.0)
+
+    # Tensor Forces:
+
+    # Per edge reference implementation the vectorized kernel must reproduce
+    def tensor_forces_loop(self, V, E, EP, EL):
+        T = np.zeros((len(V), 2))
+
+        for i, edge in enumerate(E):
+            if EP[i] == 0:
+                force = forcesLib.compute_tensor_force_on_spring(edge, V, EL[i])
+            elif EP[i] == 2:
+                force = forcesLib.compute_tensor_force_on_rope(edge, V, EL[i])
+            else:
+                continue
+
+            T[edge[0]] += force
+            T[edge[1]] -= force
+
+        return T
+
+    def testTensorForcesMatchLoopOnExample(self):
+        # Arrange
+        model, hw = simulatorLib.setup_original_watergate_example2()
+        V, E, EP, EL = model.V, model.E, model.EP, model.EL
+        V = V + np.array([[0.0, 0.0], [0.0, 0.0], [0.0, 0.0], [0.05, -0.1], [0.2, 0.3]])
+
+        # Act
+        T = forcesLib.compute_tensor_forces(V, E, EP, EL)
+
+        # Assert
+        np.testing.assert_array_equal(T, self.tensor_forces_loop(V, E, EP, EL))
+
+    def testTensorForcesSlackRopeIsIgnored(self):
+        # Arrange
+        V = np.array([[0.0, 0.0], [1.0, 0.0]])
+        E = [[0, 1]]
+        EP = [2]
+        EL = [1.5]
+
+        # Act
+        T = forcesLib.compute_tensor_forces(V, E, EP, EL)
+
+        # Assert
+        np.testing.assert_array_equal(T, np.zeros((2, 2)))
+
+    def testTensorForcesMatchLoopOnScenarios(self):
+        scenarios_directory = os.path.join(os.path.dirname(__file__), '..', 'scenarios')
+        random = np.random.RandomState(0)
+
+        for name in ['watergate-40degrees-curvature.json', 'stackable-diagonals-5layers.json', 'myrtle.json']:
+            # Arrange
+            with open(os.path.join(scenarios_directory, name)) as data_file:
+                data = json.load(data_file)
+            model, hw, water_speed, time_step, max_iterations, simulation_method = simulatorLib.from_json(data)
+            V, E, EP, EL = model.V, model.E, model.EP, model.EL
+            V = V + random.uniform(-0.05, 0.05, V.shape)
+
+            # Act
+            T = forcesLib.compute_tensor_forces(V, E, EP, EL)
+
+            # Assert
+            np.testing.assert_array_equal(T, self.tensor_forces_loop(V, E, EP, EL), err_msg=name)
+
 
 def main():
     unittest.main()
@@ -0,0 +1,86 @@
+import json
+import struct
+
+import numpy as np
+import resultsLib
+
+# Binary frames of simulation batches, so clients can wrap the arrays in typed
+# arrays (e.g. Float32Array) instead of parsing them from text. A frame is
+#
+#   magic (4 bytes) | header length (uint32, little endian) | header | arrays
+#
+# where the header is UTF-8 JSON, padded with spaces so the arrays start at a
+# multiple of 8 bytes, and the arrays are the raw little endian values of the
+# positions [steps, num_v, 2], the forces [steps, num_v, 10] (see
+# resultsLib.force_components) and the water levels [steps], one after the
+# other. The header gives their dtype, shapes and byte offsets, the steps
+# [start, end) of the batch and the layout of the force columns. When only
+# some steps of the batch are sent (see decimationLib), the header lists them
+# as stepIndices.
+frame_magic = b'SGB1'
+frame_version = 1
+frame_dtypes = {'float32': '<f4', 'float64': '<f8'}
+frame_alignment = 8
+frame_arrays = ['vertexPositions', 'forces', 'waterLevel']
+
+
+# Columns of each force component in the forces of a frame
+def force_layout():
+    return {component: [2 * c, 2 * c + 1] for c, component in enumerate(resultsLib.force_components)}
+
+
+# noinspection PyPep8Naming
+def encode_frame(P, F, wl, start, dtype='float32', steps=None):
+    if dtype not in frame_dtypes:
+        raise ValueError("Unknown frame dtype: " + str(dtype))
+
+    arrays = [np.ascontiguousarray(array, dtype=frame_dtypes[dtype]) for array in (P, F, wl)]
+    header = {
+        'version': frame_version,
+        'dtype': dtype,
+        'byteOrder': 'little',
+        'steps': [start, start + len(wl) if steps is None else int(steps[-1]) + 1],
+        'numVertices': P.shape[1],
+        'forceComponents': force_layout(),
+        'arrays': []
+    }
+    if steps is not None:
+        header['stepIndices'] = [int(step) for step in steps]
+
+    # the offsets depend on the length of the header, which depends on the
+    # offsets: they are computed for a header long enough to hold them
+    sizes = [array.nbytes for array in arrays]
+    prefix = len(frame_magic) + 4
+    header_length = 0
+    while True:
+        offset = prefix + header_length
+        header['arrays'] = []
+        for name, array, size in zip(frame_arrays, arrays, sizes):
+            header['arrays'].append({'name': name, 'shape': list(array.shape), 'offset': offset})
+            offset += size
+        encoded = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        if len(encoded) <= header_length:
+            break
+        header_length = -(-(prefix + len(encoded)) // frame_alignment) * frame_alignment - prefix
+
+    encoded += b' ' * (header_length - len(encoded))
+
+    return b''.join([frame_magic, struct.pack('<I', header_length), encoded] + [array.tobytes() for array in arrays])
+
+
+# Header and arrays (views on frame, by name) of a frame
+def decode_frame(frame):
+    if frame[:len(frame_magic)] != frame_magic:
+        raise ValueError("Not a simulation frame")
+
+    prefix = len(frame_magic) + 4
+    header_length, = struct.unpack('<I', frame[len(frame_magic):prefix])
+    header = json.loads(bytes(frame[prefix:prefix + header_length]).decode('utf-8'))
+    dtype = np.dtype(frame_dtypes[header['dtype']])
+
+    arrays = {}
+    for array in header['arrays']:
+        count = int(np.prod(array['shape']))
+        arrays[array['name']] = np.frombuffer(frame, dtype, count, array['offset']).reshape(array['shape'])
+
+    return header, arrays
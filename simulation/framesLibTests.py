@@ -0,0 +1,63 @@
+import struct
+import unittest
+
+import framesLib
+import numpy as np
+
+
+# noinspection PyPep8Naming
+class FramesLibTests(unittest.TestCase):
+    def randomBatch(self, steps=7, num_v=5):
+        P = np.random.rand(steps, num_v, 2)
+        F = np.random.rand(steps, num_v, 10)
+        wl = np.random.rand(steps)
+
+        return P, F, wl
+
+    def testFrameRoundTrips(self):
+        # Arrange
+        P, F, wl = self.randomBatch()
+
+        # Act
+        header, arrays = framesLib.decode_frame(framesLib.encode_frame(P, F, wl, 40, 'float64'))
+
+        # Assert
+        self.assertEqual(header['steps'], [40, 47])
+        self.assertEqual(header['numVertices'], 5)
+        self.assertEqual(header['forceComponents']['tensor'], [4, 5])
+        np.testing.assert_array_equal(arrays['vertexPositions'], P)
+        np.testing.assert_array_equal(arrays['forces'], F)
+        np.testing.assert_array_equal(arrays['waterLevel'], wl)
+
+    def testArraysAreAlignedLittleEndianFloats(self):
+        # Arrange
+        P, F, wl = self.randomBatch()
+
+        # Act
+        frame = framesLib.encode_frame(P, F, wl, 0)
+        header, arrays = framesLib.decode_frame(frame)
+
+        # Assert
+        self.assertEqual(frame[:4], b'SGB1')
+        self.assertEqual(len(frame), header['arrays'][-1]['offset'] + 4 * len(wl))
+        for array in header['arrays']:
+            self.assertEqual(array['offset'] % 8, 0)
+        first_force, = struct.unpack('<f', frame[header['arrays'][1]['offset']:][:4])
+        self.assertEqual(first_force, np.float32(F[0, 0, 0]))
+        np.testing.assert_allclose(arrays['forces'], F, rtol=1e-6)
+
+    def testUnknownDtypeIsRejected(self):
+        # Arrange
+        P, F, wl = self.randomBatch()
+
+        # Act & Assert
+        with self.assertRaises(ValueError):
+            framesLib.encode_frame(P, F, wl, 0, 'float16')
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import numpy as np
+from scipy import sparse
+
+
+# Sparsity structure of the jacobian of the Backward Euler system. Unknowns are
+# grouped per free vertex (x, y, vx, vy), so the matrix is stored as 4x4 blocks
+# and a block (i, j) can only be nonzero if i == j or if some edge connects the
+# free vertices i and j. The structure depends only on the topology, so it is
+# computed once per simulation and every assembly only scatters the values
+# into the preallocated slots.
+# noinspection PyPep8Naming
+class JacobianPattern(object):
+    # offsets, inside a flattened 4x4 block, of the derivatives of the forces
+    # (rows 2 and 3) with respect to the positions (columns 0 and 1)
+    force_offsets = np.array([[2 * 4 + 0, 2 * 4 + 1], [3 * 4 + 0, 3 * 4 + 1]])
+
+    def __init__(self, E, num_v, free_vertices):
+        self.num_free_vertices = len(free_vertices)
+        self.shape = (4 * self.num_free_vertices, 4 * self.num_free_vertices)
+
+        self.vertex_to_free_vertex = np.full(num_v, -1, dtype=int)
+        self.vertex_to_free_vertex[free_vertices] = np.arange(self.num_free_vertices)
+
+        # every edge couples its free endpoints, in both directions
+        edges = np.asarray(E, dtype=int).reshape(-1, 2)
+        free_v = self.vertex_to_free_vertex[edges[:, 0]]
+        free_vj = self.vertex_to_free_vertex[edges[:, 1]]
+        coupled = (free_v >= 0) & (free_vj >= 0)
+
+        diagonal = np.arange(self.num_free_vertices)
+        rows = np.concatenate([diagonal, free_v[coupled], free_vj[coupled]])
+        cols = np.concatenate([diagonal, free_vj[coupled], free_v[coupled]])
+
+        # sorting keys by row and then column gives the BSR ordering directly
+        self.keys = np.unique(rows * self.num_free_vertices + cols)
+        block_rows = self.keys // self.num_free_vertices
+        self.indices = self.keys % self.num_free_vertices
+        self.indptr = np.zeros(self.num_free_vertices + 1, dtype=int)
+        self.indptr[1:] = np.cumsum(np.bincount(block_rows, minlength=self.num_free_vertices))
+
+        self.num_blocks = len(self.keys)
+        self.diagonal_slots = self.slots(diagonal, diagonal)
+
+    # Positions in the block list of the blocks (rows[i], cols[i])
+    def slots(self, rows, cols):
+        return np.searchsorted(self.keys, np.asarray(rows) * self.num_free_vertices + np.asarray(cols))
+
+    # Assembles R = I - k * JF, the jacobian of U^{n+1} - U^n - k F(U^{n+1}),
+    # from the force derivative blocks returned by the forcesLib kernels.
+    # Force derivatives are scaled by the damping factor, while the position
+    # rows get the derivative of the velocity columns.
+    def assemble(self, contributions, k, damping):
+        data = np.zeros(self.num_blocks * 16)
+
+        for rows, cols, blocks in contributions:
+            if len(rows) == 0:
+                continue
+
+            positions = self.slots(rows, cols)[:, None, None] * 16 + self.force_offsets
+            data += np.bincount(positions.reshape(-1), weights=np.asarray(blocks).reshape(-1),
+                                minlength=self.num_blocks * 16)
+
+        data = data.reshape((self.num_blocks, 4, 4))
+        data *= -k * damping
+
+        # identity and velocity derivatives (dx/dt = vx, dy/dt = vy)
+        data[self.diagonal_slots] += np.identity(4)
+        data[self.diagonal_slots, 0, 2] -= k
+        data[self.diagonal_slots, 1, 3] -= k
+
+        return sparse.bsr_matrix((data, self.indices, self.indptr), shape=self.shape).tocsr()
@@ -0,0 +1,533 @@
+import collections
+import multiprocessing
+import os
+import queue
+import re
+import time
+import uuid
+
+import cacheLib
+import decimationLib
+import framesLib
+import pacingLib
+import resultsLib
+import simulatorLib
+
+# Simulation methods offered to the clients (the simulationMethod of their
+# requests)
+simulation_methods = {
+    'Forward Euler': simulatorLib.simulate,
+    'Backward Euler': simulatorLib.implicit_simulation
+}
+default_simulation_method = 'Backward Euler'
+
+# how the batches reach the clients: 'json' lists or 'binary' frames (see
+# framesLib) of the precision they ask for
+transports = ['json', 'binary']
+default_transport = 'json'
+default_precision = 'float32'
+
+# where the jobs store their results, one directory per job
+default_results_directory = 'results'
+
+# messages a job may have waiting to be taken from the pool before its
+# simulation pauses (see pacingLib.BackpressurePacing)
+default_queued_batches = 2
+
+# ended jobs whose status the pool remembers, the oldest are forgotten first
+default_ended_jobs = 1000
+
+# steps of stored results returned at most by a results_page
+default_page_steps = 1000
+
+# job ids are uuid4 hex strings
+job_id_pattern = re.compile('^[0-9a-f]{32}$')
+
+
+# Message of a batch (see simulatorLib.batch_result) starting at step start,
+# as the clients receive it. With the binary transport, its arrays come in a
+# single frame of bytes instead of lists. If the batch was decimated, steps
+# are the steps of its rows, sent as stepIndices
+# noinspection PyPep8Naming
+def batch_message(batch, start=0, transport=default_transport, precision=default_precision, steps=None):
+    U, F, wl, total_steps, info = batch
+
+    message = {
+        'totalSteps': total_steps,
+        'statistics': info['statistics'],
+        'telemetry': info['telemetry']
+    }
+    if transport == 'binary':
+        message['frame'] = framesLib.encode_frame(U, F, wl, start, precision, steps)
+    else:
+        message['vertexPositions'] = U.tolist()
+        message['forces'] = F.tolist()
+        message['waterLevel'] = wl.tolist()
+        if steps is not None:
+            message['stepIndices'] = steps.tolist()
+
+    return message
+
+
+# Transport and precision of the batches of a request
+def batch_transport(post_body):
+    transport = post_body.get('transport', default_transport)
+    if not isinstance(transport, str) or transport not in transports:
+        raise ValueError("Unknown transport: " + str(transport))
+    precision = post_body.get('precision', default_precision)
+    if not isinstance(precision, str) or precision not in framesLib.frame_dtypes:
+        raise ValueError("Unknown precision: " + str(precision))
+
+    return transport, precision
+
+
+# The steps of a batch starting at step start its decimation keeps: the batch
+# with only their rows and their steps, or the batch as it is and None if it
+# keeps all of them
+# noinspection PyPep8Naming
+def decimate(decimation, batch, start):
+    U, F, wl, total_steps, info = batch
+    kept = decimation.select(start, U, F, wl)
+    if len(kept) == len(wl):
+        return batch, None
+
+    return (U[kept], F[kept], wl[kept], total_steps, info), start + kept
+
+
+def simulation_method(post_body):
+    name = post_body.get('simulationMethod', default_simulation_method)
+    if not isinstance(name, str) or name not in simulation_methods:
+        raise ValueError("Unknown simulation method: " + str(name))
+
+    return simulation_methods[name]
+
+
+# Runs the simulation of a request (see simulatorLib.from_json) in a worker
+# process. Its batches, and then how it ended, are put in messages, a bounded
+# queue, as tuples (event, job id, payload): ('results', id, batch message),
+# ('finished', id, None), ('canceled', id, None) or ('failed', id, error
+# message). Jobs that are not streamed only put their progress, ('progress',
+# id, {'stepsDone', 'totalSteps'}), instead of their batches; batch messages
+# carry it too. Batches are paced by how fast messages is drained and the
+# simulation waits while it is full, keeping only a bounded buffer of steps.
+# The cancel event is checked after every batch. With a cache (see
+# cacheLib.ResultCache), requests simulated before are replayed from it,
+# after a ('cached', id, None) message, and the results of new ones are
+# added to it. Requests asking for 'profile' carry the telemetry of the run
+# (see profileLib) in their batches.
+def run_job(job_id, post_body, messages, cancel, results_path, stream=True, cache=None):
+    try:
+        method = simulation_method(post_body)
+        transport, precision = batch_transport(post_body)
+        decimation = decimationLib.decimation_policy(post_body)
+        request = simulatorLib.from_json(post_body)
+        model, hw, water_speed, time_step, max_iterations, _ = request
+
+        options = {
+            'results_path': results_path,
+            'buffer_steps': simulatorLib.streaming_buffer_steps,
+            'pacing': pacingLib.BackpressurePacing(messages),
+            'profile': post_body.get('profile', False) is True
+        }
+        if method == simulatorLib.implicit_simulation:
+            options['report_path'] = os.path.join(results_path, 'results_data.txt')
+
+        key = cacheLib.cache_key(request) if cache is not None else None
+        cached = key is not None and cache.copy_out(key, results_path)
+        if cached:
+            messages.put(('cached', job_id, None))
+            simulation = cacheLib.replay(results_path, model, max_iterations)
+        else:
+            os.makedirs(results_path, exist_ok=True)
+            simulation = method(model, hw, water_speed, time_step, max_iterations, **options)
+
+        start = 0
+        for batch in simulation:
+            progress = {'stepsDone': start + len(batch[2]), 'totalSteps': batch[3]}
+            if stream:
+                sent, steps = decimate(decimation, batch, start)
+                message = batch_message(sent, start, transport, precision, steps)
+                messages.put(('results', job_id, dict(message, **progress)))
+            else:
+                messages.put(('progress', job_id, progress))
+            start += len(batch[2])
+            if cancel.is_set():
+                simulation.close()
+                messages.put(('canceled', job_id, None))
+                return
+
+        if key is not None and not cached:
+            cache.store(key, results_path)
+        messages.put(('finished', job_id, None))
+    except Exception as error:
+        messages.put(('failed', job_id, str(error)))
+
+
+# Worker process of a SimulationPool: runs the jobs it takes from tasks, as
+# (job id, request, results path, stream), one at a time until it takes None,
+# all of them putting their messages in messages and checking cancel (see
+# run_job)
+def run_worker(tasks, messages, cancel, cache):
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+
+        job_id, post_body, results_path, stream = task
+        run_job(job_id, post_body, messages, cancel, results_path, stream, cache)
+
+
+# A worker process of the pool and the queues it shares with it: its tasks,
+# the messages of its jobs (at most queued_batches waiting) and the cancel
+# event of the job it runs, if any
+class SimulationWorker(object):
+    def __init__(self, context, queued_batches, cache):
+        self.tasks = context.SimpleQueue()
+        self.messages = context.Queue(maxsize=queued_batches)
+        self.cancel_event = context.Event()
+        self.job = None
+        self.process = context.Process(target=run_worker, args=(self.tasks, self.messages, self.cancel_event, cache),
+                                       daemon=True)
+        self.process.start()
+
+    def run(self, job, results_path):
+        self.job = job
+        self.cancel_event.clear()
+        self.tasks.put((job.id, job.post_body, results_path, job.stream))
+
+    def stop(self):
+        if self.process.is_alive():
+            self.tasks.put(None)
+        self.process.join()
+
+
+# A simulation request and its state in the pool: 'queued', waiting for a
+# free slot, 'running', or how it ended ('finished', 'canceled' or 'failed',
+# with its error). owner identifies who asked for it (e.g. the socket
+# session of the client), so only they can cancel it. Only streamed jobs
+# send their batches (see run_job).
+class SimulationJob(object):
+    def __init__(self, job_id, post_body, owner=None, stream=True):
+        self.id = job_id
+        self.post_body = post_body
+        self.owner = owner
+        self.stream = stream
+        self.state = 'queued'
+        self.steps_done = 0
+        self.total_steps = None
+        self.error = None
+        self.cached = False
+        self.worker = None
+        self.cancel_event = None
+        self.messages = None
+        self.held = None
+        self.canceling = False
+
+    # Updates the state and progress of the job with one of its messages
+    def record(self, event, payload):
+        if event in ('results', 'progress'):
+            self.steps_done = payload['stepsDone']
+            self.total_steps = payload['totalSteps']
+        elif event == 'started':
+            self.state = 'running'
+        elif event == 'cached':
+            self.cached = True
+        elif event in ('finished', 'canceled', 'failed'):
+            self.state = event
+            self.error = payload if event == 'failed' else None
+
+    def status(self):
+        return {
+            'jobId': self.id,
+            'state': self.state,
+            'stepsDone': self.steps_done,
+            'totalSteps': self.total_steps,
+            'error': self.error,
+            'cached': self.cached
+        }
+
+
+# Pool of worker processes running simulation jobs, so the numerical work
+# neither blocks the server nor is limited to one core. At most
+# max_concurrent_jobs (by default, one per worker) run at a time, the rest
+# wait in order of arrival. The server submits the requests and polls the
+# messages of the jobs (see run_job), without ever blocking on them. Each job
+# has a queue of at most queued_batches messages, so a job whose messages are
+# not taken pauses. Besides the ones of the workers, the pool sends
+# ('queued', id, position in the queue) for jobs that have to wait and
+# ('started', id, None) when they start. The status of the last ended_jobs
+# jobs is kept after they end, and the one of older jobs is read from their
+# stored results. Jobs share the result cache, if any. Workers are spawned
+# rather than forked, so they do not inherit the state of the server (e.g.
+# its monkey patched sockets), and talk to it through pipes and semaphores
+# only: a multiprocessing manager would connect through the sockets of the
+# server, which eventlet makes non-blocking.
+class SimulationPool(object):
+    def __init__(self, workers=None, results_directory=default_results_directory, max_concurrent_jobs=None,
+                 queued_batches=default_queued_batches, ended_jobs=default_ended_jobs, cache=None):
+        self.context = multiprocessing.get_context('spawn')
+        workers = workers if workers is not None else os.cpu_count() or 1
+        self.queued_batches = queued_batches
+        self.results_directory = results_directory
+        self.cache = cache
+        self.max_concurrent_jobs = max_concurrent_jobs if max_concurrent_jobs is not None else workers
+        self.workers = [SimulationWorker(self.context, queued_batches, cache) for _ in range(0, workers)]
+
+        self.active = {}
+        self.ended = collections.OrderedDict()
+        self.max_ended_jobs = ended_jobs
+        self.waiting = collections.deque()
+        self.pool_messages = []
+
+    # Queues the simulation of a request and returns the id of its job.
+    # Raises ValueError if the request is not a dictionary, its simulation
+    # method, transport or decimation is unknown, or its maximum of
+    # iterations invalid. Jobs that are not streamed only report their
+    # progress, their results are read from the store (see results_page), so
+    # they cannot be unlimited.
+    def submit(self, post_body, owner=None, stream=True):
+        if not isinstance(post_body, dict):
+            raise ValueError("A simulation request must be an object")
+        simulation_method(post_body)
+        if simulatorLib.iteration_limit(post_body) is None and not stream:
+            raise ValueError("Only streamed jobs may be unlimited")
+        batch_transport(post_body)
+        decimationLib.decimation_policy(post_body)
+
+        job = SimulationJob(uuid.uuid4().hex, post_body, owner, stream)
+        self.active[job.id] = job
+        self.waiting.append(job)
+        self.start_waiting_jobs()
+
+        if job.state == 'queued':
+            self.pool_messages.append(('queued', job.id, len(self.waiting)))
+
+        return job.id
+
+    def start_waiting_jobs(self):
+        running = sum(1 for job in self.active.values() if job.state == 'running')
+        free_workers = [worker for worker in self.workers if worker.job is None]
+        while len(self.waiting) > 0 and running < self.max_concurrent_jobs and len(free_workers) > 0:
+            job = self.waiting.popleft()
+            job.state = 'running'
+            job.worker = free_workers.pop()
+            job.cancel_event = job.worker.cancel_event
+            job.messages = job.worker.messages
+            job.worker.run(job, self.results_path(job.id))
+            self.pool_messages.append(('started', job.id, None))
+            running += 1
+
+    # Replaces a worker that died, failing its job
+    def replace_worker(self, worker):
+        job = worker.job
+        error = f"Worker process exited with code {worker.process.exitcode}"
+        self.pool_messages.append(('failed', job.id, error))
+        job.record('failed', error)
+        self.forget(job.id)
+
+        worker.process.join()
+        self.workers[self.workers.index(worker)] = SimulationWorker(self.context, self.queued_batches, self.cache)
+
+    # Stops a job after its next batch, or drops it if still waiting. Only
+    # its owner (if given) may cancel it. Returns whether it was cancelled.
+    # The batches a canceled job still sends are dropped rather than
+    # waiting to be taken.
+    def cancel(self, job_id, owner=None):
+        job = self.active.get(job_id)
+        if job is None or (owner is not None and job.owner != owner):
+            return False
+
+        if job.state == 'queued':
+            self.waiting.remove(job)
+            job.record('canceled', None)
+            self.forget(job_id)
+            self.pool_messages.append(('canceled', job_id, None))
+        else:
+            job.cancel_event.set()
+            job.canceling = True
+
+        return True
+
+    # Cancels all jobs, or the ones of owner
+    def cancel_all(self, owner=None):
+        for job_id in self.jobs(owner):
+            self.cancel(job_id, owner)
+
+    # Ids of the running and waiting jobs, or of the ones of owner
+    def jobs(self, owner=None):
+        return [job.id for job in self.active.values() if owner is None or job.owner == owner]
+
+    # Running, waiting or recently ended job
+    def job(self, job_id):
+        return self.active.get(job_id, self.ended.get(job_id))
+
+    def results_path(self, job_id):
+        return os.path.join(self.results_directory, job_id)
+
+    # Status of a job (see SimulationJob.status), or None if unknown. Jobs
+    # the pool no longer remembers are 'finished' if their stored results
+    # are complete, 'incomplete' otherwise, and unknown if they have none
+    # (e.g. their worker died before writing any).
+    def status(self, job_id):
+        job = self.job(job_id)
+        if job is not None:
+            return job.status()
+
+        if not job_id_pattern.match(job_id):
+            return None
+        try:
+            metadata = resultsLib.read_metadata(self.results_path(job_id))
+        except (OSError, ValueError):
+            return None
+        return {
+            'jobId': job_id,
+            'state': 'finished' if metadata['complete'] else 'incomplete',
+            'stepsDone': metadata['total_steps'],
+            'totalSteps': metadata['total_steps'] if metadata['complete'] else None,
+            'error': None,
+            'cached': False
+        }
+
+    # Messages of the jobs available right now, at most max_messages of them
+    # from the workers. credits, if given, tells how many more batches the
+    # consumer takes of a job (see DeliveryWindow): the job keeps the rest,
+    # and pauses once its queue is full. Jobs whose worker died are reported
+    # as failed. Jobs that ended free their slot for the waiting ones.
+    def poll(self, max_messages=100, credits=None):
+        messages = self.pool_messages
+        self.pool_messages = []
+        received = 0
+        for job in list(self.active.values()):
+            allowed = credits(job.id) if credits is not None and not job.canceling else None
+            while job.messages is not None and received < max_messages:
+                message = job.held if job.held is not None else self.next_message(job)
+                job.held = None
+                if message is None:
+                    break
+
+                received += 1
+                if message[0] == 'results':
+                    if job.canceling:
+                        continue
+                    if allowed is not None:
+                        if allowed <= 0:
+                            job.held = message
+                            break
+                        allowed -= 1
+                messages.append(message)
+
+        # a worker that died with nothing left in its queue took its job with it
+        for worker in list(self.workers):
+            job = worker.job
+            if job is not None and not worker.process.is_alive() and job.held is None and worker.messages.empty():
+                self.replace_worker(worker)
+
+        for event, job_id, payload in messages:
+            job = self.active.get(job_id)
+            if job is not None:
+                job.record(event, payload)
+            if event in ('finished', 'canceled', 'failed'):
+                self.forget(job_id)
+
+        self.start_waiting_jobs()
+        if len(self.pool_messages) > 0:
+            messages += self.pool_messages
+            self.pool_messages = []
+
+        return messages
+
+    @staticmethod
+    def next_message(job):
+        try:
+            return job.messages.get_nowait()
+        except queue.Empty:
+            return None
+
+    # Moves a job that ended to the ended ones, freeing its worker
+    def forget(self, job_id):
+        job = self.active.pop(job_id, None)
+        if job is None:
+            return
+
+        if job.worker is not None:
+            job.worker.job = None
+            job.worker = job.cancel_event = job.messages = None
+
+        self.ended[job_id] = job
+        while len(self.ended) > self.max_ended_jobs:
+            self.ended.popitem(last=False)
+
+    # Cancels the jobs and waits for them to end, taking their messages so
+    # none waits on a full queue
+    def shutdown(self):
+        self.cancel_all()
+        while len(self.active) > 0:
+            self.poll()
+            time.sleep(0.01)
+        for worker in self.workers:
+            worker.stop()
+
+
+# Batches sent to the consumers of each job and not acknowledged yet, at most
+# max_in_flight of them, so a slow client is not flooded: its jobs pause
+# instead (see SimulationPool.poll). Batches not acknowledged within
+# ack_timeout seconds (e.g. lost, or a client that does not acknowledge) no
+# longer count.
+class DeliveryWindow(object):
+    def __init__(self, max_in_flight=2, ack_timeout=10.0):
+        self.max_in_flight = max_in_flight
+        self.ack_timeout = ack_timeout
+        self.in_flight = collections.defaultdict(collections.deque)
+
+    def sent(self, job_id):
+        self.in_flight[job_id].append(time.time())
+
+    def acknowledged(self, job_id):
+        in_flight = self.in_flight.get(job_id)
+        if in_flight:
+            in_flight.popleft()
+
+    # Batches of the job the consumer takes now
+    def credits(self, job_id):
+        in_flight = self.in_flight.get(job_id)
+        if not in_flight:
+            return self.max_in_flight
+
+        expired = time.time() - self.ack_timeout
+        while in_flight and in_flight[0] < expired:
+            in_flight.popleft()
+
+        return max(self.max_in_flight - len(in_flight), 0)
+
+    def forget(self, job_id):
+        self.in_flight.pop(job_id, None)
+
+
+# Steps start to end (excluded, as in slices) of the results stored at
+# results_path, at most max_steps of them, with the range they cover and
+# the start of the next page (None once at the end of the stored steps).
+# With the binary transport, the steps come as a frame (see framesLib).
+# Raises FileNotFoundError if no results are stored at results_path yet.
+# noinspection PyPep8Naming
+def results_page(results_path, start=0, end=None, max_steps=default_page_steps, transport=default_transport,
+                 precision=default_precision):
+    reader = resultsLib.ResultReader(results_path)
+    start, end = reader.step_range(start, end)
+    end = min(end, start + max_steps)
+    P, F, wl = reader.positions(start, end), reader.forces(start, end), reader.water_level(start, end)
+
+    page = {
+        'start': start,
+        'end': end,
+        'next': end if end < reader.num_steps else None,
+        'storedSteps': reader.num_steps,
+        'complete': reader.metadata['complete']
+    }
+    if transport == 'binary':
+        page['frame'] = framesLib.encode_frame(P, F, wl, start, precision)
+    else:
+        page['vertexPositions'] = P.tolist()
+        page['forces'] = F.tolist()
+        page['waterLevel'] = wl.tolist()
+
+    return page
@@ -0,0 +1,384 @@
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import cacheLib
+import framesLib
+import jobsLib
+import numpy as np
+import resultsLib
+import simulatorLib
+
+
+# Runs the request in request_path through a pool polled from a green thread,
+# as the server does (importing jobsLib before monkey patching the standard
+# library with eventlet), and prints the events of its job as JSON. Run it in
+# a process of its own: the monkey patching cannot be undone.
+def runJobUnderEventlet(request_path, results_directory):
+    import eventlet
+    eventlet.monkey_patch()
+
+    with open(request_path) as f:
+        request = json.load(f)
+    pool = jobsLib.SimulationPool(workers=1, results_directory=results_directory)
+    job_id = pool.submit(request)
+    events = []
+
+    def forwardMessages():
+        while pool.status(job_id)['state'] in ('queued', 'running'):
+            events.extend(event for event, _, _ in pool.poll())
+            eventlet.sleep(0.01)
+
+    eventlet.spawn(forwardMessages).wait()
+    pool.shutdown()
+    print(json.dumps(events))
+
+
+# noinspection PyPep8Naming
+class JobsLibTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.pool = jobsLib.SimulationPool(workers=2, results_directory=cls.directory)
+
+        scenarios_directory = os.path.join(os.path.dirname(__file__), '..', 'scenarios')
+        with open(os.path.join(scenarios_directory, 'boyant_end_split_edges.json')) as data_file:
+            cls.scenario = json.load(data_file)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.shutdown()
+        shutil.rmtree(cls.directory)
+
+    def request(self, **settings):
+        post_body = dict(self.scenario)
+        post_body.update(settings)
+
+        return post_body
+
+    # Polls the pool until all the given jobs ended, returning their messages
+    def messagesUntilEnded(self, job_ids, pool=None, timeout=120):
+        pool = pool if pool is not None else self.pool
+        messages = {job_id: [] for job_id in job_ids}
+        ended = set()
+        deadline = time.time() + timeout
+        while ended != set(job_ids) and time.time() < deadline:
+            for event, job_id, payload in pool.poll():
+                messages[job_id].append((event, payload))
+                if event in ('finished', 'canceled', 'failed'):
+                    ended.add(job_id)
+            time.sleep(0.01)
+
+        return messages
+
+    def testJobsRunConcurrentlyInWorkers(self):
+        # Arrange
+        first = self.request(simulationMethod='Forward Euler', timeStep='0.0001', maxIterations=200)
+        second = self.request(simulationMethod='Backward Euler', timeStep='0.001', maxIterations=20)
+
+        # Act
+        job_ids = [self.pool.submit(first), self.pool.submit(second)]
+        messages = self.messagesUntilEnded(job_ids)
+
+        # Assert
+        for job_id, steps in zip(job_ids, [198, 18]):
+            events = [event for event, _ in messages[job_id]]
+            self.assertEqual(events[-1], 'finished')
+            batches = [payload for event, payload in messages[job_id] if event == 'results']
+            self.assertEqual(sum(len(batch['waterLevel']) for batch in batches), steps)
+            self.assertEqual(np.array(batches[0]['forces']).shape[1:], (len(self.scenario['verteces']), 10))
+            self.assertTrue(os.path.exists(os.path.join(self.directory, job_id, 'metadata.json')))
+        self.assertEqual(self.pool.jobs(), [])
+
+    def testOnlyProfiledJobsCarryTelemetry(self):
+        # Arrange
+        profiled = self.request(simulationMethod='Backward Euler', timeStep='0.001', maxIterations=10, profile=True)
+        unprofiled = self.request(simulationMethod='Backward Euler', timeStep='0.001', maxIterations=10)
+
+        # Act
+        job_ids = [self.pool.submit(profiled), self.pool.submit(unprofiled)]
+        messages = self.messagesUntilEnded(job_ids)
+
+        # Assert
+        telemetry = [[payload['telemetry'] for event, payload in messages[job_id] if event == 'results']
+                     for job_id in job_ids]
+        self.assertGreater(telemetry[0][-1]['run']['counters']['njev'], 0)
+        self.assertGreater(telemetry[0][-1]['run']['seconds']['jacobian'], 0.0)
+        self.assertEqual(set(map(type, telemetry[1])), {type(None)})
+
+    def testCancelStopsOnlyThatJob(self):
+        # Arrange
+        endless = self.request(simulationMethod='Forward Euler', timeStep='0.0001', unlimited=True)
+        short = self.request(simulationMethod='Forward Euler', timeStep='0.0001', maxIterations=50)
+
+        # Act
+        endless_id = self.pool.submit(endless)
+        short_id = self.pool.submit(short)
+        self.pool.cancel(endless_id)
+        messages = self.messagesUntilEnded([endless_id, short_id])
+
+        # Assert
+        self.assertEqual(messages[endless_id][-1][0], 'canceled')
+        self.assertEqual(messages[short_id][-1][0], 'finished')
+
+    def testJobsBeyondTheLimitWaitTheirTurn(self):
+        # Arrange
+        pool = jobsLib.SimulationPool(workers=1, results_directory=self.directory, max_concurrent_jobs=1)
+        request = self.request(simulationMethod='Forward Euler', timeStep='0.0001', maxIterations=50)
+
+        # Act
+        try:
+            first_id = pool.submit(request, owner='alice')
+            second_id = pool.submit(request, owner='bob')
+            third_id = pool.submit(request, owner='bob')
+            canceled_by_other = pool.cancel(third_id, owner='alice')
+            canceled_by_owner = pool.cancel(third_id, owner='bob')
+            messages = self.messagesUntilEnded([first_id, second_id, third_id], pool)
+        finally:
+            pool.shutdown()
+
+        # Assert
+        self.assertFalse(canceled_by_other)
+        self.assertTrue(canceled_by_owner)
+        self.assertEqual([event for event, _ in messages[third_id]], ['queued', 'canceled'])
+        self.assertEqual(messages[second_id][0], ('queued', 1))
+        self.assertEqual(messages[second_id][1], ('started', None))
+        self.assertEqual(messages[second_id][-1][0], 'finished')
+        self.assertEqual(messages[first_id][0], ('started', None))
+
+    def testBinaryTransportSendsFrames(self):
+        # Arrange
+        request = self.request(simulationMethod='Forward Euler', timeStep='0.0001', maxIterations=100,
+                               transport='binary', precision='float64')
+
+        # Act
+        job_id = self.pool.submit(request)
+        messages = self.messagesUntilEnded([job_id])
+
+        # Assert
+        frames = [framesLib.decode_frame(payload['frame']) for event, payload in messages[job_id]
+                  if event == 'results']
+        self.assertEqual(frames[0][0]['steps'][0], 0)
+        for (previous, _), (header, _) in zip(frames, frames[1:]):
+            self.assertEqual(header['steps'][0], previous['steps'][1])
+        self.assertEqual(frames[-1][0]['steps'][1], 98)
+        self.assertEqual(frames[0][1]['forces'].shape[1:], (len(self.scenario['verteces']), 10))
+
+    def testDecimatedJobsSendSomeSteps(self):
+        # Arrange
+        request = self.request(simulationMethod='Forward Euler', timeStep='0.0001', maxIterations=100,
+                               decimation={'policy': 'stride', 'stride': 10})
+
+        # Act
+        job_id = self.pool.submit(request)
+        messages = self.messagesUntilEnded([job_id])
+
+        # Assert
+        batches = [payload for event, payload in messages[job_id] if event == 'results']
+        steps = sum((batch['stepIndices'] for batch in batches), [])
+        last_steps = [batch['stepIndices'][-1] for batch in batches]
+        self.assertEqual(sorted(set(steps)), steps)
+        self.assertEqual([step for step in steps if step not in last_steps], [s for s in range(0, 98, 10)
+                                                                              if s not in last_steps])
+        self.assertEqual(steps[-1], 97)
+        self.assertEqual(sum(len(batch['waterLevel']) for batch in batches), len(steps))
+        stored = resultsLib.ResultReader(os.path.join(self.directory, job_id))
+        self.assertEqual(stored.num_steps, 98)
+
+    def testJobsPauseWhileTheConsumerTakesNoBatches(self):
+        # Arrange
+        endless = self.request(simulationMethod='Forward Euler', timeStep='0.0001', unlimited=True)
+        no_credits = {}
+        one_credit = {}
+
+        # Act
+        job_id = self.pool.submit(endless)
+        deadline = time.time() + 1.0
+        while time.time() < deadline:
+            for event, _, payload in self.pool.poll(credits=lambda _: 0):
+                no_credits.setdefault(event, []).append(payload)
+            time.sleep(0.01)
+        for event, _, payload in self.pool.poll(credits=lambda _: 1):
+            one_credit.setdefault(event, []).append(payload)
+        self.pool.cancel(job_id)
+        self.messagesUntilEnded([job_id])
+
+        # Assert
+        self.assertNotIn('results', no_credits)
+        self.assertEqual(len(one_credit['results']), 1)
+        self.assertLessEqual(len(one_credit['results'][0]['waterLevel']), simulatorLib.streaming_buffer_steps)
+
+    def testDeliveryWindowLimitsBatchesInFlight(self):
+        # Arrange
+        window = jobsLib.DeliveryWindow(max_in_flight=2, ack_timeout=1000.0)
+
+        # Act
+        window.sent('a')
+        window.sent('a')
+        full = window.credits('a')
+        window.acknowledged('a')
+        acknowledged = window.credits('a')
+        window.ack_timeout = 0.0
+        expired = window.credits('a')
+
+        # Assert
+        self.assertEqual((full, acknowledged, expired), (0, 1, 2))
+        self.assertEqual(window.credits('b'), 2)
+
+    def testUnstreamedJobsReportProgressAndServeStoredResults(self):
+        # Arrange
+        request = self.request(simulationMethod='Forward Euler', timeStep='0.0001', maxIterations=100)
+
+        # Act
+        job_id = self.pool.submit(request, stream=False)
+        messages = self.messagesUntilEnded([job_id])
+        status = self.pool.status(job_id)
+        first = jobsLib.results_page(self.pool.results_path(job_id), 0, None, max_steps=60)
+        second = jobsLib.results_page(self.pool.results_path(job_id), first['next'], None, max_steps=60,
+                                      transport='binary', precision='float64')
+
+        # Assert
+        events = [event for event, _ in messages[job_id]]
+        self.assertNotIn('results', events)
+        self.assertEqual(messages[job_id][-2][1], {'stepsDone': 98, 'totalSteps': 100})
+        self.assertEqual(status, {'jobId': job_id, 'state': 'finished', 'stepsDone': 98, 'totalSteps': 100,
+                                  'error': None, 'cached': False})
+        self.assertEqual((first['start'], first['end'], first['next']), (0, 60, 60))
+        self.assertEqual(len(first['waterLevel']), 60)
+        header, arrays = framesLib.decode_frame(second['frame'])
+        self.assertEqual(header['steps'], [60, 98])
+        self.assertIsNone(second['next'])
+        stored = resultsLib.ResultReader(self.pool.results_path(job_id))
+        np.testing.assert_array_equal(arrays['forces'], stored.forces(60, 98))
+
+    def testStatusOfForgottenJobsComesFromTheirResults(self):
+        # Arrange
+        request = self.request(simulationMethod='Forward Euler', timeStep='0.0001', maxIterations=30)
+        job_id = self.pool.submit(request, stream=False)
+        self.messagesUntilEnded([job_id])
+
+        # Act
+        self.pool.ended.clear()
+        status = self.pool.status(job_id)
+
+        # Assert
+        self.assertEqual((status['state'], status['stepsDone']), ('finished', 28))
+        self.assertIsNone(self.pool.status('0' * 32))
+        self.assertIsNone(self.pool.status('../' + job_id))
+
+    def testJobsWithoutStoredResultsAreUnknown(self):
+        # Arrange
+        job_id = 'f' * 32
+        os.makedirs(self.pool.results_path(job_id))
+
+        # Act
+        status = self.pool.status(job_id)
+
+        # Assert
+        self.assertIsNone(status)
+        with self.assertRaises(FileNotFoundError):
+            jobsLib.results_page(self.pool.results_path(job_id))
+
+    def testIdenticalRequestsAreReplayedFromTheCache(self):
+        # Arrange
+        cache = cacheLib.ResultCache(os.path.join(self.directory, 'cache'))
+        pool = jobsLib.SimulationPool(workers=1, results_directory=self.directory, cache=cache)
+        request = self.request(simulationMethod='Forward Euler', timeStep='0.0001', maxIterations=100)
+        same_request = self.request(simulationMethod='Forward Euler', timeStep=0.0001, maxIterations='100')
+
+        # Act
+        try:
+            first_id = pool.submit(request)
+            first = self.messagesUntilEnded([first_id], pool)[first_id]
+            second_id = pool.submit(same_request)
+            second = self.messagesUntilEnded([second_id], pool)[second_id]
+            cached = pool.status(second_id)['cached']
+        finally:
+            pool.shutdown()
+
+        # Assert
+        self.assertNotIn('cached', [event for event, _ in first])
+        self.assertIn('cached', [event for event, _ in second])
+        self.assertTrue(cached)
+        replayed = [payload for event, payload in second if event == 'results']
+        self.assertEqual(replayed[-1]['stepsDone'], 98)
+        self.assertIsNone(replayed[-1]['telemetry'])
+        simulated = resultsLib.ResultReader(os.path.join(self.directory, first_id))
+        np.testing.assert_array_equal(np.concatenate([batch['forces'] for batch in replayed]), simulated.forces())
+        np.testing.assert_array_equal(resultsLib.ResultReader(os.path.join(self.directory, second_id)).forces(),
+                                      simulated.forces())
+
+    def testWorkerThatDiesFailsItsJobAndIsReplaced(self):
+        # Arrange
+        pool = jobsLib.SimulationPool(workers=1, results_directory=self.directory)
+        endless = pool.submit(self.request(simulationMethod='Forward Euler', timeStep='0.0001', unlimited=True))
+        worker = pool.job(endless).worker
+
+        # Act
+        worker.process.kill()
+        endless_messages = self.messagesUntilEnded([endless], pool)
+        short = pool.submit(self.request(simulationMethod='Forward Euler', timeStep='0.0001', maxIterations=30))
+        short_messages = self.messagesUntilEnded([short], pool)
+        pool.shutdown()
+
+        # Assert
+        self.assertEqual(endless_messages[endless][-1][0], 'failed')
+        self.assertEqual(pool.status(endless)['state'], 'failed')
+        self.assertEqual(short_messages[short][-1], ('finished', None))
+        self.assertIsNot(pool.workers[0], worker)
+
+    @unittest.skipIf(importlib.util.find_spec('eventlet') is None, "eventlet is not installed")
+    def testJobsRunUnderEventlet(self):
+        # Arrange
+        request_path = os.path.join(self.directory, 'request.json')
+        with open(request_path, 'w') as f:
+            json.dump(self.request(simulationMethod='Forward Euler', timeStep='0.0001', maxIterations=50), f)
+        command = f"import jobsLibTests; jobsLibTests.runJobUnderEventlet({request_path!r}, {self.directory!r})"
+
+        # Act
+        run = subprocess.run([sys.executable, '-W', 'ignore', '-c', command], cwd=os.path.dirname(__file__) or '.',
+                             capture_output=True, text=True, timeout=120)
+
+        # Assert
+        self.assertEqual(run.returncode, 0, run.stderr)
+        self.assertEqual(json.loads(run.stdout.splitlines()[-1]), ['started', 'results', 'finished'])
+
+    def testUnknownMethodIsRejected(self):
+        # Act & Assert
+        with self.assertRaises(ValueError):
+            self.pool.submit(self.request(simulationMethod='Runge Kutta'))
+        with self.assertRaises(ValueError):
+            self.pool.submit(self.request(transport='xml'))
+
+    def testMalformedRequestsAreRejected(self):
+        # Arrange
+        jobs = self.pool.jobs()
+
+        # Act & Assert
+        for post_body in [None, [self.scenario], 'simulate', self.request(decimation='fps'),
+                          self.request(simulationMethod=['Forward Euler']), self.request(precision={})]:
+            with self.assertRaises(ValueError):
+                self.pool.submit(post_body)
+        self.assertEqual(self.pool.jobs(), jobs)
+
+    def testIterationLimitMustBeGivenOrExplicitlyUnlimited(self):
+        # Act & Assert
+        for max_iterations in [0, -1, '', None]:
+            with self.assertRaises(ValueError):
+                self.pool.submit(self.request(maxIterations=max_iterations))
+        with self.assertRaises(ValueError):
+            self.pool.submit(self.request(unlimited=True), stream=False)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import json
+import sys
+import time
+
+import numpy as np
+
+# Levels of the events, as in the logging module
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+level_names = {DEBUG: 'debug', INFO: 'info', WARNING: 'warning', ERROR: 'error'}
+
+# Minimum time between two events with the same name sent through
+# Logger.sample, in seconds
+default_sample_interval = 1.0
+
+
+# Converts numpy values of the events to plain python ones
+def to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+
+    raise TypeError("Not JSON serializable: " + str(type(value)))
+
+
+# Writes each event as one JSON line to a stream or to the file at path
+class NdjsonSink(object):
+    def __init__(self, stream=None, path=None):
+        self.stream = open(path, 'a') if path is not None else stream
+        self.owned = path is not None
+
+    def __call__(self, event):
+        self.stream.write(json.dumps(event, default=to_json) + '\n')
+        self.stream.flush()
+
+    def close(self):
+        if self.owned:
+            self.stream.close()
+
+
+# Keeps the events in memory, or hands them to a callback
+class MemorySink(object):
+    def __init__(self, callback=None):
+        self.events = []
+        self.callback = callback
+
+    def __call__(self, event):
+        if self.callback is not None:
+            self.callback(event)
+        else:
+            self.events.append(event)
+
+
+# Human readable lines, as the simulator used to print
+class TextSink(object):
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def __call__(self, event):
+        fields = ' '.join(f"{key}={value}" for key, value in event.items()
+                          if key not in ('time', 'level', 'event'))
+        print(f"[{event['level']}] {event['event']} {fields}", file=self.stream or sys.stdout)
+
+
+# Sends structured events (a name and keyword fields) at or above a level to
+# a sink. Disabled events cost a comparison, and their fields are neither
+# formatted nor converted. Hot loops check is_enabled once and only build
+# their fields if needed, and send per step diagnostics through sample, which
+# lets at most one event with the same name through every sample_interval
+# seconds, counting the ones it drops.
+class Logger(object):
+    def __init__(self, level=INFO, sink=None, sample_interval=default_sample_interval):
+        self.level = level
+        self.sink = sink if sink is not None else TextSink()
+        self.sample_interval = sample_interval
+        self.last_sampled = {}
+        self.suppressed = {}
+
+    def is_enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, event, **fields):
+        if level < self.level:
+            return
+
+        record = {'time': time.time(), 'level': level_names.get(level, level), 'event': event}
+        record.update(fields)
+        self.sink(record)
+
+    # Rate limited log: the fields of dropped events are not even evaluated if
+    # given as a callable returning them
+    def sample(self, level, event, fields=None, **more_fields):
+        if level < self.level:
+            return
+
+        now = time.time()
+        if now - self.last_sampled.get(event, -np.inf) < self.sample_interval:
+            self.suppressed[event] = self.suppressed.get(event, 0) + 1
+            return
+
+        self.last_sampled[event] = now
+        if callable(fields):
+            fields = fields()
+        more_fields.update(fields or {})
+        self.log(level, event, suppressed=self.suppressed.pop(event, 0), **more_fields)
+
+    def debug(self, event, **fields):
+        self.log(DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(ERROR, event, **fields)
+
+
+# Logger used when none is given: information about the runs (as their
+# summary) to stdout, no per step diagnostics
+default_logger = Logger(INFO)
+
+
+# Replaces the default logger
+def configure(level=INFO, sink=None, sample_interval=default_sample_interval):
+    global default_logger
+    default_logger = Logger(level, sink, sample_interval)
+
+    return default_logger
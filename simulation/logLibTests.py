@@ -0,0 +1,80 @@
+import io
+import json
+import unittest
+
+import logLib
+import numpy as np
+import simulatorLib
+
+
+# noinspection PyPep8Naming
+class LogLibTests(unittest.TestCase):
+    def testDisabledEventsAreNotEvaluated(self):
+        # Arrange
+        sink = logLib.MemorySink()
+        logger = logLib.Logger(logLib.INFO, sink)
+
+        def fields():
+            raise AssertionError("fields of a disabled event were evaluated")
+
+        # Act
+        logger.sample(logLib.DEBUG, 'step', fields)
+        logger.debug('batch', start=0, end=10)
+
+        # Assert
+        self.assertFalse(logger.is_enabled(logLib.DEBUG))
+        self.assertEqual(sink.events, [])
+
+    def testSampledEventsAreRateLimited(self):
+        # Arrange
+        sink = logLib.MemorySink()
+        logger = logLib.Logger(logLib.DEBUG, sink, sample_interval=1000.0)
+
+        # Act
+        for n in range(0, 5):
+            logger.sample(logLib.DEBUG, 'step', step=n)
+        logger.sample(logLib.DEBUG, 'other', step=0)
+        logger.sample_interval = 0.0
+        logger.sample(logLib.DEBUG, 'step', step=5)
+
+        # Assert
+        self.assertEqual([(event['event'], event['step'], event['suppressed']) for event in sink.events],
+                         [('step', 0, 0), ('other', 0, 0), ('step', 5, 4)])
+
+    def testNdjsonSinkWritesOneEventPerLine(self):
+        # Arrange
+        stream = io.StringIO()
+        logger = logLib.Logger(logLib.INFO, logLib.NdjsonSink(stream))
+
+        # Act
+        logger.info('summary', forces=np.array([[1.0, 2.0]]), steps=np.int64(3))
+        logger.warning('solver_failed', solver='newton')
+
+        # Assert
+        events = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(events[0]['forces'], [[1.0, 2.0]])
+        self.assertEqual(events[0]['steps'], 3)
+        self.assertEqual(events[1]['level'], 'warning')
+
+    def testSimulationStepDiagnostics(self):
+        # Arrange
+        model, hw = simulatorLib.setup_original_watergate_example7()
+        sink = logLib.MemorySink()
+        logger = logLib.Logger(logLib.DEBUG, sink, sample_interval=1000.0)
+
+        # Act
+        list(simulatorLib.simulate(model, hw, 0.0, 0.0001, 20, batch_duration=1000, logger=logger))
+
+        # Assert
+        steps = [event for event in sink.events if event['event'] == 'step']
+        self.assertEqual(len(steps), 1)
+        self.assertEqual(steps[0]['forces'].shape, (model.num_v, 12))
+        self.assertIn('batch', [event['event'] for event in sink.events])
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import forcesLib
+import geometryLib
+import jacobianLib
+import numpy as np
+
+
+# Method that preorders edges in such a way that they follow a natural order of vertices and edges from the initial
+# floor vertex
+# noinspection PyPep8Naming
+def pre_ordering_of_edges(V, E, EP, EL):
+    order, flipped = chain_ordering(V, E, EP)
+
+    new_edges = [[E[i][1], E[i][0]] if flip else E[i] for i, flip in zip(order, flipped)]
+    new_edges_tag = [EP[i] for i in order]
+    new_edges_length = [EL[i] for i in order]
+
+    return new_edges, new_edges_tag, new_edges_length
+
+
+# Walks the path of edges (ropes excluded) starting at the origin, always
+# following the first edge of E touching the current vertex other than the
+# one just walked. Ropes are moved to the end, in their original order.
+# Returns the permutation order (order[i] is the index in E of the i-th
+# ordered edge) and whether each ordered edge is flipped with respect to E.
+# noinspection PyPep8Naming
+def chain_ordering(V, E, EP):
+    edges = np.asarray(E, dtype=int).reshape(-1, 2)
+    tags = np.asarray(EP, dtype=int).reshape(-1)
+    num_v = len(V)
+
+    # edges (but ropes) touching each vertex, in their order in E, in
+    # compressed rows
+    walkable = np.nonzero(tags != 2)[0]
+    endpoints = np.concatenate([edges[walkable, 0], edges[walkable, 1]])
+    incident_edges = np.concatenate([walkable, walkable])
+    incident_edges = incident_edges[np.lexsort((incident_edges, endpoints))].tolist()
+    indptr = np.zeros(num_v + 1, dtype=int)
+    np.cumsum(np.bincount(endpoints, minlength=num_v), out=indptr[1:])
+    indptr = indptr.tolist()
+
+    edge_list = edges.tolist()
+    order = []
+    flipped = []
+
+    # starts at the origin
+    current_v = forcesLib.finds_origin(V)
+    last_edge = [-1, -1]
+
+    while True:
+        # find the first edge connecting to the current vertex
+        connected_edge_index = -1
+        for i in incident_edges[indptr[current_v]:indptr[current_v + 1]]:
+            if not geometryLib.equal_edges(edge_list[i], last_edge):
+                connected_edge_index = i
+                break
+
+        # if no connected edge was found, simply leave
+        if connected_edge_index == -1:
+            break
+
+        v1, v2 = edge_list[connected_edge_index]
+        flip = v1 != current_v
+
+        order.append(connected_edge_index)
+        flipped.append(flip)
+
+        # update V, flipping if necessary
+        last_edge = [v2, v1] if flip else [v1, v2]
+        current_v = last_edge[1]
+
+    ropes = np.nonzero(tags == 2)[0]
+    order = np.concatenate([np.array(order, dtype=int), ropes])
+    flipped = np.concatenate([np.array(flipped, dtype=bool), np.zeros(len(ropes), dtype=bool)])
+
+    return order, flipped
+
+
+# Compiled description of the structure being simulated. It is built once per
+# simulation (by simulatorLib.from_json or the setup_* scenarios) and holds
+# everything that depends only on the topology, as compact arrays:
+#   - V, VP, VBR: initial positions, tags (1 = fixed) and buoy radii of the vertices
+#   - E, EP, EL: edges in chain order (see chain_ordering), their tags
+#     (0 = spring, 1 = rod, 2 = rope) and rest lengths
+#   - edge_order, edge_flipped: where each ordered edge comes from in the
+#     input, so per edge input data can be gathered in chain order
+#   - I, J, is_spring, is_rope, L0: the edge arrays of the vectorized kernels
+#   - free_vertices, vertex_to_free_vertex: maps between vertices and free
+#     vertices (-1 for fixed ones)
+#   - gravity: gravity forces on each vertex
+#   - is_buoy, buoys: mask and indices of the vertices with buoys
+#   - pattern: sparsity structure of the Backward Euler jacobian
+# noinspection PyPep8Naming
+class SimulationModel(object):
+    def __init__(self, V, E, VP, EP, EL, VBR):
+        self.V = np.array(V, dtype=float).reshape(-1, 2)
+        self.VP = np.array(VP, dtype=int).reshape(-1)
+        self.VBR = np.array(VBR, dtype=float).reshape(-1)
+        self.num_v = len(self.V)
+
+        # edges in chain order: the i-th edge is E[edge_order[i]], reversed if
+        # edge_flipped[i]
+        self.edge_order, self.edge_flipped = chain_ordering(self.V, E, EP)
+        self.E = np.array(E, dtype=int).reshape(-1, 2)[self.edge_order]
+        self.E[self.edge_flipped] = self.E[self.edge_flipped, ::-1]
+        self.EP = np.array(EP, dtype=int).reshape(-1)[self.edge_order]
+        self.EL = np.array(EL, dtype=float).reshape(-1)[self.edge_order]
+
+        # ropes are moved to the end of the chain
+        self.num_chain_edges = int(np.count_nonzero(self.EP != 2))
+
+        self.edge_arrays = forcesLib.edge_index_arrays(self.E, self.EP, self.EL)
+        self.I, self.J, self.is_spring, self.is_rope, self.L0 = self.edge_arrays
+
+        self.free_vertices = np.nonzero(self.VP != 1)[0]
+        self.num_free_vertices = len(self.free_vertices)
+        self.vertex_to_free_vertex = np.full(self.num_v, -1, dtype=int)
+        self.vertex_to_free_vertex[self.free_vertices] = np.arange(self.num_free_vertices)
+
+        self.gravity = forcesLib.compute_gravity_forces(self.V, self.E, self.EL)
+        self.is_buoy = self.VBR > 0
+        self.buoys = np.nonzero(self.is_buoy)[0]
+
+        self.pattern = jacobianLib.JacobianPattern(self.E, self.num_v, self.free_vertices)
+
+    # Positions of all vertices, given the state U of the free vertices
+    # noinspection PyPep8Naming
+    def positions(self, U):
+        P = self.V.copy()
+        P[self.free_vertices] = U[:, 0:2]
+
+        return P
+
+    # Initial state: free vertices at rest at their initial positions
+    def initial_state(self):
+        U = np.zeros((self.num_free_vertices, 4))
+        U[:, 0:2] = self.V[self.free_vertices]
+
+        return U
@@ -0,0 +1,50 @@
+import time
+
+# When the integrators emit a batch of the steps simulated since the last one
+# (besides the last step of the run and a full StepBuffer, which always emit
+# one). ready is asked after every step, so it has to be cheap; emitted is
+# told after every batch.
+
+
+# Emits every batch_duration seconds
+class ClockPacing(object):
+    def __init__(self, batch_duration):
+        self.batch_duration = batch_duration
+        self.last_emit_time = time.time()
+
+    def ready(self):
+        return time.time() - self.last_emit_time >= self.batch_duration
+
+    def emitted(self):
+        self.last_emit_time = time.time()
+
+
+# Emits as fast as the consumer of the batches drains them from channel, a
+# bounded queue whose put blocks when full (e.g. a multiprocessing queue of
+# maxsize batches): a batch is emitted once the previous ones were taken, and
+# at most every min_interval seconds. A fast consumer gets small batches
+# right away, a slow one gets fewer larger ones, up to the size of the
+# StepBuffer, and once the channel is full, putting the next batch pauses the
+# simulation. The channel is asked at most every min_interval seconds, since
+# asking may be a round trip to another process.
+class BackpressurePacing(object):
+    def __init__(self, channel, min_interval=0.02):
+        self.channel = channel
+        self.min_interval = min_interval
+        self.last_check_time = time.perf_counter()
+
+    def ready(self):
+        now = time.perf_counter()
+        if now - self.last_check_time < self.min_interval:
+            return False
+        self.last_check_time = now
+
+        return self.channel.empty()
+
+    def emitted(self):
+        self.last_check_time = time.perf_counter()
+
+
+# Pacing of the batch_duration of the integrators, or pacing if given
+def batch_pacing(batch_duration, pacing=None):
+    return pacing if pacing is not None else ClockPacing(batch_duration)
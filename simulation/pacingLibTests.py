@@ -0,0 +1,65 @@
+import queue
+import unittest
+
+import pacingLib
+import simulatorLib
+
+
+# Pacing ready every steps-th step
+class EveryNthStep(object):
+    def __init__(self, steps):
+        self.steps = steps
+        self.calls = 0
+
+    def ready(self):
+        self.calls += 1
+        return self.calls % self.steps == 0
+
+    def emitted(self):
+        pass
+
+
+# noinspection PyPep8Naming
+class PacingLibTests(unittest.TestCase):
+    def testBackpressureWaitsForTheConsumer(self):
+        # Arrange
+        channel = queue.Queue(maxsize=2)
+        pacing = pacingLib.BackpressurePacing(channel, min_interval=0.0)
+
+        # Act
+        ready_when_empty = pacing.ready()
+        channel.put('batch')
+        ready_when_behind = pacing.ready()
+        channel.get()
+        ready_when_drained = pacing.ready()
+
+        # Assert
+        self.assertTrue(ready_when_empty)
+        self.assertFalse(ready_when_behind)
+        self.assertTrue(ready_when_drained)
+
+    def testBackpressureChecksAtMostEveryInterval(self):
+        # Arrange
+        pacing = pacingLib.BackpressurePacing(queue.Queue(), min_interval=1000.0)
+
+        # Act & Assert
+        self.assertFalse(pacing.ready())
+
+    def testPacingDecidesTheBatches(self):
+        # Arrange
+        model, hw = simulatorLib.setup_original_watergate_example7()
+
+        # Act
+        batches = list(simulatorLib.simulate(model, hw, 0.0, 0.0001, 12, batch_duration=1000,
+                                             pacing=EveryNthStep(4)))
+
+        # Assert
+        self.assertEqual([len(batch[2]) for batch in batches], [4, 4, 2])
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+from collections import defaultdict
+from time import perf_counter
+
+
+# Wall time spent in each phase of a run, and counters of its events (solver
+# evaluations, failures, ...). Phases are timed as laps: lap(phase) charges
+# the time since the previous lap to phase, so a loop calling it after each
+# of its phases pays one clock read per phase and its phases add up to the
+# whole run. Time measured inside a phase by someone else (e.g. the jacobian
+# assembly inside the solver) is moved out of it with split.
+class PhaseTimers(object):
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.split_phases = set()
+        self.start_time = perf_counter()
+        self.last = self.start_time
+        self.previous = None
+
+    # Adds the time since the last lap to phase
+    def lap(self, phase):
+        now = perf_counter()
+        self.seconds[phase] += now - self.last
+        self.calls[phase] += 1
+        self.last = now
+
+    # Moves the seconds of each part (a dictionary of seconds per phase)
+    # measured within phase out of it
+    def split(self, phase, parts):
+        self.split_phases.add(phase)
+        for part, seconds in parts.items():
+            self.seconds[part] += seconds
+            self.seconds[phase] -= seconds
+            self.split_phases.add(part)
+
+    def count(self, counter, amount=1):
+        self.counters[counter] += amount
+
+    def totals(self):
+        return {
+            'wall_seconds': perf_counter() - self.start_time,
+            'seconds': dict(self.seconds),
+            'counters': dict(self.counters)
+        }
+
+    # Totals of the run so far ('run') and their change since the previous
+    # telemetry ('batch')
+    def telemetry(self):
+        run = self.totals()
+        previous = self.previous if self.previous is not None else {'wall_seconds': 0.0, 'seconds': {},
+                                                                    'counters': {}}
+        batch = {
+            'wall_seconds': run['wall_seconds'] - previous['wall_seconds'],
+            'seconds': {phase: seconds - previous['seconds'].get(phase, 0.0)
+                        for phase, seconds in run['seconds'].items()},
+            'counters': {counter: value - previous['counters'].get(counter, 0)
+                         for counter, value in run['counters'].items()}
+        }
+        self.previous = run
+
+        return {'batch': batch, 'run': run}
+
+    # Lines of the profile of the run: phases from the slowest, with their
+    # share of the wall time and their time per lap (unless split changed
+    # it), and counters
+    def report(self):
+        run = self.totals()
+        wall = max(run['wall_seconds'], 1e-12)
+
+        lines = []
+        for phase, seconds in sorted(run['seconds'].items(), key=lambda item: -item[1]):
+            calls = self.calls.get(phase, 0)
+            line = f"{phase}: {seconds:.6f} s ({100 * seconds / wall:.1f}%)"
+            if calls > 0 and phase not in self.split_phases:
+                line += f", {calls} laps, {1e6 * seconds / calls:.1f} us per lap"
+            lines.append(line)
+        for counter, value in sorted(run['counters'].items()):
+            lines.append(f"{counter}: {value}")
+
+        return lines
+
+
+# Stand-in for PhaseTimers when profiling is off
+class NullTimers(object):
+    def lap(self, phase):
+        pass
+
+    def split(self, phase, parts):
+        pass
+
+    def count(self, counter, amount=1):
+        pass
+
+    def telemetry(self):
+        return None
+
+    def report(self):
+        return []
+
+
+def phase_timers(profile):
+    return PhaseTimers() if profile else NullTimers()
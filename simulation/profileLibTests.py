@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import logLib
+import profileLib
+import simulatorLib
+
+
+# noinspection PyPep8Naming
+class ProfileLibTests(unittest.TestCase):
+    # implicit_simulation writes results_data.txt in the working directory
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.working_directory = os.getcwd()
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        os.chdir(self.working_directory)
+        shutil.rmtree(self.directory)
+
+    def testTelemetryOfBatchesAddsUpToRun(self):
+        # Arrange
+        timers = profileLib.PhaseTimers()
+
+        # Act
+        timers.lap('forces')
+        timers.lap('solver')
+        timers.split('solver', {'jacobian': 0.25})
+        timers.count('nfev', 3)
+        first = timers.telemetry()
+        timers.lap('forces')
+        timers.count('nfev', 2)
+        second = timers.telemetry()
+
+        # Assert
+        self.assertEqual(second['run']['counters'], {'nfev': 5})
+        self.assertEqual(second['batch']['counters'], {'nfev': 2})
+        self.assertEqual(second['run']['seconds']['jacobian'], 0.25)
+        self.assertEqual(second['batch']['seconds']['jacobian'], 0.0)
+        self.assertAlmostEqual(first['run']['seconds']['forces'] + second['batch']['seconds']['forces'],
+                               second['run']['seconds']['forces'])
+        self.assertEqual(timers.calls['forces'], 2)
+
+    def testImplicitSimulationBatchesCarryTelemetry(self):
+        # Arrange
+        model, hw = simulatorLib.setup_original_watergate_example7()
+        logger = logLib.Logger(logLib.WARNING)
+
+        # Act
+        batches = list(simulatorLib.implicit_simulation(model, hw, 0.0, 0.001, 12, batch_duration=1000,
+                                                        buffer_steps=5, results_path=None, logger=logger,
+                                                        profile=True))
+
+        # Assert
+        telemetry = [batch[4]['telemetry'] for batch in batches]
+        run = telemetry[-1]['run']
+        self.assertEqual(run['counters']['equilibrium_checks'], 10)
+        self.assertEqual(sum(t['batch']['counters']['nfev'] for t in telemetry), run['counters']['nfev'])
+        self.assertGreater(run['counters']['njev'], 0)
+        for phase in ['classification', 'forces', 'jacobian', 'solver', 'recording', 'emit']:
+            self.assertIn(phase, run['seconds'])
+        self.assertLessEqual(sum(run['seconds'].values()), run['wall_seconds'])
+
+    def testProfilingIsOffByDefault(self):
+        # Arrange
+        model, hw = simulatorLib.setup_original_watergate_example7()
+        logger = logLib.Logger(logLib.WARNING)
+        U = np.zeros((len(model.free_vertices), 4))
+        U[:, 0:2] = model.V[model.free_vertices]
+
+        # Act
+        batches = list(simulatorLib.simulate(model, hw, 0.0, 0.0001, 10, batch_duration=1000, logger=logger))
+        _, _, info = simulatorLib.solve_non_linear_system(U, model, hw, 0.001)
+
+        # Assert
+        self.assertIsNone(batches[-1][4]['telemetry'])
+        self.assertEqual(sum(info['seconds'].values()), 0.0)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
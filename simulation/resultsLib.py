@@ -0,0 +1,399 @@
+import bisect
+import json
+import os
+import zipfile
+
+import numpy as np
+
+# Results of a simulation are stored in a directory holding metadata.json and
+# one subdirectory per chunk of consecutive steps, with an npy file per array:
+#   - positions: positions of all vertices (steps x num_v x 2)
+#   - forces: force components on all vertices (steps x num_v x 10), an X,Y
+#     pair per component in the order of force_components
+#   - water_level: water level at each step (steps)
+# Chunks are written as the run progresses and only listed in the metadata
+# once complete, so a crashed run keeps all but the steps of its last chunk.
+# npy files can be memory mapped (np.load(..., mmap_mode='r')).
+# Each chunk also keeps a small index of its forces, so queries over step
+# ranges can skip chunks without reading them (see ResultReader):
+#   - forces_min, forces_max: minimum and maximum of each force column on
+#     each vertex (num_v x 10)
+#   - magnitude_max: maximum magnitude of each force component on each
+#     vertex (num_v x 5)
+results_format = 'snailgate-results'
+results_version = 1
+force_components = ['total', 'water_pressure', 'tensor', 'gravity', 'buoyancy']
+result_arrays = ['positions', 'forces', 'water_level']
+metadata_file = 'metadata.json'
+default_chunk_steps = 1000
+
+
+# Directory of the index-th chunk of the results at path
+def chunk_path(path, index):
+    return os.path.join(path, 'chunk_%06d' % index)
+
+
+# Writes file_name through a temporary file, so it is never seen half written
+def replace_file(file_name, write):
+    temporary_name = file_name + '.tmp'
+    with open(temporary_name, 'wb') as f:
+        write(f)
+    os.replace(temporary_name, file_name)
+
+
+# noinspection PyPep8Naming
+def save_array(file_name, A):
+    replace_file(file_name, lambda f: np.save(f, A))
+
+
+def write_metadata(path, metadata):
+    replace_file(os.path.join(path, metadata_file), lambda f: f.write(json.dumps(metadata).encode('utf-8')))
+
+
+def read_metadata(path):
+    with open(os.path.join(path, metadata_file)) as f:
+        metadata = json.load(f)
+
+    if metadata.get('format') != results_format:
+        raise ValueError("Not a simulation results directory: " + str(path))
+    if metadata.get('version') != results_version:
+        raise ValueError("Unsupported results version: " + str(metadata.get('version')))
+
+    return metadata
+
+
+# Writes the results at path to file (a name or a binary file object) as a
+# zip archive of their directory, metadata and chunks as they are stored. The
+# npy files are stored uncompressed, since they barely compress.
+def archive_results(path, file):
+    metadata = read_metadata(path)
+    with zipfile.ZipFile(file, 'w', zipfile.ZIP_STORED) as archive:
+        archive.writestr(metadata_file, json.dumps(metadata))
+        for index in range(len(metadata['chunks'])):
+            directory = chunk_path(path, index)
+            for name in sorted(os.listdir(directory)):
+                if name.endswith('.npy'):
+                    archive.write(os.path.join(directory, name), os.path.join(os.path.basename(directory), name))
+
+
+# Index of a force component in force_components, accepting the index itself
+def component_index(component):
+    if isinstance(component, str):
+        if component not in force_components:
+            raise ValueError("Unknown force component: " + component)
+        return force_components.index(component)
+
+    return component
+
+
+# Magnitudes of the force components of F (... x 10 -> ... x 5)
+# noinspection PyPep8Naming
+def force_magnitudes(F):
+    return np.hypot(F[..., 0::2], F[..., 1::2])
+
+
+# Description of the simulated structure stored with the results
+def scenario_metadata(model):
+    return {
+        'verteces': model.V.tolist(),
+        'edges': model.E.tolist(),
+        'vertexTypes': model.VP.tolist(),
+        'edgeTypes': model.EP.tolist(),
+        'edgeLengths': model.EL.tolist(),
+        'vertexBoyantRadiai': model.VBR.tolist()
+    }
+
+
+# Appends the batches of a simulation (see simulatorLib.batch_result) to the
+# results at path, one chunk of chunk_steps steps at a time. settings are
+# the solver settings stored in the metadata. Results already at path are
+# overwritten. Closing it writes the last, possibly shorter, chunk; the
+# run is only marked as complete if it ended normally.
+# noinspection PyPep8Naming
+class ResultWriter(object):
+    def __init__(self, path, model, settings=None, chunk_steps=default_chunk_steps):
+        self.path = path
+        self.chunk_steps = chunk_steps
+        self.pending = 0
+        self.closed = False
+
+        self.positions = np.empty((chunk_steps, model.num_v, 2))
+        self.forces = np.empty((chunk_steps, model.num_v, 2 * len(force_components)))
+        self.water_level = np.empty(chunk_steps)
+
+        self.metadata = {
+            'format': results_format,
+            'version': results_version,
+            'num_vertices': model.num_v,
+            'force_components': force_components,
+            'chunk_steps': chunk_steps,
+            'scenario': scenario_metadata(model),
+            'settings': settings if settings is not None else {},
+            'chunks': [],
+            'total_steps': 0,
+            'complete': False
+        }
+
+        os.makedirs(path, exist_ok=True)
+        write_metadata(path, self.metadata)
+
+    # Appends the steps of a batch: positions P, forces F and water levels wl
+    # noinspection PyPep8Naming
+    def append(self, P, F, wl):
+        start = 0
+        while start < len(wl):
+            count = min(len(wl) - start, self.chunk_steps - self.pending)
+            self.positions[self.pending:self.pending + count] = P[start:start + count]
+            self.forces[self.pending:self.pending + count] = F[start:start + count]
+            self.water_level[self.pending:self.pending + count] = wl[start:start + count]
+            self.pending += count
+            start += count
+
+            if self.pending == self.chunk_steps:
+                self.flush()
+
+    # Writes the pending steps as a new chunk
+    def flush(self):
+        if self.pending == 0:
+            return
+
+        index = len(self.metadata['chunks'])
+        directory = chunk_path(self.path, index)
+        os.makedirs(directory, exist_ok=True)
+        for name in result_arrays:
+            save_array(os.path.join(directory, name + '.npy'), getattr(self, name)[:self.pending])
+
+        F = self.forces[:self.pending]
+        save_array(os.path.join(directory, 'forces_min.npy'), F.min(axis=0))
+        save_array(os.path.join(directory, 'forces_max.npy'), F.max(axis=0))
+        save_array(os.path.join(directory, 'magnitude_max.npy'), force_magnitudes(F).max(axis=0))
+
+        self.metadata['chunks'].append({
+            'start': self.metadata['total_steps'],
+            'steps': self.pending,
+            'water_level_min': float(self.water_level[:self.pending].min()),
+            'water_level_max': float(self.water_level[:self.pending].max())
+        })
+        self.metadata['total_steps'] += self.pending
+        self.pending = 0
+        write_metadata(self.path, self.metadata)
+
+    def close(self, complete=True):
+        if self.closed:
+            return
+
+        self.flush()
+        self.metadata['complete'] = complete
+        write_metadata(self.path, self.metadata)
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(exc_type is None)
+
+
+# Random access to stored results, without loading them: the chunk arrays are
+# memory mapped on first use and queries only read the chunks overlapping
+# their step range. Step ranges are given as in slices (start, stop, None
+# meaning the whole run, negative counting from the end), vertices as
+# anything numpy accepts as index of the vertex axis (e.g. [37] or a mask),
+# and components as names in force_components or their indices.
+# Reductions over step ranges (force_envelope, force_range, peak_force,
+# steps_above) use the chunk indexes: chunks wholly inside the range are
+# reduced from their index, and chunks that cannot hold the answer are not
+# read at all.
+# noinspection PyPep8Naming
+class ResultReader(object):
+    def __init__(self, path):
+        self.path = path
+        self.metadata = read_metadata(path)
+        self.chunks = self.metadata['chunks']
+        self.num_steps = self.metadata['total_steps']
+        self.num_vertices = self.metadata['num_vertices']
+        self.chunk_starts = [chunk['start'] for chunk in self.chunks] + [self.num_steps]
+        self.mapped = {}
+
+        # number of chunks whose data was read, for statistics
+        self.chunks_read = 0
+
+    # Array name of the index-th chunk, memory mapped
+    def array(self, index, name):
+        key = (index, name)
+        if key not in self.mapped:
+            self.mapped[key] = np.load(os.path.join(chunk_path(self.path, index), name + '.npy'), mmap_mode='r')
+
+        return self.mapped[key]
+
+    # Chunks overlapping the steps start to stop (excluded), as tuples of
+    # index, range of steps inside the chunk and whether it is the whole chunk
+    def chunk_ranges(self, start, stop):
+        first = max(bisect.bisect_right(self.chunk_starts, start) - 1, 0)
+        for index in range(first, len(self.chunks)):
+            chunk_start = self.chunk_starts[index]
+            chunk_stop = self.chunk_starts[index + 1]
+            if chunk_start >= stop:
+                break
+
+            begin = max(start, chunk_start) - chunk_start
+            end = min(stop, chunk_stop) - chunk_start
+            if end > begin:
+                yield index, begin, end, end - begin == chunk_stop - chunk_start
+
+    def step_range(self, start, stop):
+        start, stop, _ = slice(start, stop).indices(self.num_steps)
+
+        return start, max(start, stop)
+
+    # Steps start to stop of array name, restricted to vertices and columns
+    def read(self, name, start=None, stop=None, vertices=None, columns=None):
+        start, stop = self.step_range(start, stop)
+
+        parts = []
+        for index, begin, end, _ in self.chunk_ranges(start, stop):
+            self.chunks_read += 1
+            parts.append(select(self.array(index, name)[begin:end], vertices, columns))
+
+        if len(parts) == 0:
+            shape = {'positions': (0, self.num_vertices, 2),
+                     'forces': (0, self.num_vertices, 2 * len(force_components)),
+                     'water_level': (0,)}[name]
+            return select(np.empty(shape), vertices, columns)
+
+        return np.concatenate(parts)
+
+    # Positions (steps x vertices x 2)
+    def positions(self, start=None, stop=None, vertices=None):
+        return self.read('positions', start, stop, vertices)
+
+    # X,Y of the force component (steps x vertices x 2), or of all of them
+    # (steps x vertices x 10) if component is None
+    def forces(self, start=None, stop=None, vertices=None, component=None):
+        columns = None if component is None else component_columns(component)
+
+        return self.read('forces', start, stop, vertices, columns)
+
+    def water_level(self, start=None, stop=None):
+        return self.read('water_level', start, stop)
+
+    # Positions, forces and water level at step n
+    def step(self, n):
+        if not -self.num_steps <= n < self.num_steps:
+            raise IndexError("Step out of range: " + str(n))
+        n %= self.num_steps
+
+        return self.positions(n, n + 1)[0], self.forces(n, n + 1)[0], self.water_level(n, n + 1)[0]
+
+    # Magnitude of the force component (steps x vertices)
+    def force_magnitudes(self, start=None, stop=None, vertices=None, component='total'):
+        return force_magnitudes(self.forces(start, stop, vertices, component))[..., 0]
+
+    # Maximum magnitude of the force component on each vertex over the steps
+    def force_envelope(self, component='total', start=None, stop=None, vertices=None):
+        start, stop = self.step_range(start, stop)
+        c = component_index(component)
+
+        envelope = select(np.full(self.num_vertices, -np.inf), vertices)
+        for index, begin, end, whole in self.chunk_ranges(start, stop):
+            if whole:
+                chunk_max = select(self.array(index, 'magnitude_max'), vertices, c)
+            else:
+                chunk_max = self.chunk_magnitudes(index, begin, end, vertices, c).max(axis=0)
+            np.maximum(envelope, chunk_max, out=envelope)
+
+        return envelope
+
+    # Minimum and maximum X,Y of the force component on each vertex over the
+    # steps (vertices x 2 each)
+    def force_range(self, component='total', start=None, stop=None, vertices=None):
+        start, stop = self.step_range(start, stop)
+        columns = component_columns(component)
+
+        minimum = select(np.full((self.num_vertices, 2), np.inf), vertices)
+        maximum = select(np.full((self.num_vertices, 2), -np.inf), vertices)
+        for index, begin, end, whole in self.chunk_ranges(start, stop):
+            if whole:
+                chunk_min = select(self.array(index, 'forces_min'), vertices, columns)
+                chunk_max = select(self.array(index, 'forces_max'), vertices, columns)
+            else:
+                self.chunks_read += 1
+                F = select(self.array(index, 'forces')[begin:end], vertices, columns)
+                chunk_min = F.min(axis=0)
+                chunk_max = F.max(axis=0)
+            np.minimum(minimum, chunk_min, out=minimum)
+            np.maximum(maximum, chunk_max, out=maximum)
+
+        return minimum, maximum
+
+    # Largest magnitude of the force component over the steps and vertices, as
+    # (magnitude, step, vertex), or None if there are no steps. Chunks are
+    # visited from the largest indexed maximum down, and the search stops at
+    # the first one that cannot beat the peak found so far.
+    def peak_force(self, component='total', start=None, stop=None, vertices=None):
+        start, stop = self.step_range(start, stop)
+        c = component_index(component)
+        vertex_indices = np.arange(self.num_vertices) if vertices is None else select(np.arange(self.num_vertices),
+                                                                                     vertices)
+        if len(vertex_indices) == 0:
+            return None
+
+        candidates = sorted(((select(self.array(index, 'magnitude_max'), vertex_indices, c).max(), index, begin, end)
+                             for index, begin, end, _ in self.chunk_ranges(start, stop)), reverse=True)
+
+        peak = None
+        for bound, index, begin, end in candidates:
+            if peak is not None and bound <= peak[0]:
+                break
+
+            magnitudes = self.chunk_magnitudes(index, begin, end, vertex_indices, c)
+            step, vertex = np.unravel_index(np.argmax(magnitudes), magnitudes.shape)
+            if peak is None or magnitudes[step, vertex] > peak[0]:
+                peak = (float(magnitudes[step, vertex]), self.chunk_starts[index] + begin + int(step),
+                        int(vertex_indices[vertex]))
+
+        return peak
+
+    # Steps in which the magnitude of the force component is above threshold
+    # on any of the vertices. Chunks whose indexed maximum is not above it
+    # are skipped.
+    def steps_above(self, threshold, component='total', start=None, stop=None, vertices=None):
+        start, stop = self.step_range(start, stop)
+        c = component_index(component)
+
+        steps = []
+        for index, begin, end, _ in self.chunk_ranges(start, stop):
+            if select(self.array(index, 'magnitude_max'), vertices, c).max(initial=-np.inf) <= threshold:
+                continue
+
+            magnitudes = self.chunk_magnitudes(index, begin, end, vertices, c)
+            steps.append(self.chunk_starts[index] + begin + np.nonzero(np.any(magnitudes > threshold, axis=1))[0])
+
+        return np.concatenate(steps) if len(steps) > 0 else np.zeros(0, dtype=int)
+
+    # Magnitudes of force component c in steps begin to end of a chunk
+    # (steps x vertices)
+    def chunk_magnitudes(self, index, begin, end, vertices, c):
+        self.chunks_read += 1
+        F = select(self.array(index, 'forces')[begin:end], vertices, component_columns(c))
+
+        return force_magnitudes(F)[..., 0]
+
+
+# Columns of a force component in the forces arrays
+def component_columns(component):
+    c = component_index(component)
+
+    return slice(2 * c, 2 * c + 2)
+
+
+# Selects vertices (first axis after the steps, if any) and columns (last
+# axis) of an array, as a copy
+# noinspection PyPep8Naming
+def select(A, vertices=None, columns=None):
+    if vertices is not None:
+        A = A[..., vertices, :] if A.ndim > 1 else A[vertices]
+    if columns is not None:
+        A = A[..., columns]
+
+    return np.array(A)
@@ -0,0 +1,181 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import numpy as np
+import resultsLib
+import simulatorLib
+
+
+# noinspection PyPep8Naming
+class ResultsLibTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'results')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testSimulationResultsAreWrittenInChunks(self):
+        # Arrange
+        model, hw = simulatorLib.setup_original_watergate_example7()
+        simulation = simulatorLib.simulate(model, hw, 0.0, 0.0001, 60, batch_duration=1000, buffer_steps=10,
+                                           results_path=self.path)
+
+        # Act
+        batches = list(simulation)
+        metadata = resultsLib.read_metadata(self.path)
+
+        # Assert
+        self.assertTrue(metadata['complete'])
+        self.assertEqual(metadata['total_steps'], 58)
+        self.assertEqual([chunk['steps'] for chunk in metadata['chunks']], [58])
+        self.assertEqual(metadata['settings']['method'], 'Forward Euler')
+        self.assertEqual(metadata['scenario']['edges'], model.E.tolist())
+        for i, name in enumerate(resultsLib.result_arrays):
+            stored = [np.load(os.path.join(resultsLib.chunk_path(self.path, c), name + '.npy'), mmap_mode='r')
+                      for c in range(0, len(metadata['chunks']))]
+            np.testing.assert_array_equal(np.concatenate(stored), np.concatenate([batch[i] for batch in batches]))
+
+    def testInterruptedRunKeepsWrittenChunks(self):
+        # Arrange
+        model, hw = simulatorLib.setup_original_watergate_example7()
+        P = np.zeros((120, model.num_v, 2))
+        F = np.zeros((120, model.num_v, 10))
+        wl = np.arange(120, dtype=float)
+
+        # Act
+        with self.assertRaises(RuntimeError):
+            with resultsLib.ResultWriter(self.path, model, chunk_steps=50) as writer:
+                writer.append(P, F, wl)
+                raise RuntimeError("crash")
+        metadata = resultsLib.read_metadata(self.path)
+
+        # Assert
+        self.assertFalse(metadata['complete'])
+        self.assertEqual([chunk['start'] for chunk in metadata['chunks']], [0, 50, 100])
+        water_level = np.load(os.path.join(resultsLib.chunk_path(self.path, 2), 'water_level.npy'))
+        np.testing.assert_array_equal(water_level, wl[100:])
+
+    def testClosedSimulationKeepsEmittedSteps(self):
+        # Arrange
+        model, hw = simulatorLib.setup_original_watergate_example7()
+        report_path = os.path.join(self.directory, 'results_data.txt')
+        simulations = [
+            simulatorLib.simulate(model, hw, 0.0, 0.0001, 1000, batch_duration=1000, buffer_steps=10,
+                                  results_path=self.path + '_explicit'),
+            simulatorLib.implicit_simulation(model, hw, 0.0, 0.01, 1000, batch_duration=1000, buffer_steps=10,
+                                             results_path=self.path + '_implicit', report_path=report_path)
+        ]
+
+        for simulation, path in zip(simulations, [self.path + '_explicit', self.path + '_implicit']):
+            # Act
+            batches = [next(simulation) for _ in range(0, 3)]
+            simulation.close()
+            reader = resultsLib.ResultReader(path)
+
+            # Assert
+            self.assertFalse(reader.metadata['complete'])
+            self.assertEqual(reader.num_steps, sum(len(batch[2]) for batch in batches))
+            np.testing.assert_array_equal(reader.positions(), np.concatenate([batch[0] for batch in batches]))
+
+    def writeRandomResults(self, model, num_steps, chunk_steps):
+        random = np.random.RandomState(0)
+        P = random.uniform(-1, 1, (num_steps, model.num_v, 2))
+        F = random.uniform(-1, 1, (num_steps, model.num_v, 10))
+        wl = random.uniform(0, 1, num_steps)
+        with resultsLib.ResultWriter(self.path, model, chunk_steps=chunk_steps) as writer:
+            writer.append(P[:70], F[:70], wl[:70])
+            writer.append(P[70:], F[70:], wl[70:])
+
+        return P, F, wl
+
+    def testReaderSlicesStepsVerticesAndComponents(self):
+        # Arrange
+        model, hw = simulatorLib.setup_original_watergate_example7()
+        P, F, wl = self.writeRandomResults(model, 230, 50)
+
+        # Act
+        reader = resultsLib.ResultReader(self.path)
+        tension = reader.forces(vertices=[2], component='tensor')
+        forces = reader.forces(45, 160, [0, 3])
+        positions = reader.positions(-10)
+        step = reader.step(120)
+
+        # Assert
+        self.assertEqual(reader.num_steps, 230)
+        np.testing.assert_array_equal(tension, F[:, [2], 4:6])
+        np.testing.assert_array_equal(forces, F[45:160][:, [0, 3]])
+        np.testing.assert_array_equal(positions, P[-10:])
+        np.testing.assert_array_equal(reader.water_level(10, 10), wl[10:10])
+        np.testing.assert_array_equal(step[1], F[120])
+        self.assertEqual(step[2], wl[120])
+
+    def testReaderReductionsMatchFullScan(self):
+        # Arrange
+        model, hw = simulatorLib.setup_original_watergate_example7()
+        P, F, wl = self.writeRandomResults(model, 230, 50)
+        F_total = np.hypot(F[..., 0], F[..., 1])
+
+        # Act
+        reader = resultsLib.ResultReader(self.path)
+        envelope = reader.force_envelope('total', 20, 210)
+        minimum, maximum = reader.force_range('gravity', vertices=[1, 2])
+        peak = reader.peak_force('total', 20, 210)
+
+        # Assert
+        np.testing.assert_array_equal(envelope, F_total[20:210].max(axis=0))
+        np.testing.assert_array_equal(minimum, F[:, [1, 2], 6:8].min(axis=0))
+        np.testing.assert_array_equal(maximum, F[:, [1, 2], 6:8].max(axis=0))
+        step, vertex = np.unravel_index(np.argmax(F_total[20:210]), F_total[20:210].shape)
+        self.assertEqual(peak, (F_total[20 + step, vertex], 20 + step, vertex))
+
+    def testReaderSkipsChunksBelowThreshold(self):
+        # Arrange
+        model, hw = simulatorLib.setup_original_watergate_example7()
+        P = np.zeros((200, model.num_v, 2))
+        F = np.zeros((200, model.num_v, 10))
+        F[130, 3, 0] = 5.0
+        F[135, 2, 1] = -4.0
+        with resultsLib.ResultWriter(self.path, model, chunk_steps=50) as writer:
+            writer.append(P, F, np.zeros(200))
+
+        # Act
+        reader = resultsLib.ResultReader(self.path)
+        steps = reader.steps_above(3.0)
+        chunks_read = reader.chunks_read
+        peak = reader.peak_force()
+
+        # Assert
+        np.testing.assert_array_equal(steps, [130, 135])
+        self.assertEqual(chunks_read, 1)
+        self.assertEqual(peak, (5.0, 130, 3))
+        self.assertEqual(reader.chunks_read, 2)
+    def testArchiveHoldsTheWholeResults(self):
+        # Arrange
+        model, hw = simulatorLib.setup_original_watergate_example7()
+        P, F, wl = self.writeRandomResults(model, 120, 50)
+        archive = os.path.join(self.directory, 'results.zip')
+        extracted = os.path.join(self.directory, 'extracted')
+
+        # Act
+        resultsLib.archive_results(self.path, archive)
+        with zipfile.ZipFile(archive) as f:
+            f.extractall(extracted)
+        reader = resultsLib.ResultReader(extracted)
+
+        # Assert
+        self.assertTrue(reader.metadata['complete'])
+        np.testing.assert_array_equal(reader.positions(), P)
+        np.testing.assert_array_equal(reader.forces(), F)
+        np.testing.assert_array_equal(reader.water_level(), wl)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
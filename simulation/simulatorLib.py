@@ -1,122 +1,169 @@
 #!/usr/bin/env python
-import json
+import itertools
 import time
 
 import forcesLib
 import geometryLib
+import logLib
+import modelLib
 import numpy as np
+import pacingLib
+import profileLib
+import resultsLib
+import solverLib
+import statsLib
 import scipy as sp
 from scipy import optimize
 
 damping = 0.8
 
+# where implicit_simulation stores its results (see resultsLib) and its
+# report
+default_results_path = 'results'
+default_report_path = 'results_data.txt'
 
-# Method that preorders edges in such a way that they follow a natural order of vertices and edges from the initial
-# floor vertex
+
+# Backward Euler system G(x) = 0 of one time step (see
+# compute_non_linear_system_function). The residual and the jacobian at an
+# iterate share one pass over its geometry: the positions, the wet edges and
+# the edge vectors and lengths are computed once and cached with the last
+# evaluated x, so asking for G(x) and J(x) at the same x pays only once.
+# The wet edges are found by a forcesLib.WetEdgeClassifier, which may be
+# shared across time steps. With profile, the time spent classifying,
+# computing forces and assembling jacobians is kept in seconds.
 # noinspection PyPep8Naming
-def pre_ordering_of_edges(V, E, EP, EL):
-    new_edges = []
-    new_edges_tag = []
-    new_edges_length = []
-    ropes_indices = []
-
-    # searches for origin
-    origin = forcesLib.finds_origin(V)
-
-    # starts at the origin
-    current_v = origin
-
-    # continues searching for next edge to touch water until we achieve a point
-    # higher than hw
-    while True:
-        last_edge = new_edges[-1] if len(new_edges) > 0 else [-1, -1]
-
-        # find all edges connecting to the current vertex
-        connected_edge = [-1, -1]
-        connected_edge_index = -1
-        for i, edge in enumerate(E):
-            if geometryLib.equal_edges(edge, last_edge):
-                continue
-
-            if EP[i] == 2:
-                continue
-
-            if edge[0] == current_v:
-                connected_edge = edge
-                connected_edge_index = i
-                break
-
-            # flip if necessary
-            if edge[1] == current_v:
-                connected_edge = [edge[1], edge[0]]
-                connected_edge_index = i
-                break
-
-        # if no connected edge was found, simply leave
-        if connected_edge_index == -1:
-            break
-
-        # Add new edge
-        new_edges.append(connected_edge)
-        new_edges_tag.append(EP[connected_edge_index])
-        new_edges_length.append(EL[connected_edge_index])
-
-        # update V
-        current_v = connected_edge[1]
+class BackwardEulerSystem(object):
+    def __init__(self, model, previous_U, k, hw, classifier=None, profile=False):
+        self.model = model
+        self.previous_U = previous_U
+        self.k = k
+        self.hw = hw
+        self.profile = profile
+        self.classifier = classifier if classifier is not None else forcesLib.WetEdgeClassifier(model)
+
+        # U^n with damped velocities does not depend on the iterate
+        self.damped_Un = previous_U.copy()
+        self.damped_Un[:, 2:4] *= damping
+
+        self.x = None
+        self.residual = None
+        self.J = None
+        self.geometry_evaluations = 0
+        self.seconds = {'classification': 0.0, 'forces': 0.0, 'jacobian': 0.0}
+
+    # Computes the geometry at x, unless x is the last evaluated iterate
+    def update(self, x):
+        if self.x is not None and np.array_equal(x, self.x):
+            return
+
+        self.x = np.array(x, dtype=float)
+        self.U = self.x.reshape((-1, 4))
+
+        # current positions
+        model = self.model
+        self.P = model.positions(self.U)
+
+        if self.profile:
+            start = time.perf_counter()
+            self.ETW = self.classifier.classify(self.P, self.hw)
+            self.seconds['classification'] += time.perf_counter() - start
+        else:
+            self.ETW = self.classifier.classify(self.P, self.hw)
+        self.geometry = forcesLib.edge_geometry(self.P, model.I, model.J)
+        self.geometry_evaluations += 1
 
-    for i, edge in enumerate(E):
-        if EP[i] == 2:
-            new_edges.append(E[i])
-            new_edges_tag.append(EP[i])
-            new_edges_length.append(EL[i])
+        self.residual = None
+        self.J = None
+
+    # G(x). Extra arguments are accepted (and ignored) so it can be handed to
+    # solvers passing args along
+    # noinspection PyUnusedLocal
+    def function(self, x, *args):
+        self.update(x)
+
+        if self.residual is None:
+            start = time.perf_counter() if self.profile else None
+            func_result = compute_function(self.model, self.U, self.hw, self.P, self.ETW, self.geometry)
+            if self.profile:
+                self.seconds['forces'] += time.perf_counter() - start
 
-    return new_edges, new_edges_tag, new_edges_length
+            # applying damping to velocities
+            func_result[:, 2:4] *= damping
 
+            self.residual = (self.U - self.k * func_result[:, 0:4] - self.damped_Un).reshape(-1)
 
-# noinspection PyPep8Naming,PyUnusedLocal
-def compute_actual_jacobian(x, previous_U, k, V, E, EP, EL, VBR, hw, free_vertices):
-    num_free_vertices = len(x) // 4
-    num_var = 4 * num_free_vertices
-    JF = np.zeros((num_var, num_var))
-    U = x.reshape((num_free_vertices, 4))
+        return self.residual
 
-    I = np.identity(num_var)
+    # Sparse jacobian of G at x
+    # noinspection PyUnusedLocal
+    def jacobian(self, x, *args):
+        self.update(x)
 
-    # construct map from vertices to free vertices
-    vertex_to_free_vertex = [-1 for _ in range(len(V))]
-    for i in range(0, len(free_vertices)):
-        vertex_to_free_vertex[free_vertices[i]] = i
+        if self.J is None:
+            start = time.perf_counter() if self.profile else None
+            model = self.model
 
-    # current positions
-    P = V.copy()
-    P[free_vertices] = U[:, 0:2]
+            # add forces part
+            contributions = [
+                forcesLib.tensor_jacobian(model, self.P, self.geometry),
+                forcesLib.water_pressure_jacobian(model, self.P, self.ETW, self.hw),
+                forcesLib.buoyancy_jacobian(model, self.P, self.hw),
+                forcesLib.ground_collision_jacobian(model, self.P)
+            ]
 
-    # add forces part
-    ETW = forcesLib.edges_touching_water(P, E, EP, VBR, hw)
-    JF += forcesLib.tensor_jacobian(U, V, E, EP, EL, free_vertices, vertex_to_free_vertex)
-    JF += forcesLib.water_pressure_jacobian(U, V, ETW, hw, free_vertices, vertex_to_free_vertex)
-    JF += forcesLib.buoyancy_jacobian(U, V, VBR, hw, free_vertices, vertex_to_free_vertex)
-    JF += forcesLib.ground_collision_jacobian(U, free_vertices, vertex_to_free_vertex)
+            # Remember, the jacobian we want is the derivative of F(U^{n+1}) = U^{n+1} - U^n - k F(U^{n})
+            self.J = model.pattern.assemble(contributions, self.k, damping)
+            if self.profile:
+                self.seconds['jacobian'] += time.perf_counter() - start
 
-    JF *= damping
+        return self.J
 
-    # add velocity derivatives:
-    for i in range(0, num_free_vertices):
-        index_vi_func = 4 * i
-        index_vi = 4 * i + 2
+    # Dense jacobian, as expected by fsolve
+    # noinspection PyUnusedLocal
+    def dense_jacobian(self, x, *args):
+        return self.jacobian(x).toarray()
 
-        JF[index_vi_func, index_vi] = 1.0  # x coordinate
-        JF[index_vi_func + 1, index_vi + 1] = 1.0  # y coordinate
+    # Residual and jacobian at x
+    def evaluate(self, x):
+        return self.function(x), self.jacobian(x)
 
-    # Remember, the jacobian we want is the derivative of F(U^{n+1}) = U^{n+1} - U^n - k F(U^{n})
-    R = I - k * JF
+    # Identifies the set of nonsmooth terms active at x: the wet edges, the
+    # slack ropes, the vertices touching the ground and the partially
+    # submerged buoys. The jacobian jumps when it changes.
+    def active_set_signature(self, x):
+        self.update(x)
 
-    return R
+        model = self.model
+        lengths = self.geometry[1]
+        slack_ropes = model.is_rope & (lengths < model.L0)
+
+        touching_ground = self.P[:, 1] < forcesLib.epsilon_ground
+
+        radii = model.VBR
+        y = self.P[:, 1]
+        partially_submerged = model.is_buoy & (y + radii > self.hw) & (y - radii < self.hw)
+
+        return np.asarray(self.ETW, dtype=int).tobytes() + np.concatenate(
+            [slack_ropes, touching_ground, partially_submerged]).tobytes()
+
+
+# Sparse jacobian of the Backward Euler system
+# noinspection PyPep8Naming
+def compute_sparse_jacobian(x, previous_U, k, model, hw):
+    system = BackwardEulerSystem(model, previous_U, k, hw)
+
+    return system.jacobian(x)
+
+
+# Dense version of the jacobian, as expected by fsolve
+# noinspection PyPep8Naming
+def compute_actual_jacobian(x, previous_U, k, model, hw):
+    return compute_sparse_jacobian(x, previous_U, k, model, hw).toarray()
 
 
 # Approximation of Jacobian for testing purposes
 # noinspection PyPep8Naming
-def compute_approximate_jacobian(x, previous_U, k, V, E, EP, EL, VBR, hw, free_vertices):
+def compute_approximate_jacobian(x, previous_U, k, model, hw):
     h = 1e-7
     num_var = len(x)
     J = np.zeros((num_var, num_var))
@@ -124,13 +171,11 @@ def compute_approximate_jacobian(x, previous_U, k, V, E, EP, EL, VBR, hw, free_v
     for i in range(0, num_var):
         x_perturb = x.copy()
         x_perturb[i] += h
-        fx_perturb_plus = compute_non_linear_system_function(x_perturb, previous_U, k, V, E, EP, EL, VBR, hw,
-                                                             free_vertices)
+        fx_perturb_plus = compute_non_linear_system_function(x_perturb, previous_U, k, model, hw)
 
         x_perturb = x.copy()
         x_perturb[i] -= h
-        fx_perturb_minus = compute_non_linear_system_function(x_perturb, previous_U, k, V, E, EP, EL, VBR, hw,
-                                                              free_vertices)
+        fx_perturb_minus = compute_non_linear_system_function(x_perturb, previous_U, k, model, hw)
 
         diff = fx_perturb_plus - fx_perturb_minus
         J[:, i] = diff / (2 * h)
@@ -142,74 +187,97 @@ def compute_approximate_jacobian(x, previous_U, k, V, E, EP, EL, VBR, hw, free_v
 # are trying to solve.  Notice that the system is actually representing an
 # iteration of the Backward Euler method: U^{n+1} - U^n - k F(U^{n}) = 0
 # noinspection PyPep8Naming
-def compute_non_linear_system_function(x, previous_U, k, V, E, EP, EL, VBR, hw, free_vertices):
-    num_vertices = len(x) // 4
-    U_n = previous_U
-    U_np = x.reshape((num_vertices, 4))
-
-    func_result = compute_function(U_np, V, E, EP, EL, VBR, hw, free_vertices)
-
-    # applying damping to velocities
-    damped_Un = U_n.copy()
-    for i in range(0, num_vertices):
-        func_result[i, 2] *= damping
-        func_result[i, 3] *= damping
-        damped_Un[i, 2] *= damping
-        damped_Un[i, 3] *= damping
+def compute_non_linear_system_function(x, previous_U, k, model, hw):
+    system = BackwardEulerSystem(model, previous_U, k, hw)
 
-    result = U_np - k * func_result[:, 0:4] - damped_Un
+    return system.function(x)
 
-    return result.reshape(-1)
 
-
-# Simple implementation of Newtons method.
-# noinspection PyPep8Naming,PyUnusedLocal
-def solve_non_linear_system(U, V, E, VP, EP, EL, VBR, hw, k, free_vertices):
+# Solves one Backward Euler step. The default 'newton' solver uses the sparse
+# jacobian and a sparse LU factorization (see solverLib), 'chord' and
+# 'broyden' also do, but keep the factorization in reuse (a
+# solverLib.FactorizationCache) across iterations and steps, and 'fsolve'
+# hands the dense jacobian to MINPACK. The wet edges are tracked by the
+# classifier (a forcesLib.WetEdgeClassifier), if given. Besides the solution,
+# returns whether it converged and a dictionary with the solver statistics,
+# which only include the seconds of each phase (see BackwardEulerSystem) with
+# profile.
+# noinspection PyPep8Naming
+def solve_non_linear_system(U, model, hw, k, solver='newton', reuse=None, classifier=None, logger=None,
+                            profile=False):
     previous_U = U
     x0 = U.reshape(-1)
     num_free_v = len(x0) // 4
     got_it = True
+    system = BackwardEulerSystem(model, previous_U, k, hw, classifier, profile)
+
+    if solver in ('chord', 'broyden'):
+        if reuse is None:
+            reuse = solverLib.FactorizationCache(solver)
+
+        signature = system.active_set_signature(x0)
+        x, info = solverLib.newton_solve(system.function, system.jacobian, x0, xtol=1e-5, reuse=reuse,
+                                         signature=signature)
+        ier = 1 if info['converged'] else 0
+        mesg = info['message']
+    elif solver == 'newton':
+        x, info = solverLib.newton_solve(system.function, system.jacobian, x0, xtol=1e-5)
+        ier = 1 if info['converged'] else 0
+        mesg = info['message']
+    elif solver == 'fsolve':
+        x, infodict, ier, mesg = sp.optimize.fsolve(system.function, x0, fprime=system.dense_jacobian, xtol=1e-5,
+                                                    full_output=1)
+        info = {
+            'iterations': infodict['njev'],
+            'nfev': infodict['nfev'],
+            'njev': infodict['njev'],
+            'factorizations': infodict['njev'],
+            'converged': ier == 1,
+            'message': mesg
+        }
+    else:
+        raise ValueError("Unknown solver: " + str(solver))
 
-    x, infodict, ier, mesg = sp.optimize.fsolve(compute_non_linear_system_function, x0,
-                               args=(previous_U, k, V, E, EP, EL, VBR, hw, free_vertices),
-                               fprime=compute_actual_jacobian, xtol=1e-5, full_output=1)
+    info['geometry_evaluations'] = system.geometry_evaluations
+    info['seconds'] = system.seconds
 
     if not ier == 1:
-        print("Warning from fsolve! Will find solution explicitly")
-        print(mesg)
+        logger = logger if logger is not None else logLib.default_logger
+        logger.sample(logLib.WARNING, 'solver_failed', solver=solver, message=mesg,
+                      action='will find solution explicitly')
         x = x0
         got_it = False
 
-    return x.reshape((num_free_v, 4)), got_it
+    return x.reshape((num_free_v, 4)), got_it, info
 
 
 # This method computes the right hand side of the ODE being solved. Notice that
 # it is not only the forces, since we are solving a system of first order
 # equations instead of the original second order ODE
+# Callers that already computed the current positions, the wet edges or the
+# edge geometry (see BackwardEulerSystem) may pass them along, and the result
+# is written into out if given.
 # noinspection PyPep8Naming
-def compute_function(U, V, E, EP, EL, VBR, hw, free_vertices):
-    num_free_vertices = len(free_vertices)
-    FU = np.zeros((num_free_vertices, 12))
+def compute_function(model, U, hw, cur_v=None, ETW=None, geometry=None, out=None):
+    FU = out if out is not None else np.empty((model.num_free_vertices, 12))
 
     # First two rows are actually previous velocities
     FU[:, 0:2] = U[:, 2:4]
 
     # Compute the current position of all vertices using our maps
-    cur_v = V.copy()
-    cur_v[free_vertices] = U[:, 0:2]
+    if cur_v is None:
+        cur_v = model.positions(U)
 
     # The last two position are the forces on each vertex
     gravity_forces, boyant_forces, water_pressure_forces, tensor_forces, total_forces = \
-        forcesLib.compute_resulting_forces(cur_v, E, EP, EL, VBR, hw)
+        forcesLib.compute_resulting_forces(model, cur_v, hw, ETW, geometry)
 
-    for j in range(0, num_free_vertices):
-        vertex_index = free_vertices[j]
-
-        FU[j, 2:4] = total_forces[vertex_index]
-        FU[j, 4:6] = water_pressure_forces[vertex_index]
-        FU[j, 6:8] = tensor_forces[vertex_index]
-        FU[j, 8:10] = gravity_forces[vertex_index]
-        FU[j, 10:12] = boyant_forces[vertex_index]
+    free_vertices = model.free_vertices
+    FU[:, 2:4] = total_forces[free_vertices]
+    FU[:, 4:6] = water_pressure_forces[free_vertices]
+    FU[:, 6:8] = tensor_forces[free_vertices]
+    FU[:, 8:10] = gravity_forces[free_vertices]
+    FU[:, 10:12] = boyant_forces[free_vertices]
 
     # Draw force vectors
     # plotLib.drawVectors(V, Forces)
@@ -217,234 +285,474 @@ def compute_function(U, V, E, EP, EL, VBR, hw, free_vertices):
     return FU
 
 
+# Reusable buffers of the time stepping loops. Positions and forces are
+# written straight into the output arrays, so a step allocates nothing
+# besides what the force kernels need.
+# noinspection PyPep8Naming
+class StepWorkspace(object):
+    def __init__(self, model):
+        self.damped_U = np.empty((model.num_free_vertices, 4))
+
+        # damping only scales the velocity columns
+        self.damping_scale = np.array([1.0, 1.0, damping, damping])
+
+    # Explicit step D U + h D F(U), where D damps the velocities and
+    # func_result is F(U) (see compute_function). Written into out.
+    # noinspection PyPep8Naming
+    def damped_step(self, U, func_result, h, out):
+        np.multiply(func_result[:, 0:4], self.damping_scale, out=out)
+        out *= h
+        np.multiply(U, self.damping_scale, out=self.damped_U)
+        out += self.damped_U
+
+        return out
+
+
+# Steps kept by the streaming mode (see StepBuffer) if not told otherwise
+streaming_buffer_steps = 1000
+
+
+# Storage of the simulated steps: state U and function FU of the free
+# vertices, positions P and forces of all of them and the water level wl.
+# Step n lives at row n % num_steps. When a run has more steps than that (or
+# is unlimited), the buffer is a ring of the steps not yet emitted: the
+# integrators emit a batch before it fills up, and the memory does not depend
+# on the length of the run.
+# noinspection PyPep8Naming
+class StepBuffer(object):
+    def __init__(self, model, num_steps, ring=False):
+        self.num_steps = num_steps
+        self.ring = ring
+
+        # U contains, for each (free) vertex, pos X,Y and velocities VX,VY, where V* is
+        # the velocity in coordinate *
+        self.U = np.zeros((num_steps, model.num_free_vertices, 4))
+        self.P = np.empty((num_steps, model.num_v, 2))
+        self.forces = np.zeros((num_steps, model.num_v, 12))
+        self.FU = np.zeros((num_steps, model.num_free_vertices, 12))
+        self.wl = np.zeros(num_steps)
+
+        # Set positions equal to initial. Fixed vertices never move, so only
+        # the free ones are written afterwards
+        self.P[:] = model.V
+
+    # Whole history for runs of max_iterations steps, unless a smaller
+    # buffer_steps asks for streaming. Unlimited runs (max_iterations None)
+    # always stream.
+    @staticmethod
+    def create(model, max_iterations, buffer_steps=None):
+        if max_iterations is None and buffer_steps is None:
+            buffer_steps = streaming_buffer_steps
+
+        if buffer_steps is None or (max_iterations is not None and buffer_steps >= max_iterations):
+            return StepBuffer(model, max_iterations)
+
+        # steps from the last emitted one to the next one must fit
+        return StepBuffer(model, max(buffer_steps, 3), ring=True)
+
+    # Row holding step n
+    def row(self, n):
+        return n % self.num_steps
+
+    # Whether writing the step after n would overwrite step start, the first
+    # one not emitted yet
+    def full(self, start, n):
+        return self.ring and n + 2 - start >= self.num_steps
+
+    # Batch of steps start to end (excluded), see batch_result. A ring buffer
+    # returns copies, since its rows are reused afterwards
+    def batch(self, start, end, total_steps):
+        if not self.ring:
+            return batch_result(self.P, self.forces, self.wl, start, end, total_steps)
+
+        rows = np.arange(start, end) % self.num_steps
+        return batch_result(self.P[rows], self.forces[rows], self.wl[rows], 0, end - start, total_steps)
+
+
+# Steps of a run of max_iterations steps, None meaning it never ends
+def simulation_steps(max_iterations):
+    return itertools.count() if max_iterations is None else range(0, max_iterations - 1)
+
+
+# Writer of the results of a run to results_path (see resultsLib), or None
+# if they are not to be stored
+def results_writer(results_path, model, settings):
+    return resultsLib.ResultWriter(results_path, model, settings) if results_path is not None else None
+
+
+# Adds a batch of steps from start on to the statistics and to the results
+# (if any). Returns the batch followed by a dictionary with the summary of
+# the statistics so far and the telemetry of the timers (see
+# profileLib.PhaseTimers, None if not profiling).
+def record_batch(batch, start, statistics, results, timers):
+    statistics.update(start, *batch[0:3])
+    if results is not None:
+        results.append(*batch[0:3])
+
+    return batch + ({'statistics': statistics.summary(), 'telemetry': timers.telemetry()},)
+
+
+# Lines of results_data.txt about the peaks of the default statistics (see
+# statsLib.SummaryStatistics.default)
+def statistics_report(statistics):
+    lines = []
+    forces = statistics['forces']
+    for component in resultsLib.force_components:
+        peak = forces.peak(component)
+        if peak is None:
+            continue
+
+        magnitude, step, vertex, water_level = peak
+        name = 'force' if component == 'total' else component.replace('_', ' ') + ' force'
+        lines.append(f"Maximum {name}: {magnitude} at time step {step} on vertex {vertex} "
+                     f"(water level {water_level})")
+
+    ropes = statistics['rope_tension']
+    if len(ropes.ropes) > 0 and ropes.count > 0:
+        r = int(np.argmax(ropes.maximum))
+        lines.append(f"Maximum rope tension: {ropes.maximum[r]} at time step {ropes.peak_step[r]} on edge "
+                     f"{ropes.ropes[r]} (water level {ropes.peak_water_level[r]})")
+
+    water_level = statistics['water_level'].summary()
+    lines.append(f"Water level: from {water_level['minimum']} to {water_level['maximum']}")
+
+    return lines
+
+
 # noinspection PyPep8Naming,PyPep8Naming
 def batch_result(U, FU, wl, start, end, total_steps):
-    print('getting batch from', start, end)
     return U[start:end, :, 0:2], FU[start:end, :, 2:12], wl[start:end], total_steps
 
 
-def verify_equilibrium(velocity_and_forces, tolerance):
+def verify_equilibrium(velocity_and_forces, tolerance, logger=None):
     max_value = np.linalg.norm(velocity_and_forces.reshape(-1), np.inf)
 
     if max_value < tolerance:
         return True
     else:
-        print("Max value not in equilibrium: ", max_value)
+        logger = logger if logger is not None else logLib.default_logger
+        logger.sample(logLib.DEBUG, 'not_in_equilibrium', max_value=max_value)
         return False
 
 
-# run Backward Forward Euler to simulate watergate system
+# run Backward Forward Euler to simulate watergate system. max_iterations
+# None runs until the generator is closed, keeping only the steps not yet
+# emitted (see StepBuffer); buffer_steps also asks for such a streaming
+# mode on finite runs. Batches of unlimited runs report the steps simulated
+# so far as total steps. The emitted steps are stored in results_path,
+# unless it is None, and added to statistics (by default
+# statsLib.SummaryStatistics.default), whose summary so far follows the
+# steps in every batch. Diagnostics go to logger (by default
+# logLib.default_logger); per step ones are rate limited, and skipped
+# altogether unless its level is DEBUG. With profile, the time spent in each
+# phase of the steps and the solver counters are reported with every batch
+# and at the end of the run; it is off by default, since the timers cost a
+# few percent of the short steps of small models. The report of the run is written to report_path.
+# Batches are emitted every batch_duration seconds, unless pacing (see
+# pacingLib) decides when instead.
 # noinspection PyPep8Naming
-def implicit_simulation(V, E, VP, EP, EL, VBR, hw, water_speed=0.0, k=0.01, max_iterations=1000, batch_duration=1):
-    num_v = len(V)  # number of vertices
-
-    E, EP, EL = pre_ordering_of_edges(V, E, EP, EL)
-
-    # construct map from free vertices to vertices and vice versa
-    free_vertices = []
-    num_free_vertices = 0
-    for i in range(0, len(V)):
-        if VP[i] != 1:
-            free_vertices.append(i)
-            num_free_vertices += 1
-
-    # U contains, for each (free) vertex, pos X,Y and velocities VX,VY, where V* is
-    # the velocity in coordinate *
-    U = np.zeros((max_iterations, num_free_vertices, 4))
-    P = np.zeros((max_iterations, num_v, 2))
-    forces = np.zeros((max_iterations, num_v, 12))
-    FU = np.zeros((max_iterations, num_free_vertices, 12))
-    wl = np.zeros(max_iterations)
+def implicit_simulation(model, hw, water_speed=0.0, k=0.01, max_iterations=1000, batch_duration=1, solver='newton',
+                        buffer_steps=None, results_path=default_results_path, statistics=None, logger=None,
+                        profile=False, report_path=default_report_path, pacing=None):
+    V = model.V
+    free_vertices = model.free_vertices
+
+    results = results_writer(results_path, model, {
+        'method': 'Backward Euler',
+        'solver': solver,
+        'time_step': k,
+        'water_level': hw,
+        'water_speed': water_speed,
+        'max_iterations': max_iterations,
+        'damping': damping
+    })
+
+    statistics = statistics if statistics is not None else statsLib.SummaryStatistics.default(model)
+    logger = logger if logger is not None else logLib.default_logger
+    log_steps = logger.is_enabled(logLib.DEBUG)
+    timers = profileLib.phase_timers(profile)
+
+    steps = StepBuffer.create(model, max_iterations, buffer_steps)
+    U, P, forces, FU, wl = steps.U, steps.P, steps.forces, steps.FU, steps.wl
+    workspace = StepWorkspace(model)
+
+    # solver statistics over the run (a failed step counts 0 iterations)
+    steps_taken = 0
+    solver_iterations = 0
+    max_solver_iterations = 0
+    solver_failures = 0
+    jacobian_evaluations = 0
+    factorizations = 0
+
+    # chord and Broyden solvers keep the factorization across steps
+    reuse = solverLib.FactorizationCache(solver) if solver in ('chord', 'broyden') else None
+
+    # the wet edges barely change from one step to the next
+    classifier = forcesLib.WetEdgeClassifier(model)
 
     # construct U0 (velocity is already 0). Set positions equal to initial
     U[0, :, 0:2] = V[free_vertices]
-    P[0] = V.copy()
 
-    last_emit_time = time.time()
+    pacing = pacingLib.batch_pacing(batch_duration, pacing)
     last_emitted = 0
 
     # turn plotting on
     # plotLib.ion()
     # plotLib.show()
-    maximum_force = 0.0
-    time_step_of_max_force = -1
-    for n in range(0, max_iterations - 1):
-        print("Water level: " + str(hw))
-
-        # plot current setup
-        # plotLib.plotWatergateSetup(U[n, :, 0:2], E, EP, hw)
-
-        # run iteration of Backward Euler
-        # compute function and run Newtons method to find new U
-        FU[n] = compute_function(U[n], V, E, EP, EL, VBR, hw, free_vertices)
-
-        # applying damping to velocities for initial guess
-        damped_Un = U[n].copy()
-        damped_func_result = FU[n, :, 0:4].copy()
-        for i in range(0, len(free_vertices)):
-            damped_func_result[i, 2] *= damping
-            damped_func_result[i, 3] *= damping
-            damped_Un[i, 2] *= damping
-            damped_Un[i, 3] *= damping
-
-        initial_guess = damped_Un + 0.2 * k * damped_func_result
-
-        result, got_it = solve_non_linear_system(initial_guess, V, E, VP, EP, EL, VBR, hw, k, free_vertices)
-        if got_it:
-            U[n + 1] = result
-        else:
-            U[n + 1] = initial_guess
-
-        P[n + 1] = V.copy()
-        P[n + 1, free_vertices] = U[n + 1, :, 0:2]
-        forces[n] = np.zeros((num_v, 12))
-        forces[n, free_vertices] = FU[n]
-        wl[n] = hw
-
-        print(f"Iteration: {n}")
-        print(f"forces: {forces[n]}")
-        print(f"type of forces: {type(forces[n])}")
-        print(f"forces[n].shape: {forces[n].shape}")
-
-        max_value_index = np.unravel_index(np.argmax(forces[n]), forces[n].shape)
-        max_value = forces[n][max_value_index]
-        # print(f"The maximum value is {max_value} at position {max_value_index}")    
-        # break
-        if max_value > maximum_force:
-            maximum_force = max_value
-            time_step_of_max_force = n
-            vertex_of_max_force = np.unravel_index(np.argmax(forces[n]), forces[n].shape)
-
-        # pause and update plot
-        # plotLib.pause()
-        # if n == 0:
-        #    time.sleep(1)
-
-        # compute displacement update between new U and previous U
-        # displacement = U[n + 1] - U[n]
-        # noinspection PyTypeChecker
-        # distance = np.sum(np.abs(displacement) ** 2, axis=-1) ** (1. / 2)
-
-        if time.time() - last_emit_time >= batch_duration or n == max_iterations - 2:
-            yield batch_result(P, forces, wl, last_emitted, n, max_iterations)
-            last_emitted = n
-            last_emit_time = time.time()
-
-        # if small distance, halts
-        # if np.max(distance) < 1e-15:
-        #    print("Finished: left because was in equilibrium")
-        #    print("Iteration:", n)
-        #    print("Displacement:", np.max(distance))
-        #    yield batch_result(P, forces, wl, last_emitted, n, max_iterations)
-        #    break
-
-        in_equilibrium = verify_equilibrium(FU[n, :, 0:4], 100.0)
-
-        if in_equilibrium:
-            # computing new water level
-            hw += water_speed * k
-    print(f"Maximum force: {maximum_force}")
-    print(f"Time step of maximum force: {time_step_of_max_force}")
-    print(f"Vertex of maximum force: {vertex_of_max_force}")
-
-    # convert nd array to list
-    forces_list = forces.tolist()
-    # save list as JSON file
-    with open('results_forces.json', 'w') as f:
-        json.dump(forces_list, f)
-    with open('results_data.txt', 'w') as f:
-        f.write(f"Maximum force: {maximum_force}\n")
-        f.write(f"Time step of maximum force: {time_step_of_max_force}\n")
-        f.write(f"Vertex of maximum force: {vertex_of_max_force}\n")
+    try:
+        for n in simulation_steps(max_iterations):
+            i = steps.row(n)
+            j = steps.row(n + 1)
+
+            # plot current setup
+            # plotLib.plotWatergateSetup(U[i, :, 0:2], E, EP, hw)
+
+            # run iteration of Backward Euler
+            # compute function and run Newtons method to find new U
+            ETW = classifier.classify(P[i], hw)
+            timers.lap('classification')
+            compute_function(model, U[i], hw, P[i], ETW, out=FU[i])
+            timers.lap('forces')
+
+            # applying damping to velocities for initial guess, which is kept if
+            # the solver fails
+            initial_guess = workspace.damped_step(U[i], FU[i], 0.2 * k, out=U[j])
+
+            result, got_it, solver_info = solve_non_linear_system(initial_guess, model, hw, k, solver, reuse,
+                                                                 classifier, logger, profile)
+            timers.lap('solver')
+            timers.split('solver', solver_info['seconds'])
+            timers.count('nfev', solver_info['nfev'])
+            timers.count('njev', solver_info['njev'])
+            timers.count('factorizations', solver_info['factorizations'])
+            timers.count('solver_iterations', solver_info['iterations'])
+            if not got_it:
+                timers.count('solver_failures')
+            steps_taken += 1
+            jacobian_evaluations += solver_info['njev']
+            factorizations += solver_info['factorizations']
+            if got_it:
+                U[j] = result
+                solver_iterations += solver_info['iterations']
+                max_solver_iterations = max(max_solver_iterations, solver_info['iterations'])
+            else:
+                solver_failures += 1
+
+            P[j, free_vertices] = U[j, :, 0:2]
+            forces[i, free_vertices] = FU[i]
+            wl[i] = hw
+
+            if log_steps:
+                logger.sample(logLib.DEBUG, 'step', lambda: {
+                    'step': n,
+                    'water_level': hw,
+                    'solver_iterations': solver_info['iterations'],
+                    'forces': forces[i]
+                })
+            timers.lap('bookkeeping')
+
+            # pause and update plot
+            # plotLib.pause()
+            # if n == 0:
+            #    time.sleep(1)
+
+            # compute displacement update between new U and previous U
+            # displacement = U[j] - U[i]
+            # noinspection PyTypeChecker
+            # distance = np.sum(np.abs(displacement) ** 2, axis=-1) ** (1. / 2)
+
+            last_step = max_iterations is not None and n == max_iterations - 2
+            if (n > last_emitted and pacing.ready()) or last_step or steps.full(last_emitted, n):
+                batch = steps.batch(last_emitted, n, max_iterations if max_iterations is not None else n)
+                logger.debug('batch', start=last_emitted, end=n)
+                batch = record_batch(batch, last_emitted, statistics, results, timers)
+                timers.lap('recording')
+                yield batch
+                timers.lap('emit')
+                last_emitted = n
+                pacing.emitted()
+
+            # if small distance, halts
+            # if np.max(distance) < 1e-15:
+            #    print("Finished: left because was in equilibrium")
+            #    print("Iteration:", n)
+            #    print("Displacement:", np.max(distance))
+            #    yield steps.batch(last_emitted, n, max_iterations)
+            #    break
+
+            in_equilibrium = verify_equilibrium(FU[i, :, 0:4], 100.0, logger)
+            timers.count('equilibrium_checks')
+
+            if in_equilibrium:
+                timers.count('in_equilibrium')
+                # computing new water level
+                hw += water_speed * k
+            timers.lap('equilibrium')
+
+        mean_solver_iterations = solver_iterations / max(steps_taken, 1)
+        factorizations_per_step = factorizations / max(steps_taken, 1)
+        report = statistics_report(statistics)
+        logger.info('summary', peaks=report, solver=solver, mean_solver_iterations=mean_solver_iterations,
+                    max_solver_iterations=max_solver_iterations, solver_failures=solver_failures,
+                    jacobian_evaluations=jacobian_evaluations, factorizations=factorizations,
+                    factorizations_per_step=factorizations_per_step)
+        profile_report = timers.report()
+        if profile:
+            logger.info('profile', phases=profile_report)
+
+        if results is not None:
+            results.close()
+    finally:
+        # a run that failed or was stopped early (e.g. a cancelled job closing
+        # the generator) keeps the steps it emitted, marked as incomplete
+        if results is not None:
+            results.close(complete=False)
+
+    with open(report_path, 'w') as f:
+        for line in report:
+            f.write(line + "\n")
+        f.write(f"Forces are magnitudes of the force vectors\n")
         f.write(f"Note that the vertex is the index of the vertex in the list of vertices, not the vertex number\n")
-        f.write(f"Add 1 to the vertex index to get the vertex number. e.g. if index is (3,5) then it denotes the 4th vertex \n")
-    print(f"after writing to json")
+        f.write(f"Add 1 to the vertex index to get the vertex number. e.g. if index is 3 then it denotes the 4th vertex \n")
+        f.write(f"Solver: {solver}\n")
+        f.write(f"Solver iterations per step: mean {mean_solver_iterations}, max {max_solver_iterations}\n")
+        f.write(f"Solver failures (steps that fell back to the explicit guess): {solver_failures}\n")
+        f.write(f"Jacobian evaluations: {jacobian_evaluations}\n")
+        f.write(f"LU factorizations: {factorizations} ({factorizations_per_step} per step)\n")
+        if profile:
+            f.write(f"Profile:\n")
+            for line in profile_report:
+                f.write("    " + line + "\n")
+    logger.debug('results_written', path=results_path)
 # Simulation is actually done by solving the ODE: w * x''(t) = F(x), where w is
 # weight (initially considered as '1'), x is position of the node and F(x) is
 # the force on the node.
 # k = time step
+# max_iterations, buffer_steps, results_path, statistics, logger, profile and
+# pacing as in implicit_simulation
 # noinspection PyPep8Naming
-def simulate(V, E, VP, EP, EL, VBR, hw, water_speed=0.0, k=0.0001, max_iterations=10000, batch_duration=1):
-    num_v = len(V)  # number of vertices
-
-    E, EP, EL = pre_ordering_of_edges(V, E, EP, EL)
-
-    # construct map from free vertices to vertices and vice versa
-    free_vertices = []
-    num_free_vertices = 0
-    for i in range(0, len(V)):
-        if VP[i] != 1:
-            free_vertices.append(i)
-            num_free_vertices += 1
-
-    # U contains, for each (free) vertex, pos X,Y and velocities VX,VY, where V* is
-    # the velocity in coordinate *
-    U = np.zeros((max_iterations, num_free_vertices, 4))
-    P = np.zeros((max_iterations, num_v, 2))
-    forces = np.zeros((max_iterations, num_v, 12))
-    FU = np.zeros((max_iterations, num_free_vertices, 12))
-    wl = np.zeros(max_iterations)
+def simulate(model, hw, water_speed=0.0, k=0.0001, max_iterations=10000, batch_duration=1, buffer_steps=None,
+             results_path=None, statistics=None, logger=None, profile=False, pacing=None):
+    V = model.V
+    free_vertices = model.free_vertices
+
+    results = results_writer(results_path, model, {
+        'method': 'Forward Euler',
+        'time_step': k,
+        'water_level': hw,
+        'water_speed': water_speed,
+        'max_iterations': max_iterations,
+        'damping': damping
+    })
+
+    statistics = statistics if statistics is not None else statsLib.SummaryStatistics.default(model)
+    logger = logger if logger is not None else logLib.default_logger
+    log_steps = logger.is_enabled(logLib.DEBUG)
+    timers = profileLib.phase_timers(profile)
+
+    steps = StepBuffer.create(model, max_iterations, buffer_steps)
+    U, P, forces, FU, wl = steps.U, steps.P, steps.forces, steps.FU, steps.wl
+    workspace = StepWorkspace(model)
 
     # construct U0 (velocity is already 0). Set positions equal to initial
     U[0, :, 0:2] = V[free_vertices]
-    P[0] = V.copy()
 
-    last_emit_time = time.time()
+    pacing = pacingLib.batch_pacing(batch_duration, pacing)
     last_emitted = 0
 
     # turn plotting on
     # plotLib.ion()
     # plotLib.show()
 
-    for n in range(0, max_iterations - 1):
-        # run Forward Euler
-        FU[n] = compute_function(U[n], V, E, EP, EL, VBR, hw, free_vertices)
-        wl[n] = hw
-        #  print(FU[n].shape)
-        #  print(FU[n, :].shape, FU[n, :, 0:4].shape)
-
-        # applying damping to velocities
-        damped_Un = U[n].copy()
-        damped_func_result = FU[n, :, 0:4].copy()
-        for i in range(0, len(free_vertices)):
-            damped_func_result[i, 2] *= damping
-            damped_func_result[i, 3] *= damping
-            damped_Un[i, 2] *= damping
-            damped_Un[i, 3] *= damping
-
-        U[n + 1] = damped_Un + k * damped_func_result
-
-        P[n + 1] = V.copy()
-        P[n + 1, free_vertices] = U[n + 1, :, 0:2]
-        forces[n] = np.zeros((num_v, 12))
-        forces[n, free_vertices] = FU[n]
-
-        # pause and update plot
-        # plotLib.pause()
-        # if n == 0:
-        #    time.sleep(1)
-
-        # compute displacement update between new U and previous U
-        # displacement = U[n + 1] - U[n]
-        # noinspection PyTypeChecker
-        # distance = np.sum(np.abs(displacement) ** 2, axis=-1) ** (1. / 2)
-
-        if time.time() - last_emit_time >= batch_duration or n == max_iterations - 2:
-            yield batch_result(P, forces, wl, last_emitted, n, max_iterations)
-            last_emitted = n
-            last_emit_time = time.time()
-
-        # if small distance, halts
-        # if np.max(distance) < 1e-15:
-        #    print("Finished: left because was in equilibrium")
-        #    yield batch_result(P, forces, wl, last_emitted, n, max_iterations)
-        #    break
-
-        in_equilibrium = verify_equilibrium(FU[n, :, 0:4], 100.0)
-
-        if in_equilibrium:
-            # computing new water level
-            hw += water_speed * k
+    # the wet edges barely change from one step to the next
+    classifier = forcesLib.WetEdgeClassifier(model)
+
+    try:
+        for n in simulation_steps(max_iterations):
+            i = steps.row(n)
+            j = steps.row(n + 1)
+
+            # run Forward Euler
+            ETW = classifier.classify(P[i], hw)
+            timers.lap('classification')
+            compute_function(model, U[i], hw, P[i], ETW, out=FU[i])
+            timers.lap('forces')
+            wl[i] = hw
+            #  print(FU[i].shape)
+            #  print(FU[i, :].shape, FU[i, :, 0:4].shape)
+
+            # applying damping to velocities
+            workspace.damped_step(U[i], FU[i], k, out=U[j])
+
+            P[j, free_vertices] = U[j, :, 0:2]
+            forces[i, free_vertices] = FU[i]
+
+            if log_steps:
+                logger.sample(logLib.DEBUG, 'step', lambda: {'step': n, 'water_level': hw, 'forces': forces[i]})
+            timers.lap('integration')
+
+            # pause and update plot
+            # plotLib.pause()
+            # if n == 0:
+            #    time.sleep(1)
+
+            # compute displacement update between new U and previous U
+            # displacement = U[j] - U[i]
+            # noinspection PyTypeChecker
+            # distance = np.sum(np.abs(displacement) ** 2, axis=-1) ** (1. / 2)
+
+            last_step = max_iterations is not None and n == max_iterations - 2
+            if (n > last_emitted and pacing.ready()) or last_step or steps.full(last_emitted, n):
+                batch = steps.batch(last_emitted, n, max_iterations if max_iterations is not None else n)
+                logger.debug('batch', start=last_emitted, end=n)
+                batch = record_batch(batch, last_emitted, statistics, results, timers)
+                timers.lap('recording')
+                yield batch
+                timers.lap('emit')
+                last_emitted = n
+                pacing.emitted()
+
+            # if small distance, halts
+            # if np.max(distance) < 1e-15:
+            #    print("Finished: left because was in equilibrium")
+            #    yield steps.batch(last_emitted, n, max_iterations)
+            #    break
+
+            in_equilibrium = verify_equilibrium(FU[i, :, 0:4], 100.0, logger)
+            timers.count('equilibrium_checks')
+
+            if in_equilibrium:
+                timers.count('in_equilibrium')
+                # computing new water level
+                hw += water_speed * k
+            timers.lap('equilibrium')
+
+        if results is not None:
+            results.close()
+    finally:
+        # a run that failed or was stopped early (e.g. a cancelled job closing
+        # the generator) keeps the steps it emitted, marked as incomplete
+        if results is not None:
+            results.close(complete=False)
+
+    if profile:
+        logger.info('profile', phases=timers.report())
+
+
+# Maximum of iterations of a request, or None for runs that go on until
+# cancelled, which have to be asked for explicitly with unlimited
+def iteration_limit(post_body):
+    if post_body.get('unlimited', False) is True:
+        return None
+
+    try:
+        max_iterations = int(post_body.get('maxIterations', 1000))
+    except (TypeError, ValueError):
+        raise ValueError("maxIterations must be an integer: " + repr(post_body.get('maxIterations')))
+    if max_iterations <= 0:
+        raise ValueError("maxIterations must be positive (set unlimited to run until cancelled)")
+
+    return max_iterations
 
 
 # noinspection PyPep8Naming
@@ -458,10 +766,12 @@ def from_json(post_body):
     water_speed = float(post_body.get('waterLevelRaiseRate', "0.0"))
     VBR = np.array(post_body['vertexBoyantRadiai'])
     time_step = float(post_body.get('timeStep', "0.01"))
-    max_iterations = int(post_body.get('maxIterations', 1000))
+    max_iterations = iteration_limit(post_body)
     simulation_method = post_body.get('simulationMethod', "Backward Euler")
 
-    return V, E, VP, EP, EL, hw, VBR, water_speed, time_step, max_iterations, simulation_method
+    model = modelLib.SimulationModel(V, E, VP, EP, EL, VBR)
+
+    return model, hw, water_speed, time_step, max_iterations, simulation_method
 
 
 # noinspection PyPep8Naming
@@ -508,7 +818,7 @@ def setup_original_watergate_example():
     EP = [0, 0, 0, 0, 2]
     print("EP: ", EP)
 
-    return V, E, VP, EP, EL, VBR, hw
+    return modelLib.SimulationModel(V, E, VP, EP, EL, VBR), hw
 
 
 # second scenario: one extra rope
@@ -549,7 +859,7 @@ def setup_original_watergate_example2():
     EP = [0, 0, 0, 0, 2, 2]
     print("EP: ", EP)
 
-    return V, E, VP, EP, EL, VBR, hw
+    return modelLib.SimulationModel(V, E, VP, EP, EL, VBR), hw
 
 
 # third scenario: one hope in diff position
@@ -589,7 +899,7 @@ def setup_original_watergate_example3():
     EP = [0, 0, 0, 0, 2]
     print("EP: ", EP)
 
-    return V, E, VP, EP, EL, VBR, hw
+    return modelLib.SimulationModel(V, E, VP, EP, EL, VBR), hw
 
 
 # forth scenario
@@ -630,7 +940,7 @@ def setup_original_watergate_example4():
     EP = [0, 0, 0, 0, 2]
     print("EP: ", EP)
 
-    return V, E, VP, EP, EL, hw
+    return modelLib.SimulationModel(V, E, VP, EP, EL, VBR), hw
 
 
 # noinspection PyPep8Naming
@@ -669,7 +979,7 @@ def setup_original_watergate_example5():
     EP = [0, 0, 0, 0, 2]
     print("EP: ", EP)
 
-    return V, E, VP, EP, EL, hw
+    return modelLib.SimulationModel(V, E, VP, EP, EL, VBR), hw
 
 
 # second scenario: one extra rope
@@ -710,7 +1020,7 @@ def setup_original_watergate_example6():
     EP = [0, 0, 0, 0, 2, 2]
     print("EP: ", EP)
 
-    return V, E, VP, EP, EL, VBR, hw
+    return modelLib.SimulationModel(V, E, VP, EP, EL, VBR), hw
 
 
 # 7th scenario: springs go out of the water and then return
@@ -754,7 +1064,7 @@ def setup_original_watergate_example7():
     EP = [0, 0, 0, 0, 2, 2, 0, 0, 0]
     print("EP: ", EP)
 
-    return V, E, VP, EP, EL, VBR, hw
+    return modelLib.SimulationModel(V, E, VP, EP, EL, VBR), hw
 
 
 # 8th scenario: springs go underground
@@ -798,4 +1108,4 @@ def setup_original_watergate_example8():
     EP = [0, 0, 0, 0, 2, 2, 0, 0, 0]
     print("EP: ", EP)
 
-    return V, E, VP, EP, EL, VBR, hw
+    return modelLib.SimulationModel(V, E, VP, EP, EL, VBR), hw
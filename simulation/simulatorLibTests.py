@@ -1,9 +1,12 @@
 import pdb
 import unittest
 
+import forcesLib
+import modelLib
 import numpy as np
 import scipy as sp
 import simulatorLib
+import solverLib
 from scipy import optimize
 
 
@@ -37,18 +40,9 @@ class SimulatorLibTests(unittest.TestCase):
     def testJacobian(self):
         # Arrange
         k = 0.01
-        V, E, VP, EP, EL, VBR, hw = simulatorLib.setup_original_watergate_example2()
-        E, EP, EL = simulatorLib.pre_ordering_of_edges(V, E, EP, EL)
+        model, hw = simulatorLib.setup_original_watergate_example2()
 
-        free_vertices = []
-        num_free_vertices = 0
-        for i in range(0, len(V)):
-            if VP[i] != 1:
-                free_vertices.append(i)
-                num_free_vertices += 1
-
-        U = np.zeros((num_free_vertices, 4))
-        U[:, 0:2] = V[free_vertices]
+        U = model.initial_state()
 
         x = U.copy().reshape(-1)
         x += np.array([1.81108641, 3.19165332, 6.24289746, 7.83594813,
@@ -56,8 +50,8 @@ class SimulatorLibTests(unittest.TestCase):
 
         # Act
         #approx_J = optimize.slsqp.approx_jacobian(x, simulatorLib.compute_non_linear_system_function, 1e-8, U, k, V, E, EP, EL, VBR, hw, free_vertices)
-        approx_J = simulatorLib.compute_approximate_jacobian(x, U, k, V, E, EP, EL, VBR, hw, free_vertices)
-        J = simulatorLib.compute_actual_jacobian(x, U, k, V, E, EP, EL, VBR, hw, free_vertices)
+        approx_J = simulatorLib.compute_approximate_jacobian(x, U, k, model, hw)
+        J = simulatorLib.compute_actual_jacobian(x, U, k, model, hw)
 
         # Assert
         error = approx_J - J
@@ -74,18 +68,9 @@ class SimulatorLibTests(unittest.TestCase):
     def testJacobianBuoyancy(self):
         # Arrange
         k = 0.01
-        V, E, VP, EP, EL, VBR, hw = simulatorLib.setup_original_watergate_example6()
-        E, EP, EL = simulatorLib.pre_ordering_of_edges(V, E, EP, EL)
-
-        free_vertices = []
-        num_free_vertices = 0
-        for i in range(0, len(V)):
-            if VP[i] != 1:
-                free_vertices.append(i)
-                num_free_vertices += 1
+        model, hw = simulatorLib.setup_original_watergate_example6()
 
-        U = np.zeros((num_free_vertices, 4))
-        U[:, 0:2] = V[free_vertices]
+        U = model.initial_state()
 
         x = U.copy().reshape(-1)
         x += np.array([0.181108641, 0.319165332, 0.624289746, 0.783594813,
@@ -93,8 +78,8 @@ class SimulatorLibTests(unittest.TestCase):
 
         # Act
         # approxJ1 = optimize.slsqp.approx_jacobian(x, simulatorLib.computeNonLinearSystemFunction, 1e-8, U, k, E, VP, EP, EL, hw)
-        approx_J = simulatorLib.compute_approximate_jacobian(x, U, k, V, E, EP, EL, VBR, hw, free_vertices)
-        J = simulatorLib.compute_actual_jacobian(x, U, k, V, E, EP, EL, VBR, hw, free_vertices)
+        approx_J = simulatorLib.compute_approximate_jacobian(x, U, k, model, hw)
+        J = simulatorLib.compute_actual_jacobian(x, U, k, model, hw)
 
         # Assert
         error = approx_J - J
@@ -110,18 +95,9 @@ class SimulatorLibTests(unittest.TestCase):
     def testJacobianEdgesReturningToWater(self):
         # Arrange
         k = 0.01
-        V, E, VP, EP, EL, VBR, hw = simulatorLib.setup_original_watergate_example7()
-        E, EP, EL = simulatorLib.pre_ordering_of_edges(V, E, EP, EL)
-
-        free_vertices = []
-        num_free_vertices = 0
-        for i in range(0, len(V)):
-            if VP[i] != 1:
-                free_vertices.append(i)
-                num_free_vertices += 1
+        model, hw = simulatorLib.setup_original_watergate_example7()
 
-        U = np.zeros((num_free_vertices, 4))
-        U[:, 0:2] = V[free_vertices]
+        U = model.initial_state()
 
         x = U.copy().reshape(-1)
         x += np.array([0.0181108641, 0.0319165332, 0.0624289746, 0.0783594813,
@@ -133,8 +109,8 @@ class SimulatorLibTests(unittest.TestCase):
 
         # Act
         #approx_J = optimize.slsqp.approx_jacobian(x, simulatorLib.compute_non_linear_system_function, 1e-8, U, k, V, E, EP, EL, VBR, hw, free_vertices)
-        approx_J = simulatorLib.compute_approximate_jacobian(x, U, k, V, E, EP, EL, VBR, hw, free_vertices)
-        J = simulatorLib.compute_actual_jacobian(x, U, k, V, E, EP, EL, VBR, hw, free_vertices)
+        approx_J = simulatorLib.compute_approximate_jacobian(x, U, k, model, hw)
+        J = simulatorLib.compute_actual_jacobian(x, U, k, model, hw)
 
         # Assert
         error = approx_J - J
@@ -150,18 +126,9 @@ class SimulatorLibTests(unittest.TestCase):
     def testJacobianEdgesUnderground(self):
         # Arrange
         k = 0.01
-        V, E, VP, EP, EL, VBR, hw = simulatorLib.setup_original_watergate_example8()
-        E, EP, EL = simulatorLib.pre_ordering_of_edges(V, E, EP, EL)
+        model, hw = simulatorLib.setup_original_watergate_example8()
 
-        free_vertices = []
-        num_free_vertices = 0
-        for i in range(0, len(V)):
-            if VP[i] != 1:
-                free_vertices.append(i)
-                num_free_vertices += 1
-
-        U = np.zeros((num_free_vertices, 4))
-        U[:, 0:2] = V[free_vertices]
+        U = model.initial_state()
 
         x = U.copy().reshape(-1)
         x += np.array([0.0181108641, 0.0319165332, 0.0624289746, 0.0783594813,
@@ -173,8 +140,8 @@ class SimulatorLibTests(unittest.TestCase):
 
         # Act
         #approx_J = optimize.slsqp.approx_jacobian(x, simulatorLib.compute_non_linear_system_function, 1e-8, U, k, V, E, EP, EL, VBR, hw, free_vertices)
-        approx_J = simulatorLib.compute_approximate_jacobian(x, U, k, V, E, EP, EL, VBR, hw, free_vertices)
-        J = simulatorLib.compute_actual_jacobian(x, U, k, V, E, EP, EL, VBR, hw, free_vertices)
+        approx_J = simulatorLib.compute_approximate_jacobian(x, U, k, model, hw)
+        J = simulatorLib.compute_actual_jacobian(x, U, k, model, hw)
 
         # Assert
         error = approx_J - J
@@ -185,6 +152,225 @@ class SimulatorLibTests(unittest.TestCase):
         self.assertTrue(np.allclose(J, approx_J, 1e-3, 1e-2))
         self.assertAlmostEqual(max_error, 0.0, 4)
 
+    # Sparse jacobian only stores the blocks coupling vertices connected by edges
+    # noinspection PyPep8,PyPep8Naming
+    def testSparseJacobianStructure(self):
+        # Arrange
+        k = 0.01
+        model, hw = simulatorLib.setup_original_watergate_example7()
+
+        U = model.initial_state()
+        x = U.reshape(-1) + 0.01
+
+        # Act
+        J = simulatorLib.compute_sparse_jacobian(x, U, k, model, hw)
+        approx_J = simulatorLib.compute_approximate_jacobian(x, U, k, model, hw)
+
+        # Assert
+        self.assertEqual(J.format, 'csr')
+        self.assertLessEqual(model.pattern.num_blocks, model.num_free_vertices + 2 * len(model.E))
+        self.assertLessEqual(J.nnz, 16 * model.pattern.num_blocks)
+        self.assertTrue(np.allclose(J.toarray(), approx_J, 1e-3, 1e-2))
+
+    # Sparse Newton solver reaches the same Backward Euler step as fsolve
+    # noinspection PyPep8,PyPep8Naming
+    def testNewtonSolverMatchesFsolve(self):
+        # Arrange
+        k = 0.01
+        model, hw = simulatorLib.setup_original_watergate_example7()
+
+        U = model.initial_state()
+
+        # Act
+        newton_U, newton_converged, info = simulatorLib.solve_non_linear_system(U, model, hw, k, 'newton')
+        fsolve_U, fsolve_converged, _ = simulatorLib.solve_non_linear_system(U, model, hw, k, 'fsolve')
+        residual = simulatorLib.compute_non_linear_system_function(newton_U.reshape(-1), U, k, model, hw)
+
+        # Assert
+        self.assertTrue(newton_converged)
+        self.assertTrue(fsolve_converged)
+        self.assertGreater(info['iterations'], 0)
+        self.assertEqual(info['njev'], info['iterations'])
+        self.assertLess(np.max(np.abs(residual)), 1e-6)
+        self.assertTrue(np.allclose(newton_U, fsolve_U, 1e-3, 1e-3))
+
+    # Newton solver does not step when no step length decreases the residual
+    # noinspection PyPep8,PyPep8Naming
+    def testNewtonSolverRejectsStepsWithoutSufficientDecrease(self):
+        # Arrange
+        x0 = np.array([1.0, -2.0])
+
+        # Act
+        x, info = solverLib.newton_solve(lambda x: x, lambda x: -sp.sparse.identity(2, format='csc'), x0)
+
+        # Assert
+        self.assertFalse(info['converged'])
+        self.assertEqual(info['message'], 'line search failed')
+        np.testing.assert_array_equal(x, x0)
+        self.assertEqual(info['residual_norm'], 2.0)
+
+    # Chord and Broyden solvers reuse the factorization across steps
+    # noinspection PyPep8,PyPep8Naming
+    def testFactorizationReuseAcrossSteps(self):
+        # Arrange
+        k = 0.01
+        model, hw = simulatorLib.setup_original_watergate_example7()
+
+        U = model.initial_state()
+        newton_U, _, _ = simulatorLib.solve_non_linear_system(U, model, hw, k)
+
+        for mode in ['chord', 'broyden']:
+            reuse = solverLib.FactorizationCache(mode)
+
+            # Act
+            first_U, first_converged, first_info = simulatorLib.solve_non_linear_system(U, model, hw, k, mode, reuse)
+            second_U, second_converged, second_info = simulatorLib.solve_non_linear_system(first_U, model, hw, k, mode,
+                                                                                            reuse)
+
+            # Assert
+            self.assertTrue(first_converged)
+            self.assertTrue(second_converged)
+            self.assertTrue(np.allclose(first_U, newton_U, 1e-4, 1e-4))
+            self.assertEqual(reuse.factorizations, first_info['factorizations'] + second_info['factorizations'])
+            self.assertLess(reuse.factorizations, first_info['iterations'] + second_info['iterations'])
+
+    # Residual and jacobian at the same iterate share a single geometry pass
+    # noinspection PyPep8,PyPep8Naming
+    def testFusedEvaluationSharesGeometry(self):
+        # Arrange
+        k = 0.01
+        model, hw = simulatorLib.setup_original_watergate_example6()
+
+        U = model.initial_state()
+        x = U.reshape(-1) + 0.05
+
+        system = simulatorLib.BackwardEulerSystem(model, U, k, hw)
+
+        # Act
+        residual, J = system.evaluate(x)
+        same_residual = system.function(x.copy())
+        same_J = system.jacobian(x.copy())
+
+        # Assert
+        self.assertEqual(system.geometry_evaluations, 1)
+        self.assertIs(same_J, J)
+        np.testing.assert_array_equal(same_residual, residual)
+        np.testing.assert_array_equal(residual, simulatorLib.compute_non_linear_system_function(x, U, k, model, hw))
+        np.testing.assert_array_equal(J.toarray(), simulatorLib.compute_actual_jacobian(x, U, k, model, hw))
+
+    # Model holds the topology in compact arrays, built once
+    # noinspection PyPep8,PyPep8Naming
+    def testModelPrecomputesTopology(self):
+        # Arrange
+        V, E, VP, EP, EL, VBR = [np.array([[0.0, 0.0], [-1.0, 0.0], [-2.0, 0.0], [-1.3, 0.5], [-0.6, 1.0]]),
+                                 [[1, 3], [0, 1], [2, 3], [3, 4], [1, 2]], [1, 1, 1, 0, 0], [2, 0, 0, 0, 0],
+                                 [0.8, 1.0, 1.0, 1.0, 1.0], [0, 0, 0, 0.1, 0]]
+
+        # Act
+        model = modelLib.SimulationModel(V, E, VP, EP, EL, VBR)
+
+        # Assert
+        np.testing.assert_array_equal(model.E, [[0, 1], [1, 2], [2, 3], [3, 4], [1, 3]])
+        np.testing.assert_array_equal(model.EP, [0, 0, 0, 0, 2])
+        self.assertEqual(model.num_chain_edges, 4)
+        np.testing.assert_array_equal(model.free_vertices, [3, 4])
+        np.testing.assert_array_equal(model.vertex_to_free_vertex, [-1, -1, -1, 0, 1])
+        np.testing.assert_array_equal(model.is_rope, [False, False, False, False, True])
+        np.testing.assert_array_equal(model.gravity, forcesLib.compute_gravity_forces(V, model.E, model.EL))
+        np.testing.assert_array_equal(model.positions(model.initial_state()), V)
+
+    # Chain order is a permutation (with flips) of the input edges, following
+    # the path from the origin
+    # noinspection PyPep8,PyPep8Naming
+    def testChainOrderingPermutation(self):
+        # Arrange
+        V = np.array([[0.0, 0.0], [-1.0, 0.0], [-2.0, 0.0], [-1.3, 0.5], [-0.6, 1.0], [5.0, 5.0]])
+        E = [[3, 2], [1, 3], [4, 3], [0, 1], [2, 1], [5, 5]]
+        EP = [0, 2, 0, 0, 1, 0]
+
+        # Act
+        order, flipped = modelLib.chain_ordering(V, E, EP)
+
+        # Assert
+        np.testing.assert_array_equal(order, [3, 4, 0, 2, 1])
+        np.testing.assert_array_equal(flipped, [False, True, True, True, False])
+
+        ordered = np.array(E)[order]
+        ordered[flipped] = ordered[flipped, ::-1]
+        np.testing.assert_array_equal(ordered[1:4, 0], ordered[0:3, 1])
+        self.assertListEqual(ordered.tolist(), modelLib.pre_ordering_of_edges(V, E, EP, [1.0] * 6)[0])
+
+    # Workspace step damps the velocity columns only, writing in place
+    # noinspection PyPep8,PyPep8Naming
+    def testDampedStepWritesIntoOutput(self):
+        # Arrange
+        k = 0.01
+        model, hw = simulatorLib.setup_original_watergate_example7()
+        workspace = simulatorLib.StepWorkspace(model)
+        random = np.random.RandomState(0)
+        U = random.uniform(-1, 1, (model.num_free_vertices, 4))
+        FU = random.uniform(-1, 1, (model.num_free_vertices, 12))
+        out = np.empty((model.num_free_vertices, 4))
+
+        damped_U = U.copy()
+        damped_FU = FU[:, 0:4].copy()
+        for i in range(0, model.num_free_vertices):
+            damped_U[i, 2:4] *= simulatorLib.damping
+            damped_FU[i, 2:4] *= simulatorLib.damping
+
+        # Act
+        result = workspace.damped_step(U, FU, k, out)
+
+        # Assert
+        self.assertIs(result, out)
+        np.testing.assert_array_equal(out, damped_U + k * damped_FU)
+
+    def testStreamingMatchesFullHistory(self):
+        # Arrange
+        model, hw = simulatorLib.setup_original_watergate_example7()
+        max_iterations = 40
+
+        # Act
+        full = list(simulatorLib.simulate(model, hw, 0.0, 0.0001, max_iterations, batch_duration=1000))
+        streamed = list(simulatorLib.simulate(model, hw, 0.0, 0.0001, max_iterations, batch_duration=1000,
+                                              buffer_steps=8))
+
+        # Assert
+        self.assertEqual(len(full), 1)
+        self.assertGreater(len(streamed), 1)
+        for i in range(0, 3):
+            np.testing.assert_array_equal(np.concatenate([batch[i] for batch in streamed]), full[0][i])
+        self.assertTrue(all(batch[3] == max_iterations for batch in streamed))
+
+    def testUnlimitedRunsUseBoundedRingBuffers(self):
+        # Arrange
+        model, hw = simulatorLib.setup_original_watergate_example7()
+
+        # Act
+        default = simulatorLib.StepBuffer.create(model, None)
+        small = simulatorLib.StepBuffer.create(model, None, buffer_steps=10)
+        whole = simulatorLib.StepBuffer.create(model, 50, buffer_steps=100)
+
+        # Assert
+        self.assertTrue(default.ring and small.ring)
+        self.assertFalse(whole.ring)
+        self.assertEqual(default.U.shape[0], simulatorLib.streaming_buffer_steps)
+        self.assertEqual(small.U.shape[0], 10)
+        self.assertEqual(whole.U.shape[0], 50)
+
+    def testUnlimitedSimulationStreamsBatchesOfTheBuffer(self):
+        # Arrange
+        model, hw = simulatorLib.setup_original_watergate_example7()
+        simulation = simulatorLib.simulate(model, hw, 0.0, 0.0001, None, batch_duration=1000, buffer_steps=10)
+
+        # Act
+        batches = [next(simulation) for _ in range(0, 5)]
+        simulation.close()
+
+        # Assert
+        self.assertEqual([len(batch[0]) for batch in batches], [8] * 5)
+        self.assertEqual(sum(len(batch[0]) for batch in batches), batches[-1][3])
+
 
 def main():
     unittest.main()
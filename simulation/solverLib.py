@@ -0,0 +1,225 @@
+import numpy as np
+from scipy.sparse import linalg
+
+# default tolerances of the Newton solver
+xtol = 1e-5  # relative size of the last step
+ftol = 1e-8  # max norm of the residual
+max_newton_iterations = 50
+armijo = 1e-4  # sufficient decrease parameter of the line search
+min_step_length = 1.0 / 1024
+
+# defaults of the factorization reuse (chord and Broyden modes)
+slowdown_ratio = 0.5  # refactor when the residual shrinks less than this per iteration
+max_broyden_updates = 20
+
+
+# Norm used both for the residual and for the steps
+def max_norm(x):
+    return np.linalg.norm(x, np.inf) if len(x) > 0 else 0.0
+
+
+# Solves the linear system J dx = b through a sparse LU factorization of J.
+# Returns None if J is singular.
+# noinspection PyPep8Naming
+def sparse_solve(J, b):
+    try:
+        lu = linalg.splu(J.tocsc())
+    except RuntimeError:
+        return None
+
+    dx = lu.solve(b)
+    if not np.all(np.isfinite(dx)):
+        return None
+
+    return dx
+
+
+# Keeps the LU factorization of the jacobian alive across Newton iterations
+# and time steps. In 'chord' mode the old factorization is simply reused,
+# while in 'broyden' mode it is corrected after every step by rank-one
+# (good Broyden) updates of its inverse. It is refactored when the
+# convergence slows down, when the active set of the system changes (see
+# signature in newton_solve) or when too many updates piled up.
+class FactorizationCache(object):
+    def __init__(self, mode='chord', slowdown=slowdown_ratio, max_updates=max_broyden_updates):
+        if mode not in ('chord', 'broyden'):
+            raise ValueError("Unknown factorization reuse mode: " + str(mode))
+
+        self.mode = mode
+        self.slowdown = slowdown
+        self.max_updates = max_updates
+
+        self.lu = None
+        self.signature = None
+        self.stale = True
+        self.updates_u = []
+        self.updates_v = []
+
+        # statistics over the whole run
+        self.factorizations = 0
+        self.broyden_updates = 0
+        self.solves = 0
+
+    # Factors the jacobian J, discarding the Broyden updates. Returns False if
+    # J is singular.
+    # noinspection PyPep8Naming
+    def factor(self, J):
+        self.updates_u = []
+        self.updates_v = []
+
+        try:
+            self.lu = linalg.splu(J.tocsc())
+        except RuntimeError:
+            self.lu = None
+            return False
+
+        self.factorizations += 1
+        self.stale = False
+
+        return True
+
+    # Applies the approximated inverse: H b = J0^-1 b + sum u_i (v_i . b)
+    def solve(self, b):
+        self.solves += 1
+        x = self.lu.solve(b)
+        for u, v in zip(self.updates_u, self.updates_v):
+            x += u * np.dot(v, b)
+
+        return x
+
+    # Applies the transposed approximated inverse
+    def solve_transposed(self, b):
+        x = self.lu.solve(b, trans='T')
+        for u, v in zip(self.updates_u, self.updates_v):
+            x += v * np.dot(u, b)
+
+        return x
+
+    # Good Broyden update of the inverse, given the step s and the change of
+    # the residual y along it
+    def update(self, s, y):
+        if len(self.updates_u) >= self.max_updates:
+            self.stale = True
+            return
+
+        Hy = self.solve(y)
+        denominator = np.dot(s, Hy)
+        if abs(denominator) <= 1e-12 * np.linalg.norm(s) * np.linalg.norm(Hy):
+            return
+
+        self.updates_u.append((s - Hy) / denominator)
+        self.updates_v.append(self.solve_transposed(s))
+        self.broyden_updates += 1
+
+
+# Newton's method with backtracking line search for function(x) = 0, where
+# jacobian(x) returns a scipy sparse matrix. Both receive the extra args.
+# If a FactorizationCache is given as reuse, its factorization is used
+# instead of factoring the jacobian at every iteration; the signature
+# identifies the active set of the system (e.g. which edges are wet) and a
+# change of it forces a refactorization.
+# Returns the solution and a dictionary with the number of iterations, of
+# function and jacobian evaluations, of factorizations, whether it converged
+# and why.
+# noinspection PyPep8Naming
+def newton_solve(function, jacobian, x0, args=(), xtol=xtol, ftol=ftol, max_iterations=max_newton_iterations,
+                 reuse=None, signature=None):
+    x = np.array(x0, dtype=float)
+    fx = function(x, *args)
+    residual = max_norm(fx)
+
+    info = {
+        'iterations': 0,
+        'nfev': 1,
+        'njev': 0,
+        'factorizations': 0,
+        'converged': False,
+        'residual_norm': residual,
+        'step_norm': 0.0,
+        'message': ''
+    }
+
+    if reuse is not None and signature is not None and signature != reuse.signature:
+        reuse.signature = signature
+        reuse.stale = True
+
+    for iteration in range(0, max_iterations):
+        if residual <= ftol:
+            info['converged'] = True
+            info['message'] = 'residual below tolerance'
+            break
+
+        fresh = reuse is None or reuse.lu is None or reuse.stale
+        if fresh:
+            J = jacobian(x, *args)
+            info['njev'] += 1
+            info['factorizations'] += 1
+
+            if reuse is None:
+                dx = sparse_solve(J, -fx)
+            else:
+                dx = reuse.solve(-fx) if reuse.factor(J) else None
+        else:
+            dx = reuse.solve(-fx)
+
+        if dx is None or not np.all(np.isfinite(dx)):
+            info['message'] = 'singular jacobian'
+            break
+
+        # backtracking: halve the step until the residual decreases enough,
+        # down to min_step_length
+        t = 1.0
+        while True:
+            x_new = x + t * dx
+            f_new = function(x_new, *args)
+            info['nfev'] += 1
+            new_residual = max_norm(f_new)
+
+            sufficient_decrease = new_residual <= (1.0 - armijo * t) * residual
+            if sufficient_decrease or t <= min_step_length:
+                break
+
+            t /= 2
+
+        info['iterations'] = iteration + 1
+
+        if not np.all(np.isfinite(f_new)):
+            info['message'] = 'residual is not finite'
+            break
+
+        # the step is not taken if even the shortest one does not decrease
+        # the residual enough. An outdated factorization is refactored and
+        # tried again, a fresh one gives up.
+        if not sufficient_decrease:
+            if not fresh:
+                reuse.stale = True
+                continue
+
+            info['message'] = 'line search failed'
+            break
+
+        if reuse is not None:
+            if reuse.mode == 'broyden':
+                reuse.update(t * dx, f_new - fx)
+
+            if t < 1.0 or new_residual > reuse.slowdown * residual:
+                reuse.stale = True
+
+        step = max_norm(t * dx)
+        x = x_new
+        fx = f_new
+        residual = new_residual
+        info['residual_norm'] = residual
+        info['step_norm'] = step
+
+        # as in MINPACK, the relative error between two consecutive iterates.
+        # Only trusted when the line search took the full Newton step
+        if t == 1.0 and step <= xtol * (max_norm(x) + xtol):
+            info['converged'] = True
+            info['message'] = 'step below tolerance'
+            break
+    else:
+        info['converged'] = residual <= ftol
+        info['message'] = 'residual below tolerance' if info['converged'] else 'maximum number of iterations'
+
+    return x, info
@@ -0,0 +1,177 @@
+import forcesLib
+import numpy as np
+import resultsLib
+
+# Accumulators of summary statistics over the steps of a run. They are
+# updated with every emitted batch (see simulatorLib.batch_result) and keep
+# constant memory per vertex or edge, however long the run is. Any object
+# with the two methods below can be plugged into SummaryStatistics:
+#   - update(start, P, F, wl): adds steps start, start + 1, ... with
+#     positions P (steps x num_v x 2), forces F (steps x num_v x 10, see
+#     resultsLib) and water levels wl
+#   - summary(): the statistics so far, as a JSON serializable dictionary
+
+
+# Running maximum, minimum and mean of the magnitude of each force component
+# on each vertex, with the step and water level of each maximum
+# noinspection PyPep8Naming
+class ForceStatistics(object):
+    def __init__(self, model):
+        shape = (model.num_v, len(resultsLib.force_components))
+        self.count = 0
+        self.maximum = np.full(shape, -np.inf)
+        self.minimum = np.full(shape, np.inf)
+        self.total = np.zeros(shape)
+        self.peak_step = np.full(shape, -1, dtype=int)
+        self.peak_water_level = np.full(shape, np.nan)
+
+    # noinspection PyPep8Naming
+    def update(self, start, P, F, wl):
+        if len(wl) == 0:
+            return
+
+        magnitudes = resultsLib.force_magnitudes(F)
+        steps = np.argmax(magnitudes, axis=0)
+        batch_maximum = np.take_along_axis(magnitudes, steps[np.newaxis], axis=0)[0]
+
+        higher = batch_maximum > self.maximum
+        self.maximum[higher] = batch_maximum[higher]
+        self.peak_step[higher] = start + steps[higher]
+        self.peak_water_level[higher] = np.asarray(wl)[steps[higher]]
+
+        np.minimum(self.minimum, magnitudes.min(axis=0), out=self.minimum)
+        self.total += magnitudes.sum(axis=0)
+        self.count += len(wl)
+
+    def mean(self):
+        return self.total / max(self.count, 1)
+
+    # Largest magnitude of a force component over all vertices, as
+    # (magnitude, step, vertex, water level), or None if nothing was seen yet
+    def peak(self, component='total'):
+        c = resultsLib.component_index(component)
+        if self.count == 0:
+            return None
+
+        vertex = int(np.argmax(self.maximum[:, c]))
+
+        return (float(self.maximum[vertex, c]), int(self.peak_step[vertex, c]), vertex,
+                float(self.peak_water_level[vertex, c]))
+
+    def summary(self):
+        seen = self.count > 0
+        return {
+            'steps': self.count,
+            'components': resultsLib.force_components,
+            'maximum': self.maximum.tolist() if seen else [],
+            'minimum': self.minimum.tolist() if seen else [],
+            'mean': self.mean().tolist() if seen else [],
+            'peak_step': self.peak_step.tolist() if seen else [],
+            'peak_water_level': self.peak_water_level.tolist() if seen else [],
+            'peaks': {component: self.peak(component) for component in resultsLib.force_components}
+        }
+
+
+# Running peak and mean of the tension on each rope, with the step and water
+# level of each peak. Ropes only pull when stretched beyond their rest length.
+# noinspection PyPep8Naming
+class RopeTensionStatistics(object):
+    def __init__(self, model):
+        self.ropes = np.nonzero(model.is_rope)[0]
+        self.I = model.I[self.ropes]
+        self.J = model.J[self.ropes]
+        self.L0 = model.L0[self.ropes]
+
+        self.count = 0
+        self.maximum = np.zeros(len(self.ropes))
+        self.total = np.zeros(len(self.ropes))
+        self.peak_step = np.full(len(self.ropes), -1, dtype=int)
+        self.peak_water_level = np.full(len(self.ropes), np.nan)
+
+    # Tension on each rope (steps x ropes) given the positions P
+    # noinspection PyPep8Naming
+    def tensions(self, P):
+        difference_vectors = P[:, self.J] - P[:, self.I]
+        lengths = np.sqrt(difference_vectors[..., 0] ** 2 + difference_vectors[..., 1] ** 2)
+
+        return forcesLib.kappa * np.maximum(lengths - self.L0, 0.0)
+
+    # noinspection PyPep8Naming
+    def update(self, start, P, F, wl):
+        if len(wl) == 0 or len(self.ropes) == 0:
+            self.count += len(wl)
+            return
+
+        tensions = self.tensions(P)
+        steps = np.argmax(tensions, axis=0)
+        batch_maximum = tensions[steps, np.arange(len(self.ropes))]
+
+        higher = (batch_maximum > self.maximum) | (self.peak_step < 0)
+        self.maximum[higher] = batch_maximum[higher]
+        self.peak_step[higher] = start + steps[higher]
+        self.peak_water_level[higher] = np.asarray(wl)[steps[higher]]
+
+        self.total += tensions.sum(axis=0)
+        self.count += len(wl)
+
+    def summary(self):
+        return {
+            'edges': self.ropes.tolist(),
+            'maximum': self.maximum.tolist(),
+            'mean': (self.total / max(self.count, 1)).tolist(),
+            'peak_step': self.peak_step.tolist(),
+            'peak_water_level': self.peak_water_level.tolist()
+        }
+
+
+# Range and last value of the water level
+# noinspection PyPep8Naming
+class WaterLevelStatistics(object):
+    def __init__(self):
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self.last = None
+
+    # noinspection PyPep8Naming
+    def update(self, start, P, F, wl):
+        if len(wl) == 0:
+            return
+
+        self.minimum = min(self.minimum, float(np.min(wl)))
+        self.maximum = max(self.maximum, float(np.max(wl)))
+        self.last = float(wl[-1])
+
+    def summary(self):
+        seen = self.last is not None
+        return {
+            'minimum': self.minimum if seen else None,
+            'maximum': self.maximum if seen else None,
+            'last': self.last
+        }
+
+
+# Set of named accumulators updated together
+# noinspection PyPep8Naming
+class SummaryStatistics(object):
+    def __init__(self, accumulators):
+        self.accumulators = dict(accumulators)
+
+    # Statistics of the forces, rope tensions and water level of model
+    @staticmethod
+    def default(model):
+        return SummaryStatistics({
+            'forces': ForceStatistics(model),
+            'rope_tension': RopeTensionStatistics(model),
+            'water_level': WaterLevelStatistics()
+        })
+
+    def __getitem__(self, name):
+        return self.accumulators[name]
+
+    # noinspection PyPep8Naming
+    def update(self, start, P, F, wl):
+        for accumulator in self.accumulators.values():
+            accumulator.update(start, P, F, wl)
+
+    def summary(self):
+        return {name: accumulator.summary() for name, accumulator in self.accumulators.items()}
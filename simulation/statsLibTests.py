@@ -0,0 +1,76 @@
+import unittest
+
+import forcesLib
+import numpy as np
+import simulatorLib
+import statsLib
+
+
+# noinspection PyPep8Naming
+class StatsLibTests(unittest.TestCase):
+    def testForceStatisticsMatchFullHistory(self):
+        # Arrange
+        model, hw = simulatorLib.setup_original_watergate_example7()
+        random = np.random.RandomState(0)
+        P = random.uniform(-1, 1, (90, model.num_v, 2))
+        F = random.uniform(-1, 1, (90, model.num_v, 10))
+        wl = random.uniform(0, 1, 90)
+        statistics = statsLib.ForceStatistics(model)
+
+        # Act
+        for start in range(0, 90, 25):
+            statistics.update(start, P[start:start + 25], F[start:start + 25], wl[start:start + 25])
+
+        # Assert
+        magnitudes = np.hypot(F[..., 0::2], F[..., 1::2])
+        np.testing.assert_array_equal(statistics.maximum, magnitudes.max(axis=0))
+        np.testing.assert_array_equal(statistics.minimum, magnitudes.min(axis=0))
+        np.testing.assert_allclose(statistics.mean(), magnitudes.mean(axis=0))
+        np.testing.assert_array_equal(statistics.peak_step, np.argmax(magnitudes, axis=0))
+        np.testing.assert_array_equal(statistics.peak_water_level, wl[np.argmax(magnitudes, axis=0)])
+
+        step, vertex = np.unravel_index(np.argmax(magnitudes[..., 3]), magnitudes[..., 3].shape)
+        self.assertEqual(statistics.peak('gravity'), (magnitudes[step, vertex, 3], step, vertex, wl[step]))
+
+    def testRopeTensionPeaks(self):
+        # Arrange
+        model, hw = simulatorLib.setup_original_watergate_example7()
+        rope = np.nonzero(model.is_rope)[0][0]
+        v1, v2 = model.E[rope]
+        P = np.repeat(model.V[np.newaxis], 3, axis=0)
+        P[1, v2] += (model.V[v2] - model.V[v1]) * 0.5
+        P[2, v2] -= (model.V[v2] - model.V[v1]) * 0.5
+        statistics = statsLib.RopeTensionStatistics(model)
+
+        # Act
+        statistics.update(10, P, np.zeros((3, model.num_v, 10)), np.array([1.0, 2.0, 3.0]))
+
+        # Assert
+        summary = statistics.summary()
+        index = summary['edges'].index(rope)
+        length = np.linalg.norm(P[1, v2] - P[1, v1])
+        self.assertAlmostEqual(summary['maximum'][index], forcesLib.kappa * (length - model.L0[rope]))
+        self.assertEqual(summary['peak_step'][index], 11)
+        self.assertEqual(summary['peak_water_level'][index], 2.0)
+
+    def testSimulationBatchesCarryStatistics(self):
+        # Arrange
+        model, hw = simulatorLib.setup_original_watergate_example7()
+
+        # Act
+        batches = list(simulatorLib.simulate(model, hw, 0.0, 0.0001, 40, batch_duration=1000, buffer_steps=10))
+
+        # Assert
+        F = np.concatenate([batch[1] for batch in batches])
+        summary = batches[-1][4]['statistics']
+        self.assertEqual(summary['forces']['steps'], 38)
+        np.testing.assert_array_equal(summary['forces']['maximum'], np.hypot(F[..., 0::2], F[..., 1::2]).max(axis=0))
+        self.assertEqual(summary['water_level']['last'], hw)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
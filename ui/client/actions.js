@@ -1,8 +1,8 @@
-import { edgeTypes, vertexTypes, toSimulationData, fromSimulationData, splitEdge, deleteEdge, parseForcesFromServer, updateEdgeLengths, splitEdgesWithSplitSize, toSimulationResultsData } from 'models'
+import { edgeTypes, vertexTypes, toSimulationData, fromSimulationData, splitEdge, deleteEdge, parseFrameFromServer, parseResultsFromServer, emptySimulationResults, updateEdgeLengths, splitEdgesWithSplitSize, toSimulationResultsData, fromSimulationResultsData } from 'models'
 import { findClosetsPointOnEdge } from './utils/geometry'
 import { isNumber, clone, clamp, floor } from 'lodash'
 import { saveAs } from 'file-saver'
-import socketClient from './socketClient'
+import socketClient, { getSessionToken } from './socketClient'
 import {
   isAddingEdge,
   onFirstVertex,
@@ -10,7 +10,8 @@ import {
   selectedVertexId,
   selectedEdgeId,
   availableSimulationSteps,
-  simulationStep
+  simulationStep,
+  frameOfStep
 } from './selectors'
 
 import { post } from 'axios'
@@ -38,6 +39,7 @@ export const actionTypes = {
   CANCELED: 'CANCELED',
   EDGE_DELETED: 'EDGE_DELETED',
   SIMULATION_STEP_CHANGED: 'SIMULATION_STEP_CHANGED',
+  SIMULATION_JOB_QUEUED: 'SIMULATION_JOB_QUEUED',
   SIMULATION_ENDED: 'SIMULATION_ENDED',
   SHOW_FORCE_TOGGLED: 'SHOW_FORCE_TOGGLED',
   SIMULATION_LOADED: 'SIMULATION_LOADED',
@@ -319,13 +321,22 @@ export const tryDeleteSelectedEdge = () => (dispatch, getState) => {
 
 // Simulation Actions
 
-export const simulationResultsReceived = ({ forces, vertexPositions, waterLevel, totalSteps }) => ({
-  type: actionTypes.SIMULATION_RESULTS_RECEIVED,
-  vertexPositions,
-  forces: parseForcesFromServer(forces),
-  waterLevel,
-  totalSteps
-})
+// results come either as JSON lists or, with the binary transport, in a
+// frame, and are kept as a batch of typed arrays (see resultsBatch).
+// Decimated results give the simulation step of each of their frames as
+// stepIndices
+export const simulationResultsReceived = results => {
+  const { stepIndices, ...batch } = results.frame
+    ? parseFrameFromServer(results.frame)
+    : { ...parseResultsFromServer(results), stepIndices: results.stepIndices }
+
+  return {
+    type: actionTypes.SIMULATION_RESULTS_RECEIVED,
+    batch,
+    steps: stepIndices,
+    totalSteps: results.totalSteps
+  }
+}
 
 const getDataForServer = (edges, verteces, simulationSettings, waterLevel) => {
   const simulationData = toSimulationData(
@@ -352,29 +363,43 @@ export const runSimulation = (simulationSettings, randomSplitVertexPositions) =>
   const { edges, verteces } = splitEdgesWithSplitSize(state.edges, state.verteces, randomSplitVertexPositions)
 
   dispatch(startRunningSimulation({
-    vertexPositions: [],
-    forces: [],
-    waterLevel: [],
+    ...emptySimulationResults,
     edges,
     verteces
   }, simulationSettings))
 
-  post('/simulate', getDataForServer(edges, verteces, simulationSettings, state.waterLevel))
-    .then(() => {
-      dispatch({
-        type: actionTypes.FINISHED_RUNNING_SIMULATION
-      })
+  // the simulation runs in the background as a job of this socket, its end
+  // comes through the socket (see simulationEnded)
+  post('/simulate', {
+    ...getDataForServer(edges, verteces, simulationSettings, state.waterLevel),
+    sessionToken: getSessionToken(),
+    transport: 'binary',
+    precision: 'float32',
+    decimation: { policy: 'fps', fps: 30 }
+  })
+    .then(({ data }) => {
+      if (!data.success) {
+        dispatch(simulationEnded({ failed: true }))
+      } else {
+        dispatch({ type: actionTypes.SIMULATION_JOB_QUEUED, jobId: data.jobId })
+      }
     })
     .catch(() => {
-      dispatch({
-        type: actionTypes.FINISHED_RUNNING_SIMULATION
-      })
-      alert('simulation failed')
+      dispatch(simulationEnded({ failed: true }))
     })
 }
 
-export const cancelSimulation = () => dispatch => {
-  socketClient.emit('cancel')
+export const simulationEnded = ({ failed = false } = {}) => dispatch => {
+  dispatch({
+    type: actionTypes.FINISHED_RUNNING_SIMULATION
+  })
+  if (failed) {
+    alert('simulation failed')
+  }
+}
+
+export const cancelSimulation = () => (dispatch, getState) => {
+  socketClient.emit('cancel', { jobId: getState().simulationStatus.jobId })
   dispatch({ type: actionTypes.CANCELING_SIMULATION })
 }
 
@@ -387,6 +412,11 @@ export const setSimulationStep = newStep => (dispatch, getState) => {
   })
 }
 
+// shows the frame of a simulation step
+export const setSimulationStepNumber = step => (dispatch, getState) => {
+  dispatch(setSimulationStep(frameOfStep(getState(), step)))
+}
+
 export const advanceSimulation = () => (dispatch, getState) => {
   const state = getState()
   const step = simulationStep(state)
@@ -410,7 +440,7 @@ export const setSimulationPercentage = percentage => (dispatch, getState) => {
   const state = getState()
 
   const step = floor(percentage * state.simulationResults.totalSteps)
-  dispatch(setSimulationStep(step))
+  dispatch(setSimulationStep(frameOfStep(state, step)))
 }
 
 export const toggleShowForceType = forceType => ({
@@ -421,7 +451,7 @@ export const toggleShowForceType = forceType => ({
 export const loadSimulationResults = files => dispatch => {
   const reader = new FileReader()
   reader.onload = e => {
-    const simulationResults = JSON.parse(e.target.result)
+    const simulationResults = fromSimulationResultsData(JSON.parse(e.target.result))
     dispatch(startRunningSimulation(simulationResults))
     dispatch({
       type: actionTypes.FINISHED_RUNNING_SIMULATION
@@ -1,16 +1,23 @@
 import React, { Component } from 'react'
-import { map } from 'lodash'
+import { map, keyBy } from 'lodash'
+import { get } from 'axios'
 
 const getFontWeight = (currentScenario, scenario) => (
   scenario === currentScenario ? 'bold': 'default'
 )
 
-const Scenarios = ({ currentScenario, scenarios }) => (
+const describe = summary => (
+  summary ? ` (${summary.vertices} vertices, ${summary.edges} edges, ${summary.buoys} buoys)` : ''
+)
+
+const Scenarios = ({ currentScenario, scenarios, summaries }) => (
   <fieldset style={{width: 400}}>
     <legend>Scenarios</legend>
     <ul>
       {map(scenarios, (scenario, i) => (
-        <li key={i} style={{fontWeight: getFontWeight(currentScenario, scenario)}}><a href={`/?scenario=${scenario}`}>{ scenario }</a></li>
+        <li key={i} style={{fontWeight: getFontWeight(currentScenario, scenario)}}>
+          <a href={`/?scenario=${scenario}`}>{ scenario }</a>{describe(summaries[scenario])}
+        </li>
       ))}
     </ul>
   </fieldset>
@@ -23,10 +30,19 @@ export default class ScenariosContainer extends Component {
 
     this.state = {
       currentScenario: window.scenario,
-      scenarios: window.scenarios
+      scenarios: window.scenarios,
+      summaries: {}
     }
   }
 
+  // the server tags the catalog with an ETag, so the browser only gets it
+  // again when it changed
+  componentDidMount() {
+    get('/scenarios')
+      .then(({ data }) => this.setState({ summaries: keyBy(data.scenarios, 'name') }))
+      .catch(() => {})
+  }
+
   render() {
     return <Scenarios {...this.state} />
   }
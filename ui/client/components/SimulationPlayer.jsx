@@ -90,11 +90,11 @@ class SimulationPlayer extends Component {
   setSimulationPlayTime(newPlayTime) {
     const step = Math.floor(newPlayTime / (this.props.simulationTimeStep * 1000))
 
-    this.props.setSimulationStep(step)
+    this.props.setSimulationStepNumber(step)
   }
 
   get playPercentage() {
-    return this.props.simulationStep / this.props.totalSteps
+    return this.props.simulatedStepNumber / this.props.totalSteps
   }
 
   get playDuration() {
@@ -109,6 +109,7 @@ class SimulationPlayer extends Component {
       runningSimulation,
       totalSteps,
       availableSimulationSteps,
+      availableStepNumber,
       showForces,
       advanceSimulation,
       rewindSimulation,
@@ -126,7 +127,7 @@ class SimulationPlayer extends Component {
         <legend>Simulation Playback</legend>
         <svg style={{width: '100%', height: 10}}>
           <rect width={'100%'} height={10} rx={5} ry={5} fill='#BABABA' />
-          <rect width={toPercentage(availableSimulationSteps / totalSteps)} height={10} rx={5} ry={5} fill='#D8D8D8' />
+          <rect width={toPercentage(availableStepNumber / totalSteps)} height={10} rx={5} ry={5} fill='#D8D8D8' />
           <rect width={toPercentage(this.playPercentage)} height={10} rx={5} ry={5} fill='#FFCC00' />
           <rect width={'100%'} height={10} rx={5} ry={5} opacity={0} onClick={this.simulationBarClicked} style={{cursor: 'pointer'}} />
         </svg>
@@ -182,6 +183,8 @@ const mapStateToProps = state => ({
   runningSimulation: selectors.runningSimulation(state),
   totalSteps: selectors.totalSteps(state),
   availableSimulationSteps: selectors.availableSimulationSteps(state),
+  simulatedStepNumber: selectors.simulatedStepNumber(state),
+  availableStepNumber: selectors.availableStepNumber(state),
   simulationTimeStep: selectors.simulationTimeStep(state),
   showForces: selectors.showForces(state)
 })
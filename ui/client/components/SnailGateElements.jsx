@@ -1,6 +1,6 @@
 import React, { Component } from 'react'
 import { map, round, isNumber } from 'lodash'
-import { edgeTypes, forceColors } from 'models'
+import { edgeTypes, forceColors, forceColumns, forceRowLength } from 'models'
 import { ReactSVGPanZoom } from 'react-svg-pan-zoom'
 import { getCentroid, getNormal, getLength } from '../utils/geometry'
 import { connect } from 'react-redux'
@@ -139,11 +139,13 @@ const getSvgRotation = normalized => toDegrees(Math.acos(dot(normalized, [1, 0])
 
 const forceVisScale = 1/10
 
+// force is the row of forces of the vertex (see forceColumns)
 const Force = ({ origin, force, type }) => {
   const originX = toSvgX(origin[0])
   const originY = toSvgY(origin[1])
-  const length = Math.sqrt(Math.pow(force[0], 2) + Math.pow(force[1], 2))
-  const normalized = [force[0] / length, force[1] / length]
+  const [x, y] = [force[forceColumns[type]], force[forceColumns[type] + 1]]
+  const length = Math.sqrt(Math.pow(x, 2) + Math.pow(y, 2))
+  const normalized = [x / length, y / length]
   const endX = originX + length * forceVisScale
 
   return (
@@ -189,7 +191,7 @@ const Vertex = ({ id, point, boyantRadius = 0, showForces, force, vertexClicked,
         />
       )}
       {force && map(showForces, forceType => (
-        <Force key={forceType} origin={point} force={force[forceType]} type={forceType} />
+        <Force key={forceType} origin={point} force={force} type={forceType} />
       ))}
     </g>
   )
@@ -223,7 +225,7 @@ const Edges = ({edges, verteces, movedVertex, simulatedVertexPositions, edgeClic
 )
 
 const getVertexPoint = (simulatedVertexPositions, vertex, movedVertex, i) => {
-  if (simulatedVertexPositions) return simulatedVertexPositions[i]
+  if (simulatedVertexPositions) return [simulatedVertexPositions[2 * i], simulatedVertexPositions[2 * i + 1]]
   if (movedVertex && movedVertex.id === i) return movedVertex.p
   return vertex.p
 }
@@ -239,7 +241,7 @@ const Verteces = ({ verteces, movedVertex, showForces, vertexClicked, simulatedV
         vertexClicked={vertexClicked}
         vertexHovered={vertexHovered}
         showForces={showForces}
-        force={simulatedForces ? simulatedForces[i] : null}
+        force={simulatedForces ? simulatedForces.subarray(i * forceRowLength, (i + 1) * forceRowLength) : null}
         active={i === firstVertexId || i === hoveredVertexId || i === selectedVertexId}
       />
     ))}
@@ -340,7 +340,10 @@ const Water = ({ verteces, level, edges, simulatedVertexPositions }) => {
             currentVertices.push(verteces[i].p)
         }
     } else {
-        currentVertices = simulatedVertexPositions
+        // the positions of the frame come flattened, x and y of each vertex
+        for (i = 0; i < simulatedVertexPositions.length / 2; i++) {
+            currentVertices.push([simulatedVertexPositions[2 * i], simulatedVertexPositions[2 * i + 1]])
+        }
     }
 
     const origin = getOriginVertex(currentVertices)
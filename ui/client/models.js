@@ -1,6 +1,6 @@
 import { getLength, getNormalizedSlope } from './utils/geometry'
 
-import { map, clone, each, some, range, reduce, includes, filter, isNumber, random, orderBy } from 'lodash'
+import { map, clone, each, some, range, reduce, includes, filter, isNumber, random, orderBy, flatten, flattenDeep, sortedLastIndex } from 'lodash'
 
 export const vertexTypes = {
   notFixed: 0,
@@ -51,20 +51,135 @@ export const fromSimulationData = ({ verteces, edges, vertexTypes, vertexBoyantR
   waterLevel
 })
 
-export const toSimulationResultsData = simulationResults => simulationResults
-
-export const parseForcesFromServer = forcesByStep => (
-  map(forcesByStep, forceStep => (
-    map(forceStep, force => ({
-      [forceTypes.total]: [force[0], force[1]],
-      [forceTypes.waterPressure]: [force[2], force[3]],
-      [forceTypes.tensor]: [force[4], force[5]],
-      [forceTypes.gravity]: [force[6], force[7]],
-      [forceTypes.boyancy]: [force[8], force[9]]
-    }))
-  ))
+// columns of each force type in the rows of forces of the results, the x
+// and then the y component
+export const forceColumns = {
+  [forceTypes.total]: 0,
+  [forceTypes.waterPressure]: 2,
+  [forceTypes.tensor]: 4,
+  [forceTypes.gravity]: 6,
+  [forceTypes.boyancy]: 8
+}
+
+export const forceRowLength = 10
+
+// Simulation results are kept as the batches they come in, each with typed
+// arrays of its frames: vertexPositions [frames][vertices][2], forces
+// [frames][vertices][forceRowLength] and waterLevel [frames], flattened.
+// Frames are looked up through batchStarts, the first frame of each batch
+export const emptySimulationResults = {
+  batches: [],
+  batchStarts: [],
+  frames: 0,
+  steps: [],
+  totalSteps: 0
+}
+
+export const resultsBatch = (vertexPositions, forces, waterLevel) => ({
+  vertexPositions,
+  forces,
+  waterLevel,
+  frames: waterLevel.length,
+  numVertices: waterLevel.length > 0 ? vertexPositions.length / (2 * waterLevel.length) : 0
+})
+
+export const appendResultsBatch = (results, batch) => ({
+  ...results,
+  batches: [...results.batches, batch],
+  batchStarts: [...results.batchStarts, results.frames],
+  frames: results.frames + batch.frames
+})
+
+// batch holding a frame of the results and the frame within it
+export const findFrame = ({ batches, batchStarts, frames }, frame) => {
+  if (!(frame >= 0 && frame < frames)) return
+
+  const index = sortedLastIndex(batchStarts, frame) - 1
+  return { batch: batches[index], offset: frame - batchStarts[index] }
+}
+
+// rows of a frame of an array of the batches, without copying them
+export const frameRows = (values, { batch, offset }, rowLength) => (
+  values.subarray(offset * batch.numVertices * rowLength, (offset + 1) * batch.numVertices * rowLength)
+)
+
+// batch of results as they come in JSON messages, lists nested by step and
+// vertex
+export const parseResultsFromServer = ({ vertexPositions, forces, waterLevel }) => resultsBatch(
+  Float64Array.from(flattenDeep(vertexPositions)),
+  Float64Array.from(flattenDeep(forces)),
+  Float64Array.from(waterLevel)
 )
 
+// results in files keep their batches as lists
+export const toSimulationResultsData = simulationResults => ({
+  ...simulationResults,
+  batches: map(simulationResults.batches, batch => ({
+    ...batch,
+    vertexPositions: Array.from(batch.vertexPositions),
+    forces: Array.from(batch.forces),
+    waterLevel: Array.from(batch.waterLevel)
+  }))
+})
+
+// Files saved before results were kept in batches have a list per step of
+// positions and of forces by type
+const fromOlderSimulationResultsData = ({ vertexPositions = [], forces = [], waterLevel = [], ...simulationResults }) => {
+  const forceRows = map(forces, forceStep => (
+    map(forceStep, force => flatten(map(forceTypes, forceType => force[forceType])))
+  ))
+
+  return appendResultsBatch(
+    { ...emptySimulationResults, ...simulationResults },
+    parseResultsFromServer({ vertexPositions, forces: forceRows, waterLevel })
+  )
+}
+
+export const fromSimulationResultsData = simulationResultsData => {
+  if (!simulationResultsData.batches) return fromOlderSimulationResultsData(simulationResultsData)
+
+  return reduce(simulationResultsData.batches, (results, batch) => appendResultsBatch(results, resultsBatch(
+    Float64Array.from(batch.vertexPositions),
+    Float64Array.from(batch.forces),
+    Float64Array.from(batch.waterLevel)
+  )), { ...simulationResultsData, batches: [], batchStarts: [], frames: 0 })
+}
+
+// Binary frames of simulation batches (see simulation/framesLib.py): magic,
+// little endian uint32 header length, JSON header and then the arrays, which
+// are wrapped in typed arrays as they are
+const frameMagic = 'SGB1'
+const frameArrayTypes = {
+  float32: Float32Array,
+  float64: Float64Array
+}
+
+export const decodeFrame = frame => {
+  const bytes = new Uint8Array(frame)
+  const magic = String.fromCharCode(...bytes.subarray(0, 4))
+  if (magic !== frameMagic) {
+    throw new Error('Not a simulation frame')
+  }
+
+  const headerLength = new DataView(frame).getUint32(4, true)
+  const header = JSON.parse(new TextDecoder().decode(bytes.subarray(8, 8 + headerLength)))
+  const ArrayType = frameArrayTypes[header.dtype]
+
+  const arrays = reduce(header.arrays, (arrays, { name, shape, offset }) => ({
+    ...arrays,
+    [name]: new ArrayType(frame, offset, reduce(shape, (size, length) => size * length, 1))
+  }), {})
+
+  return { header, ...arrays }
+}
+
+// batch of results of a frame
+export const parseFrameFromServer = frame => {
+  const { header, vertexPositions, forces, waterLevel } = decodeFrame(frame)
+
+  return { ...resultsBatch(vertexPositions, forces, waterLevel), stepIndices: header.stepIndices }
+}
+
 export const splitEdge = (edges, verteces, vertexIdToSplitOn, edgeIdToSplit) => {
   const splitEdges = clone(edges)
 
@@ -1,6 +1,7 @@
 import { actionTypes } from './actions'
-import { vertexTypes, forceTypes, toggleShowForce } from 'models'
+import { vertexTypes, forceTypes, toggleShowForce, emptySimulationResults, appendResultsBatch } from 'models'
 import { combineReducers } from 'redux'
+import { last, range } from 'lodash'
 
 const initialVertecesState = [
   {
@@ -114,6 +115,12 @@ const simulationStatus = (state = {}, action) => {
       cancelingSimulation: true
     }
 
+  case actionTypes.SIMULATION_JOB_QUEUED:
+    return {
+      ...state,
+      jobId: action.jobId
+    }
+
   case actionTypes.CHANGE_SIMULATION_STEP:
     return {
       ...state,
@@ -144,11 +151,13 @@ const simulationStatus = (state = {}, action) => {
   }
 }
 
-const initialSimulationResultsState = {
-  vertexPositions: [],
-  forces: [],
-  waterLevel: 0,
-  totalSteps: 0
+const initialSimulationResultsState = emptySimulationResults
+
+// steps of the frames of results without their step indices: the ones
+// following the last frame
+const followingSteps = (steps = [], count) => {
+  const first = steps.length > 0 ? last(steps) + 1 : 0
+  return range(first, first + count)
 }
 
 const simulationResults = (state = initialSimulationResultsState, action) => {
@@ -158,18 +167,10 @@ const simulationResults = (state = initialSimulationResultsState, action) => {
 
   case actionTypes.SIMULATION_RESULTS_RECEIVED:
     return {
-      ...state,
-      vertexPositions: [
-        ...state.vertexPositions,
-        ...action.vertexPositions
-      ],
-      forces: [
-        ...state.forces,
-        ...action.forces
-      ],
-      waterLevel: [
-        ...state.waterLevel,
-        ...action.waterLevel
+      ...appendResultsBatch(state, action.batch),
+      steps: [
+        ...(state.steps || []),
+        ...(action.steps || followingSteps(state.steps, action.batch.frames))
       ],
       totalSteps: action.totalSteps
     }
@@ -1,8 +1,10 @@
-import { isNumber } from 'lodash'
+import { isNumber, sortedIndex, clamp } from 'lodash'
+import { findFrame, frameRows, forceRowLength } from 'models'
 
 export const waterLevel = state => {
-  if (isSimulating(state))
-    return state.simulationResults.waterLevel[simulationStep(state)] || state.waterLevel
+  const frame = isSimulating(state) && findFrame(state.simulationResults, simulationStep(state))
+  if (frame)
+    return frame.batch.waterLevel[frame.offset] || state.waterLevel
   return state.waterLevel
 }
 
@@ -16,7 +18,7 @@ export const verteces = state => {
 export const availableSimulationSteps = state => {
   if (!isSimulating(state)) return
 
-  return state.simulationResults.vertexPositions.length
+  return state.simulationResults.frames
 }
 
 export const totalSteps = state => {
@@ -25,16 +27,22 @@ export const totalSteps = state => {
   return state.simulationResults.totalSteps
 }
 
+// positions of the vertices at the current frame, x and y of each vertex in
+// turn
 export const simulatedVertexPositions = state => {
   if (!isSimulating(state)) return
 
-  return state.simulationResults.vertexPositions[simulationStep(state)]
+  const frame = findFrame(state.simulationResults, simulationStep(state))
+  return frame && frameRows(frame.batch.vertexPositions, frame, 2)
 }
 
+// forces on the vertices at the current frame, a row of forceRowLength
+// values per vertex (see forceColumns)
 export const simulatedForces = state => {
   if (!isSimulating(state)) return
 
-  return state.simulationResults.forces[simulationStep(state)]
+  const frame = findFrame(state.simulationResults, simulationStep(state))
+  return frame && frameRows(frame.batch.forces, frame, forceRowLength)
 }
 
 export const isAddingEdge = ({ addMode }) => addMode.adding
@@ -85,3 +93,31 @@ export const simulationTimeStep = ({ simulationStatus }) => simulationStatus.tim
 export const isSimulating = playingSimulation
 
 export const isEditing = state => !isSimulating(state)
+
+// simulation step of a frame of the results: frames skip steps when the
+// server decimates them. Results without steps (e.g. loaded from older
+// files) have a frame per step
+export const stepOfFrame = (state, frame) => {
+  const { steps } = state.simulationResults
+  return steps && frame < steps.length ? steps[frame] : frame
+}
+
+// frame showing a simulation step, the first one at or after it
+export const frameOfStep = (state, step) => {
+  const { steps } = state.simulationResults
+  if (!steps || steps.length === 0) return step
+
+  return clamp(sortedIndex(steps, step), 0, steps.length - 1)
+}
+
+export const simulatedStepNumber = state => {
+  if (!isSimulating(state)) return
+
+  return stepOfFrame(state, simulationStep(state))
+}
+
+export const availableStepNumber = state => {
+  if (!isSimulating(state)) return
+
+  return stepOfFrame(state, availableSimulationSteps(state) - 1) + 1
+}
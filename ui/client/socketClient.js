@@ -5,4 +5,10 @@ const socketClient = socket('http://localhost:5000')
 socketClient.on('connect', () => { console.log('connected') })
 socketClient.on('disconnect', () => { console.log('disconnect') })
 
+// token of this session, given by the server on every connection: requests
+// over HTTP send it to act on behalf of the session (e.g. /simulate)
+let sessionToken = null
+socketClient.on('session', ({ token }) => { sessionToken = token })
+export const getSessionToken = () => sessionToken
+
 export default socketClient
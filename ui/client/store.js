@@ -1,7 +1,7 @@
 import { createStore, applyMiddleware, compose } from 'redux'
 import thunk from 'redux-thunk'
 import reducers from './reducers'
-import { simulationResultsReceived } from './actions'
+import { simulationResultsReceived, simulationEnded } from './actions'
 import socketClient from './socketClient'
 
 const composeEnhancers = window.__REDUX_DEVTOOLS_EXTENSION_COMPOSE__ || compose
@@ -9,8 +9,25 @@ const store = createStore(reducers, composeEnhancers(
   applyMiddleware(thunk)
 ))
 
+// messages of jobs other than the current one (e.g. a canceled one still
+// finishing its batch) are dropped. The job id is not known until /simulate
+// answers, so nothing is dropped before that
+const isCurrentJob = ({ jobId }) => {
+  const currentJobId = store.getState().simulationStatus.jobId
+  return !currentJobId || currentJobId === jobId
+}
+
+// every batch is acknowledged once handled, the server holds the next ones
+// of the job until then
 socketClient.on('results', results => {
-  store.dispatch(simulationResultsReceived(results))
+  if (isCurrentJob(results)) {
+    store.dispatch(simulationResultsReceived(results))
+  }
+  socketClient.emit('received', { jobId: results.jobId })
 })
 
+socketClient.on('finished', message => isCurrentJob(message) && store.dispatch(simulationEnded()))
+socketClient.on('canceled', message => isCurrentJob(message) && store.dispatch(simulationEnded()))
+socketClient.on('failed', message => isCurrentJob(message) && store.dispatch(simulationEnded({ failed: true })))
+
 export default store
@@ -1,15 +1,22 @@
+import hashlib
+import hmac
 import os
+import secrets
 import sys
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'simulation'))
 
-import json
+import tempfile
 
+import cacheLib
+import catalogLib
 import eventlet
-import simulatorLib
-from flask import Flask, jsonify, render_template, request
+import jobsLib
+import logLib
+import resultsLib
+from flask import Flask, Response, jsonify, render_template, request, send_file
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
 
 app = Flask(__name__)
 
@@ -19,78 +26,256 @@ CORS(app, resources={r'/*': {'origins': '*'}})
 
 scenariosDirectory = os.path.join(os.path.dirname(__file__), '..', '..', 'scenarios')
 
+# the scenarios are indexed once and then only re-read when they change
+scenarioCatalog = catalogLib.ScenarioCatalog(scenariosDirectory)
+
+# Simulations run in a pool of worker processes (see jobsLib), as many as
+# SIMULATION_WORKERS (by default one per core), and at most
+# MAX_SIMULATION_JOBS of them at once (by default one per worker); the rest
+# wait in a queue. Their messages are forwarded by a background task to the
+# Socket.IO room of each job, which the client that asked for it joins. At
+# most MAX_BATCHES_IN_FLIGHT (by default 2) batches of a job go out before
+# the client acknowledges them; until it does, the job pauses. Results of
+# finished simulations are cached in RESULT_CACHE_DIRECTORY, up to
+# RESULT_CACHE_BYTES, and identical requests are replayed from there.
+simulationWorkers = int(os.environ['SIMULATION_WORKERS']) if 'SIMULATION_WORKERS' in os.environ else None
+maxSimulationJobs = int(os.environ['MAX_SIMULATION_JOBS']) if 'MAX_SIMULATION_JOBS' in os.environ else None
+maxBatchesInFlight = int(os.environ.get('MAX_BATCHES_IN_FLIGHT', 2))
+resultCache = cacheLib.ResultCache(os.environ.get('RESULT_CACHE_DIRECTORY', cacheLib.default_cache_directory),
+                                   int(os.environ.get('RESULT_CACHE_BYTES', cacheLib.default_max_bytes)))
+simulationPool = None
+deliveries = jobsLib.DeliveryWindow(maxBatchesInFlight)
+
+# Socket sessions by the secret token each gets when it connects (see
+# connect), and the other way around. HTTP requests act on behalf of a
+# session by sending its token: a session id alone is no proof of being it.
+sessionsByToken = {}
+tokensBySession = {}
+
 @app.route('/')
 def home():
-    scenarios = os.listdir(scenariosDirectory)
+    scenarios = scenarioCatalog.names()
     scenario = request.args.get('scenario')
     scenarioJson = {}
 
     if scenario is not None:
-        filePath = os.path.join(scenariosDirectory, scenario)
-        print('loading json at', filePath)
-        with open(filePath) as dataFile:
-            scenarioJson = json.load(dataFile)
-        print('loaded it')
+        entry = scenarioCatalog.lookup(scenario)
+        if entry is not None:
+            scenarioJson = entry.scenario
 
     static_js = os.environ['STATIC_JS'] == 'true' if 'STATIC_JS' in os.environ else False
 
     return render_template('index.html', scenarios=scenarios, scenario=scenario, scenarioJson=scenarioJson, static_js=static_js)
 
-def emitBatch(U, F, wl, totalSteps):
-    jsonResult = {
-        'vertexPositions': U.tolist(),
-        'forces': F.tolist(),
-        'waterLevel': wl.tolist(),
-        'totalSteps': totalSteps
-    }
+# Responds with data tagged with etag, or with 304 Not Modified if the
+# client already has it. Clients revalidate it on every use.
+def conditionalJson(etag, **data):
+    response = jsonify(**data)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+
+    return response.make_conditional(request)
 
-    socketio.emit('results', jsonResult)
+# Names and summaries (vertex, edge and buoy counts, content hash) of the
+# scenarios
+@app.route('/scenarios', methods=['GET'])
+def scenarios():
+    listing = scenarioCatalog.listing()
+    return conditionalJson(scenarioCatalog.listing_etag, success=True, scenarios=listing)
 
+@app.route('/scenarios/<name>', methods=['GET'])
+def scenario(name):
+    entry = scenarioCatalog.lookup(name)
+    if entry is None:
+        return jsonify(success=False, message='Unknown scenario'), 404
 
-simulatorCanceled = False
+    return conditionalJson(entry.etag, success=True, metadata=entry.metadata, scenario=entry.scenario)
+
+def getSimulationPool():
+    global simulationPool
+    if simulationPool is None:
+        simulationPool = jobsLib.SimulationPool(simulationWorkers, max_concurrent_jobs=maxSimulationJobs,
+                                                cache=resultCache)
+        socketio.start_background_task(forwardSimulationMessages)
+
+    return simulationPool
+
+# Batches of the jobs go out as 'results' events, their progress as 'queued'
+# (with the position in the queue) and 'started', and their end as
+# 'finished', 'canceled' or 'failed', all tagged with the job id and only to
+# the room of the job
+# Binary frames of the results (see jobsLib.batch_message) go as binary
+# attachments of the message
+def emitMessage(event, jobId, payload):
+    if event == 'results':
+        socketio.emit('results', dict(payload, jobId=jobId), to=jobId)
+    else:
+        socketio.emit(event, {'jobId': jobId, 'message': payload}, to=jobId)
 
+def forwardSimulationMessages():
+    while True:
+        messages = simulationPool.poll(credits=deliveries.credits)
+        for event, jobId, payload in messages:
+            if event == 'results':
+                deliveries.sent(jobId)
+            elif event in ('finished', 'canceled', 'failed'):
+                deliveries.forget(jobId)
+            emitMessage(event, jobId, payload)
+        socketio.sleep(0 if len(messages) > 0 else 0.02)
+
+# Queues the simulation and returns its job id right away. The job belongs to
+# the socket session whose token the request sends as sessionToken, which
+# joins the room of the job: nobody can have the results of a job sent to,
+# or cancel it for, another client.
 @app.route('/simulate', methods=['POST'])
 def simulate():
-    print('parsing json')
-    postBody = request.get_json()
+    postBody = request.get_json(silent=True)
+    if not isinstance(postBody, dict):
+        return jsonify(success=False, message='Expected a simulation request'), 400
+
+    socketId = sessionsByToken.get(postBody.get('sessionToken'))
+    if socketId is None:
+        return jsonify(success=False, message='Unknown socket session'), 403
 
-    print(postBody)
+    try:
+        jobId = getSimulationPool().submit(postBody, owner=socketId)
+    except ValueError as error:
+        return jsonify(success=False, message=str(error)), 400
 
-    V, E, VP, EP, EL, hw, VBR, water_speed, timeStep, maxIterations, simulationMethod = simulatorLib.from_json(postBody)
+    join_room(jobId, sid=socketId, namespace='/')
+    logLib.default_logger.info('simulation_queued', jobId=jobId)
 
-    method = None
-    batchDuration = None
+    return jsonify(success=True, jobId=jobId)
+
+# Cancels the job given as jobId, or all the jobs of the client
+@socketio.on('cancel')
+def cancelSimulation(data=None):
+    if simulationPool is None:
+        return
 
-    if (simulationMethod == "Forward Euler"):
-        method = simulatorLib.simulate
-        batchDuration = 0.5
-    elif (simulationMethod == "Backward Euler"):
-        method = simulatorLib.implicit_simulation
-        batchDuration = 1
+    jobId = data.get('jobId') if isinstance(data, dict) else None
+    if jobId is not None:
+        simulationPool.cancel(jobId, owner=request.sid)
     else:
-        return jsonify(success=False)
+        simulationPool.cancel_all(owner=request.sid)
 
-    print('Running simulation!')
-    global simulatorCanceled
-    for U, F, wl, totalSteps in method(V, E, VP, EP, EL, VBR, hw, water_speed, timeStep, maxIterations, batchDuration):
-        emitBatch(U, F, wl, totalSteps)
-        socketio.sleep(1.0/10000.0)
-        if simulatorCanceled:
-            simulatorCanceled=False
-            break
+# The client acknowledges every batch of results it handled
+@socketio.on('received')
+def resultsReceived(data=None):
+    if isinstance(data, dict) and data.get('jobId') is not None:
+        deliveries.acknowledged(data['jobId'])
 
-    return jsonify(
-        success=True,
-    )
+# REST API of the jobs, for scripts and dashboards that do not keep a socket
+# open. Jobs submitted through it are not streamed: their status and progress
+# are polled, and their stored results read page by page (at most
+# maxResultsPageSteps steps each) or downloaded whole, as often as needed.
+# Each job is only reachable with the token returned when it was submitted
+# (an HMAC of its id), sent as the X-Job-Token header or the token argument:
+# clients cannot see or cancel each other's jobs, nor the ones of the
+# sockets. Tokens outlive the server if JOB_TOKEN_SECRET is set.
+restOwner = 'rest'
+maxResultsPageSteps = 10000
+jobTokenSecret = os.environ.get('JOB_TOKEN_SECRET', secrets.token_hex(32)).encode('utf-8')
 
-@socketio.on('cancel')
-def cancelSimulation():
-    global simulatorCanceled
-    simulatorCanceled=True
+def jobToken(jobId):
+    return hmac.new(jobTokenSecret, jobId.encode('utf-8'), hashlib.sha256).hexdigest()
+
+def hasJobToken(jobId):
+    token = request.headers.get('X-Job-Token', request.args.get('token', ''))
+    return hmac.compare_digest(token.encode('utf-8'), jobToken(jobId).encode('utf-8'))
+
+@app.route('/jobs', methods=['POST'])
+def submitJob():
+    postBody = request.get_json(silent=True)
+    if not isinstance(postBody, dict):
+        return jsonify(success=False, message='Expected a simulation request'), 400
 
-@socketio.on('connect')  # to check connection
+    try:
+        jobId = getSimulationPool().submit(postBody, owner=restOwner, stream=False)
+    except ValueError as error:
+        return jsonify(success=False, message=str(error)), 400
+
+    return jsonify(success=True, jobId=jobId, token=jobToken(jobId)), 202
+
+@app.route('/jobs/<jobId>', methods=['GET'])
+def jobStatus(jobId):
+    status = getSimulationPool().status(jobId) if hasJobToken(jobId) else None
+    if status is None:
+        return jsonify(success=False, message='Unknown job'), 404
+
+    return jsonify(success=True, **status)
+
+@app.route('/jobs/<jobId>', methods=['DELETE'])
+def cancelJob(jobId):
+    if not hasJobToken(jobId) or not getSimulationPool().cancel(jobId, owner=restOwner):
+        return jsonify(success=False, message='Unknown or ended job'), 404
+
+    return jsonify(success=True)
+
+# Steps [start, end) of the results of a job (by default from the first one,
+# at most limit of them), as JSON or, with format=binary, as a frame of the
+# given precision (see framesLib). X-Next-Start tells where the next page
+# starts, if any.
+@app.route('/jobs/<jobId>/results', methods=['GET'])
+def jobResults(jobId):
+    pool = getSimulationPool()
+    if not hasJobToken(jobId) or pool.status(jobId) is None:
+        return jsonify(success=False, message='Unknown job'), 404
+
+    transport = request.args.get('format', 'json')
+    precision = request.args.get('precision', jobsLib.default_precision)
+    try:
+        transport, precision = jobsLib.batch_transport({'transport': transport, 'precision': precision})
+        limit = min(request.args.get('limit', jobsLib.default_page_steps, type=int), maxResultsPageSteps)
+        page = jobsLib.results_page(pool.results_path(jobId), request.args.get('start', 0, type=int),
+                                    request.args.get('end', None, type=int), limit, transport, precision)
+    except ValueError as error:
+        return jsonify(success=False, message=str(error)), 400
+    except FileNotFoundError:
+        return jsonify(success=False, message='No results yet'), 404
+
+    if transport == 'binary':
+        headers = {'X-Stored-Steps': str(page['storedSteps'])}
+        if page['next'] is not None:
+            headers['X-Next-Start'] = str(page['next'])
+        return Response(page['frame'], mimetype='application/octet-stream', headers=headers)
+
+    return jsonify(success=True, jobId=jobId, **page)
+
+# The whole stored results of a job, as a zip archive (see
+# resultsLib.archive_results)
+@app.route('/jobs/<jobId>/results.zip', methods=['GET'])
+def downloadJobResults(jobId):
+    pool = getSimulationPool()
+    if not hasJobToken(jobId) or pool.status(jobId) is None or not os.path.exists(pool.results_path(jobId)):
+        return jsonify(success=False, message='No results'), 404
+
+    archive = tempfile.TemporaryFile()
+    try:
+        resultsLib.archive_results(pool.results_path(jobId), archive)
+    except (OSError, ValueError):
+        archive.close()
+        return jsonify(success=False, message='No results'), 404
+    archive.seek(0)
+
+    return send_file(archive, mimetype='application/zip', as_attachment=True,
+                     attachment_filename=jobId + '.zip')
+
+# Every session gets the token its HTTP requests send (see simulate)
+@socketio.on('connect')
 def connect():
     print('connected')
+    token = secrets.token_hex(16)
+    sessionsByToken[token] = request.sid
+    tokensBySession[request.sid] = token
+    emit('session', {'token': token})
+
+# Nobody is left to watch the jobs of a client that leaves
+@socketio.on('disconnect')
+def disconnect():
+    sessionsByToken.pop(tokensBySession.pop(request.sid, None), None)
+    if simulationPool is not None:
+        simulationPool.cancel_all(owner=request.sid)
 
 if __name__ == '__main__':
     socketio.run(app)